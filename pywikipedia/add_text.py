@@ -246,16 +246,28 @@ Match was: %s''' % result)
                                                      categoriesInside, site,
                                                      True)
             # Dealing the stars' issue
-            allstars = []
+            starsR = re.compile(u'(?:template:|)(?:%s)$' % u'|'.join(starsList),
+                                re.I)
+
+            def isStar(template):
+                return len(template.parts) > 1 and \
+                       starsR.match(template.name())
             starstext = pywikibot.removeDisabledParts(text)
-            for star in starsList:
-                regex = re.compile('(\{\{(?:template:|)%s\|.*?\}\}[\s]*)'
-                                   % star, re.I)
-                found = regex.findall(starstext)
-                if found != []:
-                    newtext = regex.sub('', newtext)
-                    allstars += found
+            allstars = [template.wikitext() for template
+                        in pywikibot.parse_templates(starstext)
+                        if isStar(template)]
             if allstars != []:
+                # remove the stars with the whitespace behind them
+                pieces = []
+                last = 0
+                for template in pywikibot.parse_templates(newtext):
+                    if template.start >= last and isStar(template):
+                        pieces.append(newtext[last:template.start])
+                        last = template.end
+                        while last < len(newtext) and newtext[last].isspace():
+                            last += 1
+                pieces.append(newtext[last:])
+                newtext = u''.join(pieces)
                 newtext = newtext.strip() + '\r\n\r\n'
                 allstars.sort()
                 for element in allstars:
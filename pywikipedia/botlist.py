@@ -75,7 +75,7 @@ def refresh(site, sysop=False, witheditsonly=True):
     pywikibot.output(u'Retrieving bot user list for %s via API.' % repr(site))
     botlist = []
     while True:
-        pywikibot.get_throttle()
+        pywikibot.get_throttle(site=site)
         data = pywikibot.query.GetData(params, site, sysop=sysop)
         if 'error' in data:
             raise RuntimeError('ERROR: %s' % data)
@@ -96,7 +96,7 @@ def refresh(site, sysop=False, witheditsonly=True):
     else:
         PATTERN = u'<li>(.*?) *\((.*?),\s(.*?)\)</li>'
     while m1:
-        pywikibot.get_throttle()
+        pywikibot.get_throttle(site=site)
         text = site.getUrl(site.globalusers_address(offset=urllib.quote(offset), group='Global_bot'))
 
         m1 = re.findall(u'<li>.*?</li>', text)
@@ -42,6 +42,10 @@ Options for "move" action:
 
 Options for several actions:
  * -rebuild     - reset the database
+ * -xml:        - Fill the database with the category links found in an XML
+                  dump, then use it without updates from the wiki (for the
+                  tidy, tree and listify actions). Categories added by
+                  templates are not found in the dump.
  * -from:       - The category to move from (for the move option)
                   Also, the category to remove from in the remove option
                   Also, the category to make a list of in the listify option
@@ -63,9 +67,9 @@ Options for several actions:
                   move and remove actions).
 
 For the actions tidy and tree, the bot will store the category structure
-locally in category.dump. This saves time and server load, but if it uses
-these data later, they may be outdated; use the -rebuild parameter in this
-case.
+locally in category.db. This saves time and server load; at the next run,
+only the categories of the pages changed in the meantime are updated. Use
+the -rebuild parameter to load all categories again.
 
 For example, to create a new category from a list of persons, type:
 
@@ -96,9 +100,9 @@ __version__ = '$Id$'
 # Distributed under the terms of the MIT license.
 #
 
-import os, re, pickle, bz2
+import os, re
 import wikipedia as pywikibot
-import catlib, config, pagegenerators
+import catlib, config, pagegenerators, query
 from pywikibot import i18n
 
 # This is required for the text that is shown when you run this script
@@ -121,107 +125,398 @@ cfd_templates = {
 
 
 class CategoryDatabase:
-    '''This is a temporary knowledge base saving for each category the contained
+    '''This is a knowledge base saving for each category the contained
     subcategories and articles, so that category pages do not need to be loaded
     over and over again
 
+    The data is kept in an sqlite database, so it is not loaded at startup
+    and survives between runs. When a wiki is used for the first time in a
+    run, the pages changed since the last run are taken from its recent
+    changes and only the memberships of these pages are updated.
+
     '''
-    def __init__(self, rebuild = False, filename = 'category.dump.bz2'):
+    # if more pages have changed since the last run, the known categories
+    # are listed again when needed instead of asking for the categories of
+    # every changed page
+    maxChanges = 1000
+
+    def __init__(self, rebuild = False, filename = 'category.db',
+                 autoRefresh = True):
+        import sqlite3
+        if not os.path.isabs(filename):
+            filename = pywikibot.config.datafilepath(filename)
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = unicode
+        # the newest recent change of each wiki which is known
+        self.db.execute('CREATE TABLE IF NOT EXISTS sites ('
+                        'site TEXT PRIMARY KEY, timestamp TEXT)')
+        # the categories whose members or supercategories are known, with
+        # the time of the latest recent change when they were listed
+        self.db.execute('CREATE TABLE IF NOT EXISTS categories ('
+                        'site TEXT, title TEXT, listed TEXT, '
+                        'superlisted TEXT, PRIMARY KEY (site, title))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS members ('
+                        'site TEXT, category TEXT, title TEXT, ns INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS members_category '
+                        'ON members (site, category)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS members_title '
+                        'ON members (site, title)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS supercats ('
+                        'site TEXT, category TEXT, supercat TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS supercats_category '
+                        'ON supercats (site, category)')
+        # wikis which have been refreshed in this run
+        self.refreshed = set()
+        # if False, the data is used as it is without recent changes
+        self.autoRefresh = autoRefresh
         if rebuild:
             self.rebuild()
-        else:
-            try:
-                if not os.path.isabs(filename):
-                    filename = pywikibot.config.datafilepath(filename)
-                f = bz2.BZ2File(filename, 'r')
-                pywikibot.output(u'Reading dump from %s'
-                                 % pywikibot.config.shortpath(filename))
-                databases = pickle.load(f)
-                f.close()
-                # keys are categories, values are 2-tuples with lists as entries.
-                self.catContentDB = databases['catContentDB']
-                # like the above, but for supercategories
-                self.superclassDB = databases['superclassDB']
-                del databases
-            except:
-                # If something goes wrong, just rebuild the database
-                self.rebuild()
 
     def rebuild(self):
-        self.catContentDB={}
-        self.superclassDB={}
+        for table in ('sites', 'categories', 'members', 'supercats'):
+            self.db.execute('DELETE FROM %s' % table)
+        self.db.commit()
+        self.refreshed = set()
+
+    def _timestamp(self, site):
+        """Return the timestamp of the newest known change of site."""
+        key = site.sitename()
+        if key not in self.refreshed and self.autoRefresh:
+            self.refreshed.add(key)
+            self.refresh(site)
+        row = self.db.execute('SELECT timestamp FROM sites WHERE site = ?',
+                              (key,)).fetchone()
+        return row and row[0]
+
+    def refresh(self, site):
+        '''Update the data of site with the changes made since the last
+        refresh. If the recent changes do not reach back that far, the data
+        of site is dropped.
+
+        '''
+        key = site.sitename()
+        row = self.db.execute('SELECT timestamp FROM sites WHERE site = ?',
+                              (key,)).fetchone()
+        params = {
+            'list': 'recentchanges',
+            'rcprop': ['title', 'timestamp', 'loginfo'],
+            # changes of Wikidata and the like don't touch category links
+            'rctype': ['edit', 'new', 'log'],
+            'rclimit': 1,
+        }
+        if row:
+            since = row[0]
+            params['rcdir'] = 'newer'
+            oldest = list(query.iterate(params, site, limit=1))
+            if oldest and oldest[0]['timestamp'] > since:
+                pywikibot.output(u'Category data of %s is outdated, dropping it.'
+                                 % site)
+                for table in ('categories', 'members', 'supercats'):
+                    self.db.execute('DELETE FROM %s WHERE site = ?' % table,
+                                    (key,))
+                row = None
+            elif not self.db.execute('SELECT 1 FROM categories WHERE site = ? '
+                                     'AND (listed IS NOT NULL '
+                                     'OR superlisted IS NOT NULL) LIMIT 1',
+                                     (key,)).fetchone():
+                # there is nothing the changes could make outdated
+                row = None
+        if not row:
+            self._setNewest(site, params)
+            self.db.commit()
+            return
+
+        params['rcstart'] = since
+        params['rclimit'] = 'max'
+        changed = {}
+        timestamp = since
+        for change in query.iterate(params, site):
+            changed[change['title']] = change['ns']
+            # the target of a move is changed, too
+            target = change.get('move', {}).get('new_title') \
+                     or change.get('logparams', {}).get('target_title')
+            if target:
+                changed[target] = change.get('move', {}).get(
+                    'new_ns', change.get('logparams', {}).get('target_ns', 0))
+            timestamp = max(timestamp, change['timestamp'])
+            if len(changed) > self.maxChanges:
+                break
+        if len(changed) > self.maxChanges:
+            # cheaper to list the categories again when they are needed
+            pywikibot.output(u'More than %d pages of %s have changed, '
+                             u'dropping the lists of members.'
+                             % (self.maxChanges, site))
+            self.db.execute('UPDATE categories SET listed = NULL, '
+                            'superlisted = NULL WHERE site = ?', (key,))
+            self._setNewest(site, params)
+            self.db.commit()
+        elif changed:
+            pywikibot.output(u'Updating category data of %s with %d changed '
+                             u'pages...' % (site, len(changed)))
+            self.update(site, self._pageCategories(site, changed), timestamp)
+        else:
+            self._setTimestamp(site, timestamp)
+            self.db.commit()
+
+    def _setNewest(self, site, params):
+        '''Set the timestamp of site to its newest recent change.'''
+        params = dict(params, rcdir='older', rclimit=1)
+        params.pop('rcstart', None)
+        newest = list(query.iterate(params, site, limit=1))
+        if newest:
+            self._setTimestamp(site, newest[0]['timestamp'])
+
+    def _pageCategories(self, site, changed):
+        '''Return a dict mapping the titles in changed to their namespace
+        and their current categories which are in the database.
+
+        '''
+        known = set(row[0] for row in self.db.execute(
+            'SELECT title FROM categories WHERE site = ? '
+            'AND listed IS NOT NULL', (site.sitename(),)))
+        pages = dict((title, (ns, set())) for title, ns in changed.iteritems())
+        if not known:
+            return pages
+        titles = list(changed)
+        for i in range(0, len(titles), 50):
+            params = {
+                'prop': 'categories',
+                'titles': titles[i:i + 50],
+                'cllimit': 'max',
+            }
+            # a page can be continued in the next result
+            for page in query.iterate(params, site):
+                for cat in page.get('categories', []):
+                    if cat['title'] in known and page['title'] in pages:
+                        pages[page['title']][1].add(cat['title'])
+        return pages
+
+    def update(self, site, pages, timestamp):
+        '''Set the memberships of changed pages.
+
+        pages maps the titles of the pages to their namespace and the set
+        of their categories, timestamp is the newest change included.
+
+        '''
+        key = site.sitename()
+        for title, (ns, cats) in pages.iteritems():
+            if ns == 14:
+                # its supercategories must be listed again
+                self.db.execute('UPDATE categories SET superlisted = NULL '
+                                'WHERE site = ? AND title = ?', (key, title))
+                self.db.execute('DELETE FROM supercats '
+                                'WHERE site = ? AND category = ?',
+                                (key, title))
+            old = set(row[0] for row in self.db.execute(
+                'SELECT category FROM members WHERE site = ? AND title = ?',
+                (key, title)))
+            for cat in old - cats:
+                self.db.execute('DELETE FROM members WHERE site = ? '
+                                'AND category = ? AND title = ?',
+                                (key, cat, title))
+            self.db.executemany('INSERT INTO members (site, category, title, '
+                                'ns) VALUES (?, ?, ?, ?)',
+                                [(key, cat, title, ns) for cat in cats - old])
+        self._setTimestamp(site, timestamp)
+        self.db.commit()
+
+    def _setTimestamp(self, site, timestamp):
+        self.db.execute('INSERT OR REPLACE INTO sites (site, timestamp) '
+                        'VALUES (?, ?)', (site.sitename(), timestamp))
+
+    def _setListed(self, cat, column, timestamp):
+        key = (cat.site().sitename(), cat.title())
+        self.db.execute('INSERT OR IGNORE INTO categories (site, title) '
+                        'VALUES (?, ?)', key)
+        # an empty timestamp if the wiki has no recent changes at all
+        self.db.execute('UPDATE categories SET %s = ? '
+                        'WHERE site = ? AND title = ?' % column,
+                        (timestamp or u'',) + key)
+
+    def _list(self, cat):
+        '''Make sure the members of cat are in the database and return the
+        key of cat.
+
+        '''
+        site = cat.site()
+        timestamp = self._timestamp(site)
+        key = (site.sitename(), cat.title())
+        row = self.db.execute('SELECT listed FROM categories '
+                              'WHERE site = ? AND title = ?', key).fetchone()
+        if not row or row[0] is None:
+            self.db.execute('DELETE FROM members '
+                            'WHERE site = ? AND category = ?', key)
+            members = set()
+            for tag, page in cat._parseCategory():
+                members.add((page.title(), page.namespace()))
+            self.db.executemany('INSERT INTO members (site, category, title, '
+                                'ns) VALUES (?, ?, ?, ?)',
+                                [key + member for member in members])
+            self._setListed(cat, 'listed', timestamp)
+            self.db.commit()
+        return key
+
+    def _contents(self, cat):
+        '''Return a list of (title, namespace) of the members of cat,
+        sorted by title.
+
+        '''
+        return self.db.execute('SELECT title, ns FROM members '
+                               'WHERE site = ? AND category = ? '
+                               'ORDER BY title', self._list(cat)).fetchall()
 
     def getSubcats(self, supercat):
         '''For a given supercategory, return a list of Categorys for all its
-        subcategories. Saves this list in a temporary database so that it won't
+        subcategories. Saves this list in the database so that it won't
         be loaded from the server next time it's required.
 
         '''
-        # if we already know which subcategories exist here
-        if supercat in self.catContentDB:
-            return self.catContentDB[supercat][0]
-        else:
-            subcatlist = supercat.subcategoriesList()
-            articlelist = supercat.articlesList()
-            # add to dictionary
-            self.catContentDB[supercat] = (subcatlist, articlelist)
-            return subcatlist
+        site = supercat.site()
+        return [catlib.Category.fromNormalizedTitle(site, title, ns)
+                for title, ns in self._contents(supercat) if ns == 14]
 
-    def getArticles(self, cat):
+    def getArticles(self, cat, recurse=False):
         '''For a given category, return a list of Pages for all its articles.
-        Saves this list in a temporary database so that it won't be loaded from the
+        Saves this list in the database so that it won't be loaded from the
         server next time it's required.
 
-        '''
-        # if we already know which articles exist here
-        if cat in self.catContentDB:
-            return self.catContentDB[cat][1]
-        else:
-            subcatlist = cat.subcategoriesList()
-            articlelist = cat.articlesList()
-            # add to dictionary
-            self.catContentDB[cat] = (subcatlist, articlelist)
-            return articlelist
+        If recurse is True, the articles of all subcategories are included,
+        if it is an int, those of subcategories up to that depth. The list
+        is sorted and unique then.
 
-    def getSupercats(self, subcat):
-        # if we already know which subcategories exist here
-        if subcat in self.superclassDB:
-            return self.superclassDB[subcat]
-        else:
-            supercatlist = subcat.supercategoriesList()
-            # add to dictionary
-            self.superclassDB[subcat] = supercatlist
-            return supercatlist
+        '''
+        articles = self._articles(cat)
+        if not recurse:
+            return articles
+        # breadth first, so that every category is visited once, at its
+        # smallest depth, even if it can be reached on many paths
+        visited = set([cat])
+        level = [cat]
+        while level and (recurse is True or recurse > 0):
+            if recurse is not True:
+                recurse -= 1
+            subcats = []
+            for supercat in level:
+                for subcat in self.getSubcats(supercat):
+                    if subcat not in visited:
+                        visited.add(subcat)
+                        subcats.append(subcat)
+                        articles.extend(self._articles(subcat))
+            level = subcats
+        return catlib.unique(articles)
+
+    def _articles(self, cat):
+        '''Return a list of Pages for the members of cat which are no
+        categories.
 
-    def dump(self, filename = 'category.dump.bz2'):
-        '''Saves the contents of the dictionaries superclassDB and catContentDB
-        to disk.
+        '''
+        site = cat.site()
+        articles = []
+        for title, ns in self._contents(cat):
+            if ns == 6:
+                articles.append(pywikibot.ImagePage.fromNormalizedTitle(
+                    site, title, ns))
+            elif ns != 14:
+                articles.append(pywikibot.Page.fromNormalizedTitle(
+                    site, title, ns))
+        return articles
+
+    def countArticles(self, cat):
+        '''Return the number of articles in a category.'''
+        return self.db.execute('SELECT COUNT(*) FROM members '
+                               'WHERE site = ? AND category = ? AND ns != 14',
+                               self._list(cat)).fetchone()[0]
+
+    def loadDump(self, site, filename):
+        '''Replace the data of site with the category links found in an XML
+        dump of it.
+
+        The members and supercategories of every category are learned
+        without querying the wiki. Category links which are added by
+        templates are not found, as the dump has the wikitext only.
 
         '''
-        if not os.path.isabs(filename):
-            filename = pywikibot.config.datafilepath(filename)
-        if self.catContentDB or self.superclassDB:
-            pywikibot.output(u'Dumping to %s, please wait...'
-                             % pywikibot.config.shortpath(filename))
-            f = bz2.BZ2File(filename, 'w')
-            databases = {
-                'catContentDB': self.catContentDB,
-                'superclassDB': self.superclassDB
-            }
-            # store dump to disk in binary format
-            try:
-                pickle.dump(databases, f, protocol=pickle.HIGHEST_PROTOCOL)
-            except pickle.PicklingError:
-                pass
-            f.close()
-        else:
-            try:
-                os.remove(filename)
-            except EnvironmentError:
-                pass
+        import xmlreader
+        key = site.sitename()
+        for table in ('categories', 'members', 'supercats'):
+            self.db.execute('DELETE FROM %s WHERE site = ?' % table, (key,))
+        timestamp = u''
+        categories = set()
+        categoryPages = set()
+        members = []
+        supercats = []
+        count = 0
+        for entry in xmlreader.XmlDump(filename).parse():
+            if entry.ns:
+                ns = int(entry.ns)
             else:
-                pywikibot.output(u'Database is empty. %s removed'
-                                 % pywikibot.config.shortpath(filename))
+                ns = pywikibot.Page(site, entry.title).namespace()
+            try:
+                cats = set(cat.title() for cat
+                           in pywikibot.getCategoryLinks(entry.text, site))
+            except pywikibot.Error, error:
+                pywikibot.output(u'Skipping the categories of %s: %s'
+                                 % (entry.title, error))
+                cats = set()
+            members.extend((key, cat, entry.title, ns) for cat in cats)
+            if ns == 14:
+                categoryPages.add(entry.title)
+                supercats.extend((key, entry.title, cat) for cat in cats)
+            categories.update(cats)
+            timestamp = max(timestamp, entry.timestamp)
+            if len(members) >= 10000:
+                self._addDumpLinks(members, supercats)
+                members = []
+                supercats = []
+            count += 1
+            if count % 10000 == 0:
+                pywikibot.output(u'%d pages read...' % count)
+        self._addDumpLinks(members, supercats)
+        categories.update(categoryPages)
+        self.db.executemany('INSERT INTO categories (site, title, listed) '
+                            'VALUES (?, ?, ?)',
+                            [(key, cat, timestamp) for cat in categories])
+        # the supercategories of the category pages are known, too
+        self.db.executemany('UPDATE categories SET superlisted = listed '
+                            'WHERE site = ? AND title = ?',
+                            [(key, cat) for cat in categoryPages])
+        self._setTimestamp(site, timestamp)
+        self.db.commit()
+        pywikibot.output(u'%d categories of %d pages loaded.'
+                         % (len(categories), count))
+
+    def _addDumpLinks(self, members, supercats):
+        self.db.executemany('INSERT INTO members (site, category, title, ns) '
+                            'VALUES (?, ?, ?, ?)', members)
+        self.db.executemany('INSERT INTO supercats (site, category, supercat) '
+                            'VALUES (?, ?, ?)', supercats)
+
+    def getSupercats(self, subcat):
+        site = subcat.site()
+        timestamp = self._timestamp(site)
+        key = (site.sitename(), subcat.title())
+        row = self.db.execute('SELECT superlisted FROM categories '
+                              'WHERE site = ? AND title = ?', key).fetchone()
+        # if we don't know yet which supercategories exist here
+        if not row or row[0] is None:
+            self.db.execute('DELETE FROM supercats '
+                            'WHERE site = ? AND category = ?', key)
+            self.db.executemany('INSERT INTO supercats (site, category, '
+                                'supercat) VALUES (?, ?, ?)',
+                                [key + (cat.title(),) for cat
+                                 in subcat.supercategoriesList()])
+            self._setListed(subcat, 'superlisted', timestamp)
+            self.db.commit()
+        return [catlib.Category.fromNormalizedTitle(site, row[0], 14)
+                for row in self.db.execute('SELECT supercat FROM supercats '
+                                           'WHERE site = ? AND category = ? '
+                                           'ORDER BY supercat', key)]
+
+    def dump(self):
+        '''Saves the changes to disk and closes the database.'''
+        self.db.commit()
+        self.db.close()
 
 
 class AddCategory:
@@ -498,8 +793,10 @@ class CategoryMoveRobot:
 
 class CategoryListifyRobot:
     '''Creates a list containing all of the members in a category.'''
-    def __init__(self, catTitle, listTitle, editSummary, overwrite = False, showImages = False, subCats = False, talkPages = False, recurse = False):
+    def __init__(self, catTitle, listTitle, editSummary, overwrite = False, showImages = False, subCats = False, talkPages = False, recurse = False, catDB = None):
         self.editSummary = editSummary
+        # if given, the members are taken from this CategoryDatabase
+        self.catDB = catDB
         self.overwrite = overwrite
         self.showImages = showImages
         self.site = pywikibot.getSite()
@@ -510,9 +807,15 @@ class CategoryListifyRobot:
         self.recurse = recurse
 
     def run(self):
-        listOfArticles = self.cat.articlesList(recurse = self.recurse)
-        if self.subCats:
-            listOfArticles += self.cat.subcategoriesList()
+        if self.catDB:
+            listOfArticles = self.catDB.getArticles(self.cat,
+                                                    recurse = self.recurse)
+            if self.subCats:
+                listOfArticles += self.catDB.getSubcats(self.cat)
+        else:
+            listOfArticles = self.cat.articlesList(recurse = self.recurse)
+            if self.subCats:
+                listOfArticles += self.cat.subcategoriesList()
         if not self.editSummary:
             self.editSummary = i18n.twntranslate(self.site,
                                                  'category-listifying',
@@ -805,7 +1108,7 @@ class CategoryTreeRobot:
 
         result = u'#' * currentDepth
         result += '[[:%s|%s]]' % (cat.title(), cat.title().split(':', 1)[1])
-        result += ' (%d)' % len(self.catDB.getArticles(cat))
+        result += ' (%d)' % self.catDB.countArticles(cat)
         # We will remove an element of this array, but will need the original array
         # later, so we create a shallow copy with [:]
         supercats = self.catDB.getSupercats(cat)[:]
@@ -869,6 +1172,7 @@ def main(*args):
     withHistory = False
     titleRegex = None
     pagesonly = False
+    xmlFilename = None
 
     # This factory is responsible for processing command line arguments
     # that are also used by other scripts and that determine on which pages
@@ -902,6 +1206,12 @@ def main(*args):
             sort_by_last_name = True
         elif arg == '-rebuild':
             catDB.rebuild()
+        elif arg.startswith('-xml'):
+            if len(arg) == 4:
+                xmlFilename = pywikibot.input(
+                    u'Please enter the XML dump\'s filename:')
+            else:
+                xmlFilename = arg[5:]
         elif arg.startswith('-from:'):
             oldCatTitle = arg[len('-from:'):].replace('_', ' ')
             fromGiven = True
@@ -939,6 +1249,12 @@ def main(*args):
         else:
             genFactory.handleArg(arg)
 
+    if xmlFilename and action in ('tidy', 'tree', 'listify'):
+        catDB.loadDump(pywikibot.getSite(), xmlFilename)
+        catDB.autoRefresh = False
+    else:
+        xmlFilename = None
+
     if action == 'add':
         # Note that the add functionality is the only bot that actually
         # uses the the generator factory.  Every other bot creates its own
@@ -995,7 +1311,8 @@ u'Please enter the name of the category that should be removed:')
                 u'Please enter the name of the list to create:')
         bot = CategoryListifyRobot(oldCatTitle, newCatTitle, editSummary,
                                    overwrite, showImages, subCats=True,
-                                   talkPages=talkPages, recurse=recurse)
+                                   talkPages=talkPages, recurse=recurse,
+                                   catDB=xmlFilename and catDB or None)
         bot.run()
     else:
         pywikibot.showHelp('category')
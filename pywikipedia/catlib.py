@@ -16,8 +16,11 @@ Library to work with category pages on Wikipedia
 __version__ = '$Id$'
 #
 import re
+import sys
 import time
+import threading
 import urllib
+from collections import deque
 import wikipedia as pywikibot
 import query
 
@@ -63,6 +66,74 @@ def unique(l):
     return l
 
 
+class _ListingThread(threading.Thread):
+    """Fetch the listing of a subcategory in the background.
+
+    The thread is started by the constructor.
+
+    """
+
+    def __init__(self, listing, category):
+        threading.Thread.__init__(self)
+        self.setName('Category-Thread-%s' % category.title())
+        self.setDaemon(True)
+        self.listing = listing
+        self.category = category
+        self.result = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.listing(self.category)
+        except:
+            self.error = sys.exc_info()
+
+    def get(self):
+        """Wait for the listing and return it."""
+        # join with a timeout to stay responsive to KeyboardInterrupt
+        while self.isAlive():
+            self.join(1)
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+
+def _walkCategories(category, root, recurse, listing):
+    """Yield the contents of category and its subcategories breadth first.
+
+    root yields the (tag, page) tuples of category itself, listing(subcat)
+    returns those of a subcategory. recurse is as in Category.articles().
+    Every subcategory is listed once, even if the categories form a cycle,
+    and up to config.category_threads listings are fetched at the same time.
+
+    """
+    visited = set([category])
+    # subcategories to be listed, with the depth of the subcategories in them
+    pending = deque()
+    # threads listing the next subcategories, in breadth first order
+    running = deque()
+    threads = max(1, pywikibot.config.category_threads)
+    items, depth = root, 1
+    while True:
+        for tag, page in items:
+            yield tag, page
+            if tag == SUBCATEGORY and page not in visited \
+                    and (recurse is True or depth <= recurse):
+                visited.add(page)
+                pending.append((page, depth + 1))
+                if len(running) < threads:
+                    subcat, subdepth = pending.popleft()
+                    running.append((_ListingThread(listing, subcat), subdepth))
+        while pending and len(running) < threads:
+            subcat, subdepth = pending.popleft()
+            running.append((_ListingThread(listing, subcat), subdepth))
+        if not running:
+            return
+        thread, depth = running.popleft()
+        items = thread.get()
+
+
 class Category(pywikibot.Page):
     """Subclass of Page that has some special tricks that only work for
     category: pages
@@ -120,58 +191,44 @@ class Category(pywikibot.Page):
 
         Other parameters are analogous to _parseCategory(). If purge is True,
         cached results will be discarded. If startFrom is used, nothing
-        will be cached.
+        will be cached. cache is the set of pages which are not yielded
+        (again).
 
         This should not be used outside of this module.
 
         """
         if cache is None:
-            cache = []
+            cache = set()
+        root = self._getCachedContents(purge, startFrom, sortby, sortdir,
+                                       endsort)
+        def listing(subcat):
+            return list(subcat._getCachedContents(purge, sortby=sortby,
+                                                  sortdir=sortdir))
+        for tag, page in _walkCategories(self, root, recurse, listing):
+            if page not in cache:
+                cache.add(page)
+                yield tag, page
+
+    def _getCachedContents(self, purge=False, startFrom=None, sortby=None,
+                           sortdir=None, endsort=None):
+        """Yield the contents of this category, from the cache if possible."""
         if purge:
             self.completelyCached = False
-        if recurse:
-            if type(recurse) is int:
-                newrecurse = recurse - 1
-            else:
-                newrecurse = recurse
         if self.completelyCached:
             for article in self.articleCache:
-                if article not in cache:
-                    cache.append(article)
-                    yield ARTICLE, article
+                yield ARTICLE, article
             for subcat in self.subcatCache:
-                if subcat not in cache:
-                    cache.append(subcat)
-                    yield SUBCATEGORY, subcat
-                    if recurse:
-                        # contents of subcategory are cached by calling
-                        # this method recursively; therefore, do not cache
-                        # them again
-                        for item in subcat._getAndCacheContents(
-                                newrecurse, purge, cache=cache, sortby=sortby,
-                                sortdir=sortdir, endsort=endsort):
-                            yield item
+                yield SUBCATEGORY, subcat
         else:
+            self.articleCache = []
+            self.subcatCache = []
             for tag, page in self._parseCategory(purge, startFrom, sortby,
                                                  sortdir, endsort):
                 if tag == ARTICLE:
                     self.articleCache.append(page)
-                    if not page in cache:
-                        cache.append(page)
-                        yield ARTICLE, page
                 elif tag == SUBCATEGORY:
                     self.subcatCache.append(page)
-                    if not page in cache:
-                        cache.append(page)
-                        yield SUBCATEGORY, page
-                        if recurse:
-                            # contents of subcategory are cached by calling
-                            # this method recursively; therefore, do not cache
-                            # them again
-                            for item in page._getAndCacheContents(
-                                    newrecurse, purge, cache=cache,
-                                    sortby=sortby, sortdir=sortdir):
-                                yield item
+                yield tag, page
             if not startFrom:
                 self.completelyCached = True
 
@@ -181,16 +238,12 @@ class Category(pywikibot.Page):
         cache anything
 
         """
-        for tag, page in self._parseCategory(startFrom=startFrom,
-                                             sortby=sortby, sortdir=sortdir,
-                                             endsort=endsort):
-            yield tag, page
-            if tag == SUBCATEGORY and recurse:
-                for item in page._getContentsNaive(recurse=True,
-                                                   sortby=sortby,
-                                                   sortdir=sortdir,
-                                                   endsort=endsort):
-                    yield item
+        root = self._parseCategory(startFrom=startFrom, sortby=sortby,
+                                   sortdir=sortdir, endsort=endsort)
+        def listing(subcat):
+            return list(subcat._parseCategory(sortby=sortby, sortdir=sortdir,
+                                              endsort=endsort))
+        return _walkCategories(self, root, recurse, listing)
 
     def _parseCategory(self, purge=False, startFrom=None, sortby=None,
                        sortdir=None, endsort=None):
@@ -251,7 +304,7 @@ class Category(pywikibot.Page):
                     msg += ' ending at %s' % endsort
                 pywikibot.output(msg + u'...')
 
-            pywikibot.get_throttle()
+            pywikibot.get_throttle(site=self.site())
             data = query.GetData(params, self.site())
             if 'error' in data:
                 raise RuntimeError("%s" % data['error'])
@@ -272,8 +325,8 @@ class Category(pywikibot.Page):
                     yield ARTICLE, pywikibot.ImagePage(self.site(),
                                                        memb['title'])
                 else:
-                    yield ARTICLE, pywikibot.Page(self.site(), memb['title'],
-                                                  defaultNamespace=memb['ns'])
+                    yield ARTICLE, pywikibot.Page.fromNormalizedTitle(
+                        self.site(), memb['title'], memb['ns'])
                 if count >= params['cmlimit']:
                     break
             # try to find a link to the next list page
@@ -339,7 +392,7 @@ class Category(pywikibot.Page):
                                                        self.site())))
             else:
                 pywikibot.output('Getting [[%s]]...' % self.title())
-            pywikibot.get_throttle()
+            pywikibot.get_throttle(site=self.site())
             txt = self.site().getUrl(path)
             # index where subcategory listing begins
             if self.site().versionnumber() >= 9:
@@ -711,7 +764,7 @@ def categoryAllElementsAPI(CatName, cmlimit=5000, categories_parsed=[],
                            site=None):
     # action=query&list=categorymembers&cmlimit=500&cmtitle=Category:License_tags
     """ Category to load all the elements in a category using the APIs.
-    Limit: 5000 elements.
+    cmlimit is the number of elements requested at once.
 
     """
     pywikibot.output("Loading %s..." % CatName)
@@ -723,21 +776,8 @@ def categoryAllElementsAPI(CatName, cmlimit=5000, categories_parsed=[],
         'cmtitle': CatName,
     }
 
-    data = query.GetData(params, site)
     categories_parsed.append(CatName)
-    try:
-        members = data['query']['categorymembers']
-    except KeyError:
-        if int(cmlimit) != 500:
-            pywikibot.output(
-                u'An Error occured, trying to reload the category.')
-            return categoryAllElementsAPI(CatName, cmlimit=500)
-        else:
-            raise pywikibot.Error(data)
-    if len(members) == int(cmlimit):
-        raise pywikibot.Error(
-            u'The category selected has >= %s elements, limit reached.'
-            % cmlimit)
+    members = list(query.iterate(params, site))
     allmembers = members
     results = list()
     for subcat in members:
@@ -213,6 +213,9 @@ logfilecount = 5
 # logging handler to use, you can choose between: 'TRFH' (TimedRotatingFile-
 # Handler), 'RFH' (RotatingFileHandler), ... more might come.
 loghandler = 'TRFH'
+# If True, the logfile is written in a background thread, so that the bots
+# don't wait for it.
+logasync = False
 
 ############## INTERWIKI SETTINGS ##############
 
@@ -256,9 +259,8 @@ interwiki_graph_url = None
 # Save file with local articles without interwikis.
 without_interwiki = False
 
-# Experimental feature:
 # Store the page contents on disk (/cache/ directory) instead of loading
-# them in RAM.
+# them in RAM. This sets page_contents_memory to 0 unless it is set.
 interwiki_contents_on_disk = False
 
 ############## SOLVE_DISAMBIGUATION SETTINGS ############
@@ -279,6 +281,12 @@ sort_ignore_case = False
 # Commons by default.
 upload_to_commons = False
 
+# Files bigger than this many bytes are uploaded in pieces of this size, if
+# the wiki supports chunked uploads (MediaWiki 1.20 and later). An upload
+# which is interrupted can then be resumed. Set it to 0 to upload every file
+# in one request.
+upload_chunk_size = 1024 * 1024
+
 ############## SETTINGS TO AVOID SERVER OVERLOAD ##############
 
 # Slow down the robot such that it never requests a second page within
@@ -292,6 +300,10 @@ maxthrottle = 60
 # 'put_throttle' seconds.
 put_throttle = 10
 
+# The throttles above apply to every wiki server on its own. After a pause,
+# up to 'throttle_burst' requests may be sent to a server without delay.
+throttle_burst = 1
+
 # Sometimes you want to know when a delay is inserted. If a delay is larger
 # than 'noisysleep' seconds, it is logged on the screen.
 noisysleep = 3.0
@@ -332,8 +344,22 @@ table2wikiSkipWarnings = False
 # that slow servers won't slow you down.
 max_external_links = 50
 
+# How many links of the same host should be checked at the same time? The
+# remaining links of a host wait, so that no server is flooded.
+max_external_links_per_host = 4
+
 report_dead_links_on_talk = False
 
+############## REFERENCE LINKS SETTINGS ##############
+
+# How many references should reflinks.py load at the same time? They are
+# loaded ahead of the pages they are needed for.
+reflinks_threads = 10
+
+# How many bytes of a referenced page should reflinks.py read to find its
+# title? PDF files are always loaded completely.
+reflinks_max_size = 100 * 1024
+
 ############## DATABASE SETTINGS ##############
 db_hostname = 'localhost'
 db_username = 'wikiuser'
@@ -454,6 +480,15 @@ replicate_replace = {}
 # Default socket timeout. Set to None to disable timeouts.
 socket_timeout = 120  # set a pretty long timeout just in case...
 
+# Keep connections to the wikis open and reuse them for further requests.
+# This is not done if a proxy is used.
+http_keepalive = True
+
+# Maximum number of connections used at the same time, for all servers and
+# for a single server.
+http_max_connections = 25
+http_max_connections_per_host = 5
+
 
 ############## COSMETIC CHANGES SETTINGS ##############
 # The bot can make some additional changes to each page it edits, e.g. fix
@@ -508,12 +543,44 @@ actions_to_block = ['edit', 'watch', 'move', 'delete', 'undelete', 'protect',
                     'wbsetreference', 'wblinktitles',       #
                     'wbremoveclaims', 'wbremovereferences'] #
 
-# How many pages should be put to a queue in asynchroneous mode.
+# How many pages should be put to a queue of a wiki in asynchroneous mode.
 # If maxsize is <= 0, the queue size is infinite.
 # Increasing this value will increase memory space but could speed up
 # processing. As higher this value this effect will decrease.
 max_queue_size = 64
 
+# Pages saved asynchronously are queued per wiki, and every wiki is written
+# to by its own thread. How many pages may be saved at the same time?
+put_threads = 4
+
+# How many batches of pages should PreloadingGenerator load in the background
+# ahead of the bot? Set it to 0 to load every batch only when it is needed.
+preload_depth = 2
+
+# Maximum amount of page text (in characters) which PreloadingGenerator keeps
+# in batches loaded ahead. A single batch larger than this is still loaded.
+preload_max_bytes = 32 * 1024 * 1024
+
+# How many parsed page titles should be remembered per wiki? Creating a Page
+# for a title seen before then skips normalizing it.
+page_title_cache_size = 10000
+
+# How much page text (in characters) should be kept in memory? If set, the
+# texts beyond this budget are compressed and moved to a temporary file in
+# the cache directory, so bots which hold many pages, e.g. interwiki.py,
+# need less memory. Use 0 to move all texts to disk; None keeps all texts
+# in memory.
+page_contents_memory = None
+
+# From how many sites at once should PreloadingGenerator load pages if a
+# batch spans several wikis, e.g. with -interwiki? Every site still honors
+# its own throttle.
+preload_sites = 8
+
+# How many subcategories should be listed at the same time when the contents
+# of a category are retrieved recursively, e.g. with -catr?
+category_threads = 4
+
 # Define the line separator. Pages retrieved via API have "\n" whereas
 # pages fetched from screen (mostly) have "\r\n". Interwiki and category
 # separator settings in family files should use multiplied of this.
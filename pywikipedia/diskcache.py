@@ -5,65 +5,137 @@ __version__ = '$Id$'
 import random
 import config
 import os
-
-# http://mail.python.org/pipermail/python-list/2006-March/375280.html
+import mmap
+import struct
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 try:
-     os.SEEK_SET
-except AttributeError:
-     os.SEEK_SET, os.SEEK_CUR, os.SEEK_END = range(3)
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
 
 ## Dictionary like disk caching module
 ## (c) Copyright 2008 - Bryan Tong Minh / The Pywikipediabot team
 ## Licensed under the terms of the MIT license
 
+## File layout: a header (magic, number of entries, number of slots), a
+## hash table of slots (64 bit key hash, record offset + 1 or 0 if empty)
+## and the records (key length, key, value length, value).
+
+MAGIC = 'PWBDC\x00\x00\x01'
+HEADER = struct.Struct('<8sII')
+SLOT = struct.Struct('<QQ')
+LENGTH = struct.Struct('<I')
+
+
+def _hash(key):
+    return struct.unpack('<Q', md5(key).digest()[:8])[0]
+
+
+def _key(key):
+    """Return key as it is stored: lowercased and encoded in UTF-8."""
+    if type(key) is str:
+        key = key.decode('utf-8')
+    elif type(key) is not unicode:
+        key = unicode(key)
+    return key.lower().encode('utf-8')
+
+
 class CachedReadOnlyDictI(object):
-    """A cached readonly dict with case insensitive keys."""
-    def __init__(self, data, prefix = "", max_size = 10, cache_base = 'cache'):
+    """A cached readonly dict with case insensitive keys.
+
+    The data is written to a hashed file which is read through mmap, so
+    lookups take constant time and only the max_size most recently used
+    values are kept in memory.
+
+    If name is given, the file is kept in cache_base under this name and
+    can be opened again by later runs with load(); otherwise a temporary
+    file is used and removed by delete().
+    """
+    def __init__(self, data, prefix = "", max_size = 10, cache_base = 'cache',
+                 name = None):
         self.max_size = max_size
-        while True:
-            self.cache_path = config.datafilepath(cache_base, prefix + ''.join(
-                [random.choice('abcdefghijklmnopqrstuvwxyz')
-                    for i in xrange(16)]))
-            if not os.path.exists(self.cache_path): break
-        self.cache_file = open(self.cache_path, 'wb+')
-
-        lookup = [-1] * 36
-        data.sort(key = lambda i: i[0])
-        for key, value in data:
-            if type(key) is unicode:
-                key = key.encode('utf-8')
-            elif type(key) != str:
-                key = str(key)
-            key = key.lower()
-            index = key[0]
-            if not ((index >= 'a' and index <= 'z') or (index >= '0' and index <= '9')) or '\t' in key:
-                raise RuntimeError('Only alphabetic keys are supported', key)
-
-            if index < 'a':
-                index = ord(index) - 48 + 26 # Numeric
-            else:
-                index = ord(index) - 97
-            if lookup[index] == -1:
-                lookup[index] = self.cache_file.tell()
+        self.persistent = name is not None
+        if self.persistent:
+            self.cache_path = config.datafilepath(cache_base, name)
+        else:
+            while True:
+                self.cache_path = config.datafilepath(cache_base, prefix + ''.join(
+                    [random.choice('abcdefghijklmnopqrstuvwxyz')
+                        for i in xrange(16)]))
+                if not os.path.exists(self.cache_path): break
+        if data is not None:
+            self._write(data)
+        self._open()
+        if OrderedDict:
+            self.cache = OrderedDict()
+        else:
+            self.cache = {}
+            self.cache_keys = []
 
+    @classmethod
+    def load(cls, name, max_size = 10, cache_base = 'cache'):
+        """Return the cache stored under name, or None if there is none."""
+        try:
+            return cls(None, max_size = max_size, cache_base = cache_base,
+                       name = name)
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+
+    def _write(self, data):
+        records = {}
+        for key, value in data:
+            key = _key(key)
             if type(value) is unicode:
                 value = value.encode('utf-8')
             elif type(value) != str:
                 value = str(value)
+            records[key] = value
+
+        nslots = 8
+        while nslots < len(records) * 2:
+            nslots *= 2
+        slots = [(0, 0)] * nslots
+        offset = HEADER.size + SLOT.size * nslots
+        body = []
+        for key, value in records.iteritems():
+            h = _hash(key)
+            i = h & (nslots - 1)
+            while slots[i][1]:
+                i = (i + 1) & (nslots - 1)
+            slots[i] = (h, offset + 1)
+            record = '%s%s%s%s' % (LENGTH.pack(len(key)), key,
+                                   LENGTH.pack(len(value)), value)
+            body.append(record)
+            offset += len(record)
+
+        # write to a new file and rename it, so that a persistent cache
+        # which is currently read by another process stays intact
+        tmp_path = '%s.%d.tmp' % (self.cache_path, os.getpid())
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(HEADER.pack(MAGIC, len(records), nslots))
+            f.write(''.join([SLOT.pack(*slot) for slot in slots]))
+            f.write(''.join(body))
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(self.cache_path):
+            os.unlink(self.cache_path)
+        os.rename(tmp_path, self.cache_path)
 
-            if len(key) > 0xFF:
-                raise RuntimeError('Key length must be smaller than %i' % 0xFF)
-            if len(value) > 0xFFFFFF:
-                raise RuntimeError('Value length must be smaller than %i' % 0xFFFFFF)
-
-            self.cache_file.write('%02x%s%06x%s' % (len(key), key, len(value), value))
-
-        self.lookup = lookup
-
-        self.cache_file.close()
+    def _open(self):
         self.cache_file = open(self.cache_path, 'rb')
-        self.cache_file.seek(0)
-        self.cache = []
+        try:
+            self.map = mmap.mmap(self.cache_file.fileno(), 0,
+                                 access = mmap.ACCESS_READ)
+            magic, self.count, self.nslots = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                raise ValueError('%s is no cache file' % self.cache_path)
+        except:
+            self.cache_file.close()
+            raise
 
     def delete(self):
         """
@@ -75,9 +147,12 @@ class CachedReadOnlyDictI(object):
         3) Strange errors can be raised here, we don't care.
         """
         try:
+            self.map.close()
             self.cache_file.close()
-        except IOError:
+        except (IOError, ValueError):
             pass
+        if self.persistent:
+            return
         try:
             try:
                 import os
@@ -87,55 +162,54 @@ class CachedReadOnlyDictI(object):
         finally:
             os = None
 
-    def __getitem__(self, key):
-        key = key.lower()
-        if type(key) is unicode:
-            key = key.encode('utf-8')
+    def __len__(self):
+        return self.count
 
+    def __contains__(self, key):
         try:
-            index = key[0]
-        except IndexError:
-            raise KeyError(key)
-        if not ((index >= 'a' and index <= 'z') or (index >= '0' and index <= '9')):
-            raise KeyError(key)
-
-        if index < 'a':
-            i = ord(index) - 48 + 26 # Numeric
-        else:
-            i = ord(index) - 97
-
-        for k, v in self.cache:
-            if k == key:
-                self.cache.remove((k, v))
-                self.cache.append((k, v))
+            self[key]
+            return True
+        except KeyError:
+            return False
 
-        try:
-            k, v = self.cache[-1]
-            if k == key:
-                return v
-        except IndexError:
-            pass
-
-        self.cache_file.seek(self.lookup[i])
+    def __getitem__(self, key):
+        key = _key(key)
+
+        if key in self.cache:
+            value = self.cache.pop(key)
+            self.cache[key] = value
+            if not OrderedDict:
+                self.cache_keys.remove(key)
+                self.cache_keys.append(key)
+            return value
+
+        value = self._lookup(key).decode('utf-8')
+        self.cache[key] = value
+        if OrderedDict:
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last = False)
+        else:
+            self.cache_keys.append(key)
+            if len(self.cache_keys) > self.max_size:
+                del self.cache[self.cache_keys.pop(0)]
+        return value
+
+    def _lookup(self, key):
+        h = _hash(key)
+        mask = self.nslots - 1
+        i = h & mask
         while True:
-            length = int(self.read(2, key), 16)
-            k = self.read(length, key)
-            if k == key:
-                length = int(self.read(6, key), 16)
-                value = self.read(length, key).decode('utf-8')
-                if len(self.cache) > self.max_size:
-                    del self.cache[0]
-                self.cache.append((key, value))
-                return value
-
-            elif k[0] != index:
+            slot_hash, offset = SLOT.unpack_from(self.map,
+                                                 HEADER.size + SLOT.size * i)
+            if not offset:
                 raise KeyError(key)
-
-            length = int(self.read(6, key), 16)
-            self.cache_file.seek(length, os.SEEK_CUR)
-
-
-    def read(self, length, key = ''):
-        s = self.cache_file.read(length)
-        if not s: raise KeyError(key)
-        return s
+            if slot_hash == h:
+                offset -= 1
+                length = LENGTH.unpack_from(self.map, offset)[0]
+                offset += LENGTH.size
+                if self.map[offset:offset + length] == key:
+                    offset += length
+                    length = LENGTH.unpack_from(self.map, offset)[0]
+                    offset += LENGTH.size
+                    return self.map[offset:offset + length]
+            i = (i + 1) & mask
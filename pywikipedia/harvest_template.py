@@ -94,7 +94,6 @@ class HarvestRobot:
             #TODO FIXME: We should provide an option to create the page
         else:
             pagetext = page.get()
-            pagetext = pywikibot.removeDisabledParts(pagetext)
             templates = pywikibot.extract_templates_and_params(pagetext)
             for (template, fielddict) in templates:
                 # We found the template we were looking for
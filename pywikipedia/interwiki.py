@@ -620,74 +620,6 @@ class Global(object):
         return True
 
 
-class StoredPage(pywikibot.Page):
-    """
-    Store the Page contents on disk to avoid sucking too much
-    memory when a big number of Page objects will be loaded
-    at the same time.
-    """
-
-    # Please prefix the class members names by SP
-    # to avoid possible name clashes with pywikibot.Page
-
-    # path to the shelve
-    SPpath = None
-    # shelve
-    SPstore = None
-
-    # attributes created by pywikibot.Page.__init__
-    SPcopy = ['_editrestriction',
-              '_site',
-              '_namespace',
-              '_section',
-              '_title',
-              'editRestriction',
-              'moveRestriction',
-              '_permalink',
-              '_userName',
-              '_ipedit',
-              '_editTime',
-              '_startTime',
-              '_revisionId',
-              '_deletedRevs']
-
-    def SPdeleteStore():
-        if StoredPage.SPpath:
-            del StoredPage.SPstore
-            os.unlink(StoredPage.SPpath)
-    SPdeleteStore = staticmethod(SPdeleteStore)
-
-    def __init__(self, page):
-        for attr in StoredPage.SPcopy:
-            setattr(self, attr, getattr(page, attr))
-
-        if not StoredPage.SPpath:
-            import shelve
-            index = 1
-            while True:
-                path = config.datafilepath('cache', 'pagestore' + str(index))
-                if not os.path.exists(path): break
-                index += 1
-            StoredPage.SPpath = path
-            StoredPage.SPstore = shelve.open(path)
-
-        self.SPkey = str(self)
-        self.SPcontentSet = False
-
-    def SPgetContents(self):
-        return StoredPage.SPstore[self.SPkey]
-
-    def SPsetContents(self, contents):
-        self.SPcontentSet = True
-        StoredPage.SPstore[self.SPkey] = contents
-
-    def SPdelContents(self):
-        if self.SPcontentSet:
-            del StoredPage.SPstore[self.SPkey]
-
-    _contents = property(SPgetContents, SPsetContents, SPdelContents)
-
-
 class PageTree(object):
     """
     Structure to manipulate a set of pages.
@@ -829,10 +761,6 @@ class Subject(object):
         """Constructor. Takes as arguments the Page on the home wiki
            plus optionally a list of hints for translation"""
 
-        if globalvar.contentsondisk:
-            if originPage:
-                originPage = StoredPage(originPage)
-
         # Remember the "origin page"
         self.originPage = originPage
         self.repoPage = None
@@ -935,8 +863,6 @@ class Subject(object):
                 removebrackets=globalvar.hintnobracket,
                 site=pywikibot.getSite())
         for page in pages:
-            if globalvar.contentsondisk:
-                page = StoredPage(page)
             self.todo.add(page)
             self.foundIn[page] = [None]
             if keephintedsites:
@@ -1010,8 +936,6 @@ class Subject(object):
             self.foundIn[page].append(linkingPage)
             return False
         else:
-            if globalvar.contentsondisk:
-                page = StoredPage(page)
             self.foundIn[page] = [linkingPage]
             self.todo.add(page)
             counter.plus(page.site)
@@ -1323,8 +1247,6 @@ u'WARNING: %s is in namespace %i, but %s is in namespace %i. Follow it anyway?'
                     # the 1st existig page becomes the origin page, if none was
                     # supplied
                     if globalvar.initialredirect:
-                        if globalvar.contentsondisk:
-                            redirectTargetPage = StoredPage(redirectTargetPage)
                         # don't follow another redirect; it might be a self loop
                         if not redirectTargetPage.isRedirectPage() \
                            and not redirectTargetPage.isCategoryRedirect():
@@ -1804,21 +1726,12 @@ u'NOTE: number of edits are restricted at %s'
         """
         Delete the contents that are stored on disk for this Subject.
 
-        We cannot afford to define this in a StoredPage destructor because
-        StoredPage instances can get referenced cyclicly: that would stop the
-        garbage collector from destroying some of those objects.
-
-        It's also not necessary to set these lines as a Subject destructor:
-        deleting all stored content one entry by one entry when bailing out
-        after a KeyboardInterrupt for example is redundant, because the
-        whole storage file will be eventually removed.
+        Pages can get referenced cyclicly, so we cannot wait for the
+        garbage collector to remove their contents from the store.
         """
-        if globalvar.contentsondisk:
+        if pywikibot.pageContentStore() is not None:
             for page in self.foundIn:
-                # foundIn can contain either Page or StoredPage objects
-                # calling the destructor on _contents will delete the
-                # disk records if necessary
-                if hasattr(page, '_contents'):
+                if page._hasContents():
                     del page._contents
 
     def replaceLinks(self, page, newPages):
@@ -2535,6 +2448,10 @@ def main():
             if not genFactory.handleArg(arg):
                 singlePageTitle.append(arg)
 
+    if globalvar.contentsondisk and config.page_contents_memory is None:
+        # keep none of the page contents in memory
+        config.page_contents_memory = 0
+
     # Do not use additional summary with autonomous mode
     if globalvar.autonomous:
         globalvar.summary = u''
@@ -2656,8 +2573,6 @@ def main():
             dumpFileName = bot.dump(append)
             raise
     finally:
-        if globalvar.contentsondisk:
-            StoredPage.SPdeleteStore()
         if dumpFileName:
             try:
                 restoredFiles.remove(dumpFileName)
@@ -26,6 +26,7 @@ import codecs
 import datetime
 import urllib, urllib2, time
 import traceback
+import threading, Queue
 import wikipedia as pywikibot
 import config
 from pywikibot import i18n
@@ -1201,68 +1202,237 @@ def PageWithTalkPageGenerator(generator):
             yield page.toggleTalkPage()
 
 
+class _PreloadThread(threading.Thread):
+    """For internal use only - supports PreloadingGenerator.
+
+    Takes batches from the PreloadingGenerator, loads them and hands them
+    over to the consuming thread through a queue. At most depth batches,
+    counting the one being loaded, are loaded ahead of the consumer.
+    Besides, the amount of page text held by them is limited; a single
+    batch exceeding that limit is still handed over so that the pipeline
+    does not stall.
+
+    """
+    def __init__(self, preloader):
+        threading.Thread.__init__(self)
+        self.setName('Preload-Thread')
+        self.setDaemon(True)
+        self.preloader = preloader
+        self.queue = Queue.Queue()
+        self.condition = threading.Condition()
+        # batches loaded or being loaded, but not yet taken by the consumer
+        self.ahead = 0
+        self.bufferedBytes = 0
+        self.stopped = False
+        # keep it, the sys module may be gone when the thread is still
+        # running at interpreter exit
+        self.exc_info = sys.exc_info
+
+    def run(self):
+        try:
+            for batch in self.preloader.batches():
+                if not self.wait(lambda: self.ahead >= self.preloader.depth):
+                    return
+                self.condition.acquire()
+                try:
+                    self.ahead += 1
+                finally:
+                    self.condition.release()
+                loaded = list(self.preloader.preload(batch))
+                size = 0
+                for page in loaded:
+                    if page._hasContents():
+                        size += len(page._contents)
+                if not self.wait(lambda: self.bufferedBytes and
+                        self.bufferedBytes + size > self.preloader.maxBytes):
+                    return
+                self.condition.acquire()
+                try:
+                    self.bufferedBytes += size
+                finally:
+                    self.condition.release()
+                self.queue.put((loaded, size, None))
+            self.queue.put((None, 0, None))
+        except:
+            self.queue.put((None, 0, self.exc_info()))
+
+    def wait(self, busy):
+        """
+        Wait while busy() is true. Return False if the consumer went away
+        meanwhile.
+        """
+        self.condition.acquire()
+        try:
+            while not self.stopped and busy():
+                self.condition.wait(1)
+            return not self.stopped
+        finally:
+            self.condition.release()
+
+    def get(self):
+        """Return the next (pages, size, exc_info) item for the consumer."""
+        item = self.queue.get()
+        self.condition.acquire()
+        try:
+            self.ahead -= 1
+            self.condition.notify()
+        finally:
+            self.condition.release()
+        return item
+
+    def release(self, size):
+        """Called by the consumer when a batch of size bytes was yielded."""
+        self.condition.acquire()
+        try:
+            self.bufferedBytes -= size
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def stop(self):
+        self.condition.acquire()
+        try:
+            self.stopped = True
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+
 class PreloadingGenerator(object):
     """
     Yields the same pages as generator generator. Retrieves 60 pages (or
     another number specified by pageNumber), loads them using
     Special:Export, and yields them one after the other. Then retrieves more
     pages, etc. Thus, it is not necessary to load each page separately.
-    Operates asynchronously, so the next batch of pages is loaded in the
-    background before the first batch is fully consumed.
+
+    Operates asynchronously: a background thread keeps up to depth batches
+    (default: config.preload_depth) loaded ahead of the consumer, as long as
+    the page text held by them does not exceed maxBytes (default:
+    config.preload_max_bytes). With depth=0, every batch is loaded in the
+    calling thread when it is needed.
     """
     @deprecate_arg("lookahead", None)
-    def __init__(self, generator, pageNumber=60):
+    def __init__(self, generator, pageNumber=60, depth=None, maxBytes=None):
         self.wrapped_gen = generator
         self.pageNumber = pageNumber
+        if depth is None:
+            depth = config.preload_depth
+        self.depth = depth
+        if maxBytes is None:
+            maxBytes = config.preload_max_bytes
+        self.maxBytes = maxBytes
 
     def __iter__(self):
         try:
-            # this array will contain up to pageNumber pages and will be flushed
-            # after these pages have been preloaded and yielded.
-            somePages = []
-            for page in self.wrapped_gen:
-                somePages.append(page)
-                # We don't want to load too many pages at once using XML export.
-                # We only get a maximum number at a time.
-                if len(somePages) >= self.pageNumber:
+            if self.depth > 0:
+                for page in self.prefetch():
+                    yield page
+            else:
+                for somePages in self.batches():
                     for loaded_page in self.preload(somePages):
                         yield loaded_page
-                    somePages = []
-            if somePages:
-                # wrapped generator is exhausted but some pages still unloaded
-                # preload remaining pages
-                for loaded_page in self.preload(somePages):
-                    yield loaded_page
         except GeneratorExit:
             pass
         except Exception, e:
             traceback.print_exc()
             pywikibot.output(unicode(e))
 
-    def preload(self, page_list, retry=False):
+    def batches(self):
+        """Yield lists of up to pageNumber pages from the wrapped generator."""
+        # this array will contain up to pageNumber pages and will be flushed
+        # after these pages have been preloaded and yielded.
+        somePages = []
+        for page in self.wrapped_gen:
+            somePages.append(page)
+            # We don't want to load too many pages at once using XML export.
+            # We only get a maximum number at a time.
+            if len(somePages) >= self.pageNumber:
+                yield somePages
+                somePages = []
+        if somePages:
+            # wrapped generator is exhausted but some pages still unloaded
+            yield somePages
+
+    def prefetch(self):
+        """Yield the pages loaded by a background _PreloadThread."""
+        worker = _PreloadThread(self)
+        worker.start()
         try:
-            while len(page_list) > 0:
-                # It might be that the pages are on different sites,
-                # e.g. because the -interwiki parameter was used.
-                # Query the sites one by one.
-                site = page_list[0].site()
-                pagesThisSite = [page for page in page_list
-                                      if page.site() == site]
-                page_list = [page for page in page_list
-                                  if page.site() != site]
-                pywikibot.getall(site, pagesThisSite)
-                for page in pagesThisSite:
+            while True:
+                loaded, size, error = worker.get()
+                if error:
+                    # re-raise the worker's exception in the consumer thread
+                    raise error[0], error[1], error[2]
+                if loaded is None:
+                    break
+                for page in loaded:
                     yield page
-        except IndexError:
-            # Can happen if the pages list is empty. Don't care.
-            pass
+                worker.release(size)
+        finally:
+            worker.stop()
+            worker.join()
+
+    def preload(self, page_list, retry=False):
+        """Load page_list and yield its pages in the original order.
+
+        It might be that the pages are on different sites, e.g. because the
+        -interwiki parameter was used. Up to config.preload_sites sites are
+        queried at the same time, each one honoring its own throttle.
+
+        """
+        sites = []
+        pagesBySite = {}
+        for page in page_list:
+            if page._hasContents() or hasattr(page, '_getexception'):
+                # already loaded, getall() would skip it anyway
+                continue
+            site = page.site()
+            if site not in pagesBySite:
+                sites.append(site)
+                pagesBySite[site] = []
+            pagesBySite[site].append(page)
+        if len(sites) == 1 or config.preload_sites <= 1:
+            for site in sites:
+                self._getall(site, pagesBySite[site], retry)
+        elif sites:
+            queue = Queue.Queue()
+            for site in sites:
+                queue.put(site)
+            errors = []
+            def worker():
+                while True:
+                    try:
+                        site = queue.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        self._getall(site, pagesBySite[site], retry)
+                    except:
+                        errors.append(sys.exc_info())
+            threads = []
+            for i in range(min(config.preload_sites, len(sites))):
+                thread = threading.Thread(target=worker)
+                thread.setName('Preload-Site-Thread-%d' % i)
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                # join with a timeout to stay responsive to KeyboardInterrupt
+                while thread.isAlive():
+                    thread.join(1)
+            if errors:
+                raise errors[0][0], errors[0][1], errors[0][2]
+        for page in page_list:
+            yield page
+
+    def _getall(self, site, pages, retry=False):
+        try:
+            pywikibot.getall(site, pages)
         except pywikibot.SaxError:
             if not retry:
                 # Retry once.
-                self.preload(page_list, retry=True)
+                self._getall(site, pages, retry=True)
             # Ignore this error, and get the pages the traditional way later.
-            pass
-
 
 
 def main(*args):
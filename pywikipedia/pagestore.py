@@ -0,0 +1,164 @@
+# -*- coding: utf-8  -*-
+
+__version__ = '$Id$'
+
+import os
+import random
+import threading
+import weakref
+import zlib
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+import config
+
+## Memory bounded store for the contents of pages
+## (c) Copyright 2013 - The Pywikipediabot team
+## Licensed under the terms of the MIT license
+
+## The most recently used contents are kept in memory. When they take more
+## than max_memory characters, the least recently used ones are compressed
+## and appended to a temporary file, which is removed by close().
+
+
+class PageContentStore(object):
+    """Store the contents of many pages within a memory budget.
+
+    Contents are added with add(), which returns the key to get them back.
+    A content is removed by discard() or as soon as the object it belongs
+    to is garbage collected.
+    """
+    def __init__(self, max_memory, cache_base = 'cache'):
+        self.max_memory = max_memory
+        self.cache_base = cache_base
+        self.memory = 0
+        if OrderedDict:
+            self.recent = OrderedDict()
+        else:
+            self.recent = {}
+            self.recent_keys = []
+        # key -> (offset, length, is unicode) in the file
+        self.stored = {}
+        # key -> weak reference to the owner
+        self.owners = {}
+        self.next_key = 0
+        self.file = None
+        self.path = None
+        self.lock = threading.RLock()
+
+    def add(self, owner, contents):
+        """Store contents belonging to owner and return their key."""
+        self.lock.acquire()
+        try:
+            key = self.next_key
+            self.next_key += 1
+            self.owners[key] = weakref.ref(owner,
+                                           lambda ref: self.discard(key))
+            self._remember(key, contents)
+            return key
+        finally:
+            self.lock.release()
+
+    def __getitem__(self, key):
+        self.lock.acquire()
+        try:
+            if key in self.recent:
+                contents = self.recent.pop(key)
+                if not OrderedDict:
+                    self.recent_keys.remove(key)
+                self.memory -= len(contents)
+            else:
+                contents = self._read(key)
+            # most recently used
+            self._remember(key, contents)
+            return contents
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        self.lock.acquire()
+        try:
+            return key in self.recent or key in self.stored
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.owners)
+
+    def discard(self, key):
+        """Remove the contents with key, if they are stored."""
+        self.lock.acquire()
+        try:
+            self.owners.pop(key, None)
+            # the space in the file is not reused
+            self.stored.pop(key, None)
+            if key in self.recent:
+                self.memory -= len(self.recent.pop(key))
+                if not OrderedDict:
+                    self.recent_keys.remove(key)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """Remove all contents and the file."""
+        self.lock.acquire()
+        try:
+            self.recent.clear()
+            if not OrderedDict:
+                del self.recent_keys[:]
+            self.stored.clear()
+            self.owners.clear()
+            self.memory = 0
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                try:
+                    os.unlink(self.path)
+                except OSError:
+                    pass
+        finally:
+            self.lock.release()
+
+    def _remember(self, key, contents):
+        self.recent[key] = contents
+        if not OrderedDict:
+            self.recent_keys.append(key)
+        self.memory += len(contents)
+        while self.memory > self.max_memory and self.recent:
+            if OrderedDict:
+                old_key, old_contents = self.recent.popitem(last = False)
+            else:
+                old_key = self.recent_keys.pop(0)
+                old_contents = self.recent.pop(old_key)
+            self.memory -= len(old_contents)
+            if old_key not in self.stored:
+                self._write(old_key, old_contents)
+
+    def _open(self):
+        while True:
+            self.path = config.datafilepath(self.cache_base, 'pagestore-' +
+                ''.join([random.choice('abcdefghijklmnopqrstuvwxyz')
+                         for i in xrange(16)]))
+            if not os.path.exists(self.path): break
+        self.file = open(self.path, 'w+b')
+
+    def _write(self, key, contents):
+        if self.file is None:
+            self._open()
+        is_unicode = type(contents) is unicode
+        if is_unicode:
+            data = zlib.compress(contents.encode('utf-8'))
+        else:
+            data = zlib.compress(contents)
+        self.file.seek(0, 2)
+        self.stored[key] = (self.file.tell(), len(data), is_unicode)
+        self.file.write(data)
+
+    def _read(self, key):
+        offset, length, is_unicode = self.stored[key]
+        self.file.seek(offset)
+        contents = zlib.decompress(self.file.read(length))
+        if is_unicode:
+            contents = contents.decode('utf-8')
+        return contents
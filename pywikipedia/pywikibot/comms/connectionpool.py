@@ -0,0 +1,213 @@
+# -*- coding: utf-8  -*-
+"""
+Pool of persistent HTTP connections.
+
+It is used for the requests to the wikis as well as by the scripts which
+load many external web pages, like weblinkchecker.py and reflinks.py.
+"""
+
+#
+# (C) Pywikipedia bot team, 2012
+#
+# Distributed under the terms of the MIT license.
+#
+
+__version__ = '$Id$'
+
+import errno
+import httplib
+import socket
+import threading
+from collections import deque
+
+
+def stale_connection(err, sent, body=None):
+    """
+    Return True if err shows that a reused connection had been closed by
+    the server before the request reached it, so sending the request again
+    on a new connection is safe.
+
+    This is the case if the connection was reset while sending, or if the
+    connection was closed or reset before the status line of a request
+    without a body came back. Timeouts and errors after a body was sent
+    completely are never treated as stale, the server may have processed
+    the request already.
+
+    @param sent: whether the request was sent completely
+    @param body: the request body, None for requests without one
+    """
+    if isinstance(err, socket.timeout):
+        return False
+    if isinstance(err, socket.error):
+        return (err.errno in (errno.ECONNRESET, errno.EPIPE)
+                and (not sent or body is None))
+    return (sent and body is None and isinstance(err, httplib.BadStatusLine)
+            and (err.line in ('', "''")
+                 or err.line.startswith('No status line received')))
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of persistent HTTP connections.
+
+    Idle connections are kept per identifier, usually (scheme, host), so
+    following requests to the same server reuse them instead of connecting
+    (and doing the TLS handshake) again.
+
+    If max_connections_per_host or max_connections is given, at most that
+    many connections to one host or in total are in use at the same time;
+    further requests wait until a connection is released. If max_idle is
+    given, the connection which has been idle for the longest time is closed
+    when more connections are idle.
+    """
+
+    def __init__(self, max_connections=None, max_connections_per_host=None,
+                 max_idle=None):
+        self.max_connections_per_host = max_connections_per_host
+        if max_connections is None:
+            self.global_max = None
+        else:
+            self.global_max = threading.BoundedSemaphore(max_connections)
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.clists = {}    # identifier: (semaphore, [idle connections])
+        self.order = deque()    # identifiers of idle connections, oldest first
+        self.requests = 0
+        self.reused = 0
+        self.stale = 0
+
+    def pop_connection(self, identifier):
+        """
+        Reserve a connection slot for identifier.
+
+        @return: an idle connection of this host or None if a new one has
+                 to be opened. Either way, the slot must be given back with
+                 push_connection() or release().
+        """
+        self.lock.acquire()
+        try:
+            if identifier not in self.clists:
+                if self.max_connections_per_host is None:
+                    hostmax = None
+                else:
+                    hostmax = threading.BoundedSemaphore(
+                        self.max_connections_per_host)
+                self.clists[identifier] = (hostmax, [])
+            hostmax, idle = self.clists[identifier]
+        finally:
+            self.lock.release()
+        # take the host slot first, so threads waiting for a busy host do
+        # not block the global slots other hosts need
+        if hostmax is not None:
+            hostmax.acquire()
+        if self.global_max is not None:
+            self.global_max.acquire()
+        self.lock.acquire()
+        try:
+            self.requests += 1
+            if idle:
+                self.reused += 1
+                self.order.remove(identifier)
+                return idle.pop()
+            return None
+        finally:
+            self.lock.release()
+
+    def push_connection(self, identifier, connection):
+        """Give back a connection slot, keeping connection for reuse."""
+        old = None
+        self.lock.acquire()
+        try:
+            self.clists[identifier][1].append(connection)
+            self.order.append(identifier)
+            if self.max_idle is not None and len(self.order) > self.max_idle:
+                old = self.clists[self.order.popleft()][1].pop(0)
+        finally:
+            self.lock.release()
+        if old is not None:
+            old.close()
+        self.release(identifier)
+
+    def release(self, identifier):
+        """Give back a connection slot whose connection was closed."""
+        if self.global_max is not None:
+            self.global_max.release()
+        hostmax = self.clists[identifier][0]
+        if hostmax is not None:
+            hostmax.release()
+
+    def request(self, identifier, connect, method, url, body=None,
+                headers={}):
+        """
+        Send a request on a connection for identifier and read the status
+        line and headers of the response.
+
+        An idle connection is used if there is one, otherwise connect() is
+        called to open a new one. If the idle connection turns out to be
+        closed by the server (see stale_connection()), the request is sent
+        again on a new connection.
+
+        @return: the connection and the response. The connection slot must be
+                 given back with push_connection() or release() once the
+                 response has been read. If the request fails, the slot is
+                 given back and the error is raised.
+        """
+        connection = self.pop_connection(identifier)
+        try:
+            while True:
+                reused = connection is not None
+                if not reused:
+                    connection = connect()
+                if hasattr(body, 'seek'):
+                    # a streamed body has to be sent from its start again
+                    body.seek(0)
+                sent = False
+                try:
+                    connection.request(method, url, body, headers)
+                    sent = True
+                    return connection, connection.getresponse(buffering=True)
+                except (socket.error, httplib.HTTPException), err:
+                    connection.close()
+                    connection = None
+                    if not (reused and stale_connection(err, sent, body)):
+                        raise
+                    # the server closed the idle connection meanwhile,
+                    # send the request again on a new one
+                    self.lock.acquire()
+                    try:
+                        self.stale += 1
+                    finally:
+                        self.lock.release()
+        except:
+            if connection is not None:
+                connection.close()
+            self.release(identifier)
+            raise
+
+    def close(self):
+        """Close all idle connections."""
+        self.lock.acquire()
+        try:
+            for hostmax, idle in self.clists.itervalues():
+                while idle:
+                    idle.pop().close()
+            self.order.clear()
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """
+        Return a dict with the number of requests, of requests sent on a
+        reused connection, of reused connections found closed by the
+        server, and the reuse rate.
+        """
+        self.lock.acquire()
+        try:
+            return {'requests': self.requests,
+                    'reused': self.reused,
+                    'stale': self.stale,
+                    'reuse_rate': (float(self.reused - self.stale)
+                                   / max(self.requests, 1)),
+                    }
+        finally:
+            self.lock.release()
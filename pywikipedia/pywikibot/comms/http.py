@@ -8,6 +8,7 @@ This module is responsible for
     - Providing a (blocking) interface for HTTP requests
     - Urlencoding all data
     - Basic HTTP error handling
+    - Keeping connections to the wikis alive between requests
 """
 
 #
@@ -18,10 +19,14 @@ This module is responsible for
 
 __version__ = '$Id$'
 
+import httplib
+import socket
+import StringIO
 import urllib2
 
 import config
 from pywikibot import *
+from pywikibot.comms.connectionpool import ConnectionPool
 import wikipedia as pywikibot
 
 # global variables
@@ -58,6 +63,86 @@ class buffered_addinfourl(object):
         return self._buffer[name]
 
 
+class KeepAliveHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+    """
+    urllib2 handler sending HTTP and HTTPS requests on persistent
+    connections taken from a ConnectionPool.
+
+    The response body is read completely before the connection is given
+    back to the pool; the returned response object serves it from memory.
+    """
+
+    def __init__(self, pool):
+        urllib2.HTTPHandler.__init__(self)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.do_pool_open(httplib.HTTPConnection, req)
+
+    def https_open(self, req):
+        return self.do_pool_open(httplib.HTTPSConnection, req)
+
+    def do_pool_open(self, http_class, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        identifier = (req.get_type(), host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        try:
+            connection, r = self.pool.request(
+                identifier, lambda: http_class(host, timeout=req.timeout),
+                req.get_method(), req.get_selector(), req.data, headers)
+        except (socket.error, httplib.HTTPException), err:
+            raise urllib2.URLError(err)
+        try:
+            try:
+                body = r.read()
+            except (socket.error, httplib.HTTPException), err:
+                raise urllib2.URLError(err)
+        except:
+            connection.close()
+            self.pool.release(identifier)
+            raise
+
+        if r.will_close:
+            connection.close()
+            self.pool.release(identifier)
+        else:
+            self.pool.push_connection(identifier, connection)
+
+        resp = urllib2.addinfourl(StringIO.StringIO(body), r.msg,
+                                  req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+def _build_opener():
+    """
+    Return the opener for requests to the wikis. It keeps connections
+    alive unless disabled in config or a proxy is used.
+    """
+    if not config.http_keepalive or config.proxy['host']:
+        return MyURLopener
+    opener = urllib2.build_opener(pywikibot.U2RedirectHandler,
+                                  KeepAliveHandler(pool))
+    for handler in MyURLopener.handlers:
+        if isinstance(handler, urllib2.HTTPBasicAuthHandler):
+            opener.add_handler(handler)
+    opener.addheaders = MyURLopener.addheaders
+    return opener
+
+pool = ConnectionPool(config.http_max_connections,
+                      config.http_max_connections_per_host)
+opener = _build_opener()
+
+
 def request(site, uri, retry=None, sysop=False, data=None, compress=True,
             no_hostname=False, cookie_only=False, refer=None,
             back_response=False):
@@ -116,7 +201,7 @@ def request(site, uri, retry=None, sysop=False, data=None, compress=True,
     while True:
         try:
             req = urllib2.Request(url, data, headers)
-            f = buffered_addinfourl(MyURLopener.open(req))
+            f = buffered_addinfourl(opener.open(req))
 
             # read & info can raise socket.error
             headers = f.info()
@@ -155,6 +240,21 @@ def request(site, uri, retry=None, sysop=False, data=None, compress=True,
                         retry_idle_time = 30
                     continue
                 raise
+            elif e.code in [429, 503] and retry and not no_hostname \
+                 and e.info().get('retry-after'):
+                # The wiki asks us to come back later; hold back all reads
+                # from this site meanwhile
+                retry_attempt += 1
+                if retry_attempt > config.maxretries:
+                    raise MaxTriesExceededError()
+                try:
+                    delay = int(e.info()['retry-after'])
+                except ValueError:
+                    # Retry-After may be given as a HTTP date
+                    delay = 60
+                pywikibot.output(u'HTTPError: %s %s' % (e.code, e.msg))
+                pywikibot.get_throttle.pause(min(max(delay, 1), 300), site=site)
+                continue
             else:
                 pywikibot.output(u"Result: %s %s" % (e.code, e.msg))
                 raise
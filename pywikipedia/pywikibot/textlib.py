@@ -16,6 +16,8 @@ __version__ = '$Id$'
 
 import wikipedia as pywikibot
 import re
+import sre_constants
+import sre_parse
 from HTMLParser import HTMLParser
 import config
 
@@ -34,72 +36,74 @@ def unescape(s):
     return s
 
 
-def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
-                  allowoverlap=False, marker='', site=None):
-    """
-    Return text with 'old' replaced by 'new', ignoring specified types of text.
-
-    Skips occurences of 'old' within exceptions; e.g., within nowiki tags or
-    HTML comments. If caseInsensitive is true, then use case insensitive
-    regex matching. If allowoverlap is true, overlapping occurences are all
-    replaced (watch out when using this, it might lead to infinite loops!).
-
-    Parameters:
-        text            - a unicode string
-        old             - a compiled or uncompiled regular expression
-        new             - a unicode string (which can contain regular
-                          expression references), or a function which takes
-                          a match object as parameter. See parameter repl of
-                          re.sub().
-        exceptions      - a list of strings which signal what to leave out,
-                          e.g. ['math', 'table', 'template']
-        caseInsensitive - a boolean
-        marker          - a string that will be added to the last replacement;
-                          if nothing is changed, it is added at the end
-
-    """
-    if site is None:
-        site = pywikibot.getSite()
-
-    exceptionRegexes = {
-        'comment':      re.compile(r'(?s)<!--.*?-->'),
-        # section headers
-        'header':       re.compile(r'\r?\n=+.+=+ *\r?\n'),
-        # preformatted text
-        'pre':          re.compile(r'(?ism)<pre>.*?</pre>'),
-        'source':       re.compile(r'(?is)<source .*?</source>'),
-        # inline references
-        'ref':          re.compile(r'(?ism)<ref[ >].*?</ref>'),
-        # lines that start with a space are shown in a monospace font and
-        # have whitespace preserved.
-        'startspace':   re.compile(r'(?m)^ (.*?)$'),
-        # tables often have whitespace that is used to improve wiki
-        # source code readability.
-        # TODO: handle nested tables.
-        'table':        re.compile(r'(?ims)^{\|.*?^\|}|<table>.*?</table>'),
-        'hyperlink':    compileLinkR(),
-        'gallery':      re.compile(r'(?is)<gallery.*?>.*?</gallery>'),
-        # this matches internal wikilinks, but also interwiki, categories, and
-        # images.
-        'link':         re.compile(r'\[\[[^\]\|]*(\|[^\]]*)?\]\]'),
+# regular expressions of the text parts named in the exceptions of
+# replaceExcept(), compiled when they are used first
+_exceptionRegexes = {}
+# interwiki link regular expressions per site
+_interwikiRegexes = {}
+# compiled exceptions per site and list of exceptions; regexes given as
+# exceptions are keyed by their pattern and flags, so that callers which
+# compile them on every call don't add a new entry each time
+_compiledExceptions = {}
+# the cache is emptied when it holds more entries
+_MAX_COMPILED_EXCEPTIONS = 100
+
+
+def _getExceptionRegexes(site):
+    """Return the dictionary of named exception regexes for site."""
+    if not _exceptionRegexes:
+        _exceptionRegexes.update({
+            'comment':      re.compile(r'(?s)<!--.*?-->'),
+            # section headers
+            'header':       re.compile(r'\r?\n=+.+=+ *\r?\n'),
+            # preformatted text
+            'pre':          re.compile(r'(?ism)<pre>.*?</pre>'),
+            'source':       re.compile(r'(?is)<source .*?</source>'),
+            # inline references
+            'ref':          re.compile(r'(?ism)<ref[ >].*?</ref>'),
+            # lines that start with a space are shown in a monospace font and
+            # have whitespace preserved.
+            'startspace':   re.compile(r'(?m)^ (.*?)$'),
+            # tables often have whitespace that is used to improve wiki
+            # source code readability.
+            # TODO: handle nested tables.
+            'table':        re.compile(r'(?ims)^{\|.*?^\|}|<table>.*?</table>'),
+            'hyperlink':    compileLinkR(),
+            'gallery':      re.compile(r'(?is)<gallery.*?>.*?</gallery>'),
+            # this matches internal wikilinks, but also interwiki, categories,
+            # and images.
+            'link':         re.compile(r'\[\[[^\]\|]*(\|[^\]]*)?\]\]'),
+            # Wikidata property inclusions
+            'property':     re.compile(r'(?i)\{\{\s*#property:\s*p\d+\s*\}\}'),
+            # Module invocations (currently only Lua)
+            'invoke':       re.compile(r'(?i)\{\{\s*#invoke:.*?}\}'),
+        })
+    if site not in _interwikiRegexes:
         # also finds links to foreign sites with preleading ":"
-        'interwiki':    re.compile(r'(?i)\[\[:?(%s)\s?:[^\]]*\]\][\s]*'
-                                   % '|'.join(site.validLanguageLinks() +
-                                              site.family.obsolete.keys())),
-        # Wikidata property inclusions
-        'property':     re.compile(r'(?i)\{\{\s*#property:\s*p\d+\s*\}\}'),
-        # Module invocations (currently only Lua)
-        'invoke':       re.compile(r'(?i)\{\{\s*#invoke:.*?}\}'),
-
-    }
+        _interwikiRegexes[site] = re.compile(
+            r'(?i)\[\[:?(%s)\s?:[^\]]*\]\][\s]*'
+            % '|'.join(site.validLanguageLinks() +
+                       site.family.obsolete.keys()))
+    regexes = dict(_exceptionRegexes)
+    regexes['interwiki'] = _interwikiRegexes[site]
+    return regexes
 
-    # if we got a string, compile it as a regular expression
-    if isinstance(old, basestring):
-        if caseInsensitive:
-            old = re.compile(old, re.IGNORECASE | re.UNICODE)
-        else:
-            old = re.compile(old)
 
+def _compileExceptions(exceptions, site):
+    """
+    Return the list of regexes for exceptions and whether templates are
+    excepted. The result is cached per site and exceptions.
+    """
+    try:
+        key = (site, tuple([(exc.pattern, exc.flags)
+                            if hasattr(exc, 'pattern') else exc
+                            for exc in exceptions]))
+        if key in _compiledExceptions:
+            return _compiledExceptions[key]
+    except TypeError:
+        # unhashable exceptions
+        key = None
+    exceptionRegexes = _getExceptionRegexes(site)
     dontTouchRegexes = []
     except_templates = False
     for exc in exceptions:
@@ -122,125 +126,486 @@ def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
         else:
             # assume it's a regular expression
             dontTouchRegexes.append(exc)
+    if key is not None:
+        if len(_compiledExceptions) >= _MAX_COMPILED_EXCEPTIONS:
+            _compiledExceptions.clear()
+        _compiledExceptions[key] = (dontTouchRegexes, except_templates)
+    return dontTouchRegexes, except_templates
 
-    # mark templates
-    # don't care about mw variables and parser functions
-    if except_templates:
-        marker1 = findmarker(text)
-        marker2 = findmarker(text, u'##', u'#')
-        Rvalue = re.compile('{{{.+?}}}')
-        Rmarker1 = re.compile('%(mark)s(\d+)%(mark)s' % {'mark': marker1})
-        Rmarker2 = re.compile('%(mark)s(\d+)%(mark)s' % {'mark': marker2})
-        # hide the flat template marker
-        dontTouchRegexes.append(Rmarker1)
-        origin = text
-        values = {}
-        count = 0
-        for m in Rvalue.finditer(text):
-            count += 1
-            # If we have digits between brackets, restoring from dict may fail.
-            # So we need to change the index. We have to search in the origin.
-            while u'}}}%d{{{' % count in origin:
-                count += 1
-            item = m.group()
-            text = text.replace(item, '%s%d%s' % (marker2, count, marker2))
-            values[count] = item
-        inside = {}
-        seen = set()
-        count = 0
-        while TEMP_REGEX.search(text) is not None:
-            for m in TEMP_REGEX.finditer(text):
-                item = m.group()
-                if item in seen:
-                    continue  # speed up
-                seen.add(item)
-                count += 1
-                while u'}}%d{{' % count in origin:
-                    count += 1
-                text = text.replace(item, '%s%d%s' % (marker1, count, marker1))
-
-                # Make sure stored templates don't contain markers
-                for m2 in Rmarker1.finditer(item):
-                    item = item.replace(m2.group(), inside[int(m2.group(1))])
-                for m2 in Rmarker2.finditer(item):
-                    item = item.replace(m2.group(), values[int(m2.group(1))])
-                inside[count] = item
-    index = 0
-    markerpos = len(text)
-    while True:
-        match = old.search(text, index)
-        if not match:
-            # nothing left to replace
-            break
-
-        # check which exception will occur next.
-        nextExceptionMatch = None
-        for dontTouchR in dontTouchRegexes:
-            excMatch = dontTouchR.search(text, index)
-            if excMatch and (
-                    nextExceptionMatch is None or
-                    excMatch.start() < nextExceptionMatch.start()):
-                nextExceptionMatch = excMatch
-
-        if nextExceptionMatch is not None \
-                and nextExceptionMatch.start() <= match.start():
-            # an HTML comment or text in nowiki tags stands before the next
-            # valid match. Skip.
-            index = nextExceptionMatch.end()
-        else:
-            # We found a valid match. Replace it.
-            if callable(new):
-                # the parameter new can be a function which takes the match
-                # as a parameter.
-                replacement = new(match)
+
+_GROUP_REF = re.compile(r'\\(?P<number>\d+)|\\g<(?P<name>.+?)>')
+
+
+def _expandGroups(new):
+    """
+    Return a function which returns the replacement string new for a match,
+    with regex group references such as \\2 or \\g<name> filled in.
+    """
+    # We cannot just use match.expand(), as it would also process escapes.
+    # Using old.sub() on the matched text does not work either because it
+    # can't handle lookahead or lookbehind (see bug #1731008).
+    # So new is split into literal parts and group references once.
+    parts = []
+    last = 0
+    for groupMatch in _GROUP_REF.finditer(new):
+        parts.append(new[last:groupMatch.start()])
+        parts.append(groupMatch.group('name') or
+                     int(groupMatch.group('number')))
+        last = groupMatch.end()
+    parts.append(new[last:])
+    if len(parts) == 1:
+        return lambda match: new
+
+    def expand(match):
+        replacement = [parts[0]]
+        for i in xrange(1, len(parts), 2):
+            groupID = parts[i]
+            try:
+                replacement.append(match.group(groupID))
+            except IndexError:
+                print '\nInvalid group reference:', groupID
+                print 'Groups found:\n', match.groups()
+                raise IndexError
+            replacement.append(parts[i + 1])
+        return ''.join(replacement)
+    return expand
+
+
+class _ExceptionFinder(object):
+    """
+    Find the excepted parts of a text from left to right.
+
+    The next match of every exception regex is kept; a regex is searched
+    again only when the position has passed the start of its match. This
+    gives the same matches as searching all regexes from every position,
+    so a match starting inside an earlier excepted part does not hide the
+    excepted part behind it.
+    """
+
+    def __init__(self, regexes, text):
+        self.regexes = regexes
+        self.text = text
+        self.matches = [regex.search(text) for regex in regexes]
+
+    def next(self, index):
+        """Return the first match of an exception regex from index on."""
+        first = None
+        for i, match in enumerate(self.matches):
+            if match is not None and match.start() < index:
+                match = self.matches[i] = self.regexes[i].search(self.text,
+                                                                 index)
+            if match is not None and (first is None
+                                      or match.start() < first.start()):
+                first = match
+        return first
+
+
+class Replacer(object):
+    """
+    Replace text while ignoring specified types of text, see replaceExcept().
+
+    The exception regexes are compiled once per site and set of exceptions,
+    so a Replacer should be used to apply many replacements to the same text:
+
+        replacer = Replacer(['comment', 'nowiki'])
+        for old, new in replacements:
+            text = replacer.replace(text, old, new)
+
+    or, hiding the templates only once if they are excepted:
+
+        text = replacer.replaceAll(text, replacements)
+
+    """
+
+    def __init__(self, exceptions, caseInsensitive=False, allowoverlap=False,
+                 site=None):
+        if site is None:
+            site = pywikibot.getSite()
+        self.caseInsensitive = caseInsensitive
+        self.allowoverlap = allowoverlap
+        self.regexes, self.except_templates = _compileExceptions(exceptions,
+                                                                 site)
+        self._hidden = None
+
+    def replace(self, text, old, new, marker=''):
+        """Return text with 'old' replaced by 'new' outside of exceptions.
+
+        marker is added to the last replacement; if nothing is changed, it
+        is added at the end.
+
+        """
+        return self.replaceAll(text, [(old, new)], marker)
+
+    def replaceAll(self, text, replacements, marker=''):
+        """Return text with all (old, new) replacements applied in turn.
+
+        replacements can be a list or a ReplacementIndex, which skips the
+        replacements that can't apply to text.
+
+        marker is added to the last replacement of the last (old, new) pair
+        which changed something; if nothing is changed, it is added at the
+        end.
+
+        """
+        if self.except_templates:
+            text, hidden = self._hideTemplates(text)
+        markerpos = None
+        candidates = None
+        if isinstance(replacements, ReplacementIndex):
+            candidates = replacements.candidates(text)
+        for i, (old, new) in enumerate(replacements):
+            if candidates is not None and i not in candidates:
+                continue
+            text, pos = self._replace(text, old, new)
+            if pos is not None:
+                markerpos = pos
+                if candidates is not None:
+                    # the replacement may have made others applicable
+                    candidates = replacements.candidates(text)
+        if markerpos is None:
+            markerpos = len(text)
+        text = text[:markerpos] + marker + text[markerpos:]
+        if self.except_templates:
+            text = self._restoreTemplates(text, hidden)
+        return text
+
+    def _exceptions(self, text):
+        return _ExceptionFinder(self.regexes + self._extraRegexes(), text)
+
+    def _extraRegexes(self):
+        if self.except_templates and self._hidden:
+            # hide the flat template marker
+            return [self._hidden[0]]
+        return []
+
+    def _replace(self, text, old, new):
+        """
+        Replace old by new in text. Return the new text and the position
+        for the marker or None if nothing was replaced.
+        """
+        # if we got a string, compile it as a regular expression
+        if isinstance(old, basestring):
+            if self.caseInsensitive:
+                old = re.compile(old, re.IGNORECASE | re.UNICODE)
             else:
-                # it is not a function, but a string.
-
-                # it is a little hack to make \n work. It would be better
-                # to fix it previously, but better than nothing.
-                new = new.replace('\\n', '\n')
-
-                # We cannot just insert the new string, as it may contain regex
-                # group references such as \2 or \g<name>.
-                # On the other hand, this approach does not work because it
-                # can't handle lookahead or lookbehind (see bug #1731008):
-                #replacement = old.sub(new, text[match.start():match.end()])
-                #text = text[:match.start()] + replacement + text[match.end():]
-
-                # So we have to process the group references manually.
-                replacement = new
-
-                groupR = re.compile(r'\\(?P<number>\d+)|\\g<(?P<name>.+?)>')
-                while True:
-                    groupMatch = groupR.search(replacement)
-                    if not groupMatch:
-                        break
-                    groupID = groupMatch.group('name') or \
-                              int(groupMatch.group('number'))
-                    try:
-                        replacement = replacement[:groupMatch.start()] + \
-                                      match.group(groupID) + \
-                                      replacement[groupMatch.end():]
-                    except IndexError:
-                        print '\nInvalid group reference:', groupID
-                        print 'Groups found:\n', match.groups()
-                        raise IndexError
-            text = text[:match.start()] + replacement + text[match.end():]
+                old = re.compile(old)
+
+        # the parameter new can be a function which takes the match as a
+        # parameter; a string is turned into such a function.
+        if not callable(new):
+            # it is a little hack to make \n work. It would be better
+            # to fix it previously, but better than nothing.
+            new = _expandGroups(new.replace('\\n', '\n'))
+
+        if self.allowoverlap:
+            return self._replaceOverlapping(text, old, new)
+
+        exceptions = self._exceptions(text)
+        # the output is collected in pieces and joined once; the matches
+        # and the excepted parts are both searched in the original text
+        # from left to right.
+        pieces = []
+        length = 0
+        last = 0
+        index = 0
+        while True:
+            match = old.search(text, index)
+            if not match:
+                # nothing left to replace
+                break
+
+            # check which exception will occur next.
+            exception = exceptions.next(index)
+            if exception is not None and exception.start() <= match.start():
+                # an HTML comment or text in nowiki tags stands before the
+                # next valid match. Skip.
+                index = exception.end()
+                continue
 
+            # We found a valid match. Replace it.
+            replacement = new(match)
+            pieces.append(text[last:match.start()])
+            pieces.append(replacement)
+            length += match.start() - last + len(replacement)
+            last = match.end()
             # continue the search on the remaining text
-            if allowoverlap:
-                index = match.start() + 1
-            else:
-                index = match.start() + len(replacement)
+            index = match.end()
+            if match.start() == match.end():
+                # don't find an empty match at the same place again
+                if index == len(text):
+                    break
+                pieces.append(text[index])
+                length += 1
+                last = index = index + 1
+        if not pieces:
+            return text, None
+        pieces.append(text[last:])
+        return ''.join(pieces), length
+
+    def _replaceOverlapping(self, text, old, new):
+        """
+        Like _replace(), but continue the search within each replacement,
+        so the text has to be searched again after every replacement.
+        """
+        exceptions = self._exceptions(text)
+        index = 0
+        markerpos = None
+        while True:
+            match = old.search(text, index)
+            if not match:
+                break
+            exception = exceptions.next(index)
+            if exception is not None and exception.start() <= match.start():
+                index = exception.end()
+                continue
+            replacement = new(match)
+            text = text[:match.start()] + replacement + text[match.end():]
+            index = match.start() + 1
+            # the search continues within the replacement, so look for
+            # the exceptions in the new text
+            exceptions = self._exceptions(text)
             markerpos = match.start() + len(replacement)
-    text = text[:markerpos] + marker + text[markerpos:]
+        return text, markerpos
 
-    if except_templates:  # restore templates from dict
-        for m2 in Rmarker1.finditer(text):
-            text = text.replace(m2.group(), inside[int(m2.group(1))])
-        for m2 in Rmarker2.finditer(text):
-            text = text.replace(m2.group(), values[int(m2.group(1))])
-    return text
+    def _hideTemplates(self, text):
+        """
+        Replace templates and template parameters by markers, so that they
+        are excepted. Return the text and the data needed to restore them.
+        """
+        marker = findmarker(text)
+        Rmarker = re.compile('%(mark)s(\d+)%(mark)s' % {'mark': marker})
+        inside = {}
+        pieces = []
+        last = 0
+        for count, template in enumerate(parse_templates(text)):
+            pieces.append(text[last:template.start])
+            pieces.append('%s%d%s' % (marker, count, marker))
+            inside[count] = template.wikitext()
+            last = template.end
+        pieces.append(text[last:])
+        self._hidden = (Rmarker, inside)
+        return ''.join(pieces), self._hidden
+
+    def _restoreTemplates(self, text, hidden):
+        """Restore the templates hidden by _hideTemplates()."""
+        Rmarker, inside = hidden
+        text = Rmarker.sub(lambda m: inside[int(m.group(1))], text)
+        self._hidden = None
+        return text
+
+
+# at most this many alternative literals are derived from a regex
+_MAX_LITERALS = 32
+
+
+def _betterLiterals(a, b):
+    """Return the better of two lists of alternative literals."""
+    def quality(literals):
+        if not literals or len(literals) > _MAX_LITERALS:
+            return (0, 0)
+        return (min([len(s) for s in literals]), -len(literals))
+    if quality(b) > quality(a):
+        return b
+    return a
+
+
+def _sequenceLiterals(items, ignorecase):
+    """
+    Return a list of strings one of which must occur in every match of the
+    parsed regex items, or None.
+    """
+    best = None
+    # alternatives of the literal text matched by the current items
+    run = [u'']
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            char = unichr(av)
+            if ignorecase:
+                char = char.lower()
+            run = [s + char for s in run]
+            continue
+        elif op == sre_constants.AT:
+            # \b, ^ and $ don't consume text
+            continue
+        elif op == sre_constants.IN and \
+                len(run) * len(av) <= _MAX_LITERALS and \
+                [1 for op2, av2 in av if op2 != sre_constants.LITERAL] == []:
+            # a small character class like [Tt]
+            chars = set([unichr(av2) for op2, av2 in av])
+            if ignorecase:
+                chars = set([char.lower() for char in chars])
+            run = [s + char for s in run for char in chars]
+            continue
+        best = _betterLiterals(best, run)
+        run = [u'']
+        if op == sre_constants.SUBPATTERN:
+            best = _betterLiterals(best, _sequenceLiterals(av[1], ignorecase))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) \
+                and av[0] >= 1:
+            best = _betterLiterals(best, _sequenceLiterals(av[2], ignorecase))
+        elif op == sre_constants.BRANCH:
+            literals = []
+            for branch in av[1]:
+                branchLiterals = _sequenceLiterals(branch, ignorecase)
+                if not branchLiterals:
+                    break
+                literals.extend(branchLiterals)
+            else:
+                best = _betterLiterals(best, list(set(literals)))
+    return _betterLiterals(best, run)
+
+
+def requiredLiterals(regex):
+    """
+    Return a list of strings, one of which occurs in every match of the
+    compiled regex, or None if no such strings of at least two characters
+    can be found. With re.IGNORECASE, the strings are lowercase and have to
+    be searched in the lowercased text.
+    """
+    if regex.flags & re.LOCALE:
+        return None
+    try:
+        items = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return None
+    literals = _sequenceLiterals(items, regex.flags & re.IGNORECASE)
+    if not literals or len(literals) > _MAX_LITERALS \
+            or min([len(s) for s in literals]) < 2:
+        return None
+    return literals
+
+
+class LiteralIndex(object):
+    """Find which of many strings occur in a text with a single scan.
+
+    The strings are compiled to one regex with a trie of their characters,
+    which is tried at every position of the text.
+
+    """
+
+    def __init__(self, strings):
+        self.strings = set(strings)
+        trie = {}
+        for s in self.strings:
+            node = trie
+            for char in s:
+                node = node.setdefault(char, {})
+            node[''] = True
+        self.regex = re.compile(u'(?=(%s))' % self._trieRegex(trie),
+                                re.UNICODE)
+        # the longest string found at a position also tells which of its
+        # prefixes occur there
+        self._prefixes = {}
+        for s in self.strings:
+            self._prefixes[s] = [p for p in self.strings if s.startswith(p)]
+
+    def _trieRegex(self, trie):
+        alternatives = [re.escape(char) + self._trieRegex(trie[char])
+                        for char in sorted(trie) if char]
+        if not alternatives:
+            return u''
+        if len(alternatives) == 1 and '' not in trie:
+            return alternatives[0]
+        regex = u'(?:%s)' % u'|'.join(alternatives)
+        if '' in trie:
+            # greedy, so the longest string is found
+            regex += u'?'
+        return regex
+
+    def find(self, text):
+        """Return the set of the strings which occur in text."""
+        found = set()
+        if not self.strings:
+            return found
+        for longest in set(self.regex.findall(text)):
+            found.update(self._prefixes[longest])
+        return found
+
+
+class ReplacementIndex(object):
+    """A list of replacements which knows which of them can apply to a text.
+
+    For each regex, strings which occur in all its matches are derived from
+    it, and all of them are searched at once with a LiteralIndex. Only the
+    replacements whose strings occur in a text, or for which none could be
+    derived, are tried on it. This makes a large set of replacements, e.g.
+    of fixes.py, nearly as fast as a single one for pages which don't need
+    most of them.
+
+    It can be iterated like the list of (old, new) tuples and be passed to
+    Replacer.replaceAll().
+
+    """
+
+    def __init__(self, replacements, caseInsensitive=False):
+        self.replacements = []
+        # indices of the replacements which have to be tried on all texts
+        self._always = set()
+        # literal -> indices of the replacements which need it
+        self._needed = ({}, {})
+        for i, (old, new) in enumerate(replacements):
+            # if we got a string, compile it as a regular expression
+            if isinstance(old, basestring):
+                if caseInsensitive:
+                    old = re.compile(old, re.IGNORECASE | re.UNICODE)
+                else:
+                    old = re.compile(old)
+            self.replacements.append((old, new))
+            literals = requiredLiterals(old)
+            if literals is None:
+                self._always.add(i)
+                continue
+            needed = self._needed[bool(old.flags & re.IGNORECASE)]
+            for literal in literals:
+                needed.setdefault(literal, []).append(i)
+        self._indexes = (LiteralIndex(self._needed[0]),
+                         LiteralIndex(self._needed[1]))
+
+    def __iter__(self):
+        return iter(self.replacements)
+
+    def __len__(self):
+        return len(self.replacements)
+
+    def candidates(self, text):
+        """Return the set of indices of the replacements to try on text."""
+        result = set(self._always)
+        for literal in self._indexes[0].find(text):
+            result.update(self._needed[0][literal])
+        if self._needed[1]:
+            for literal in self._indexes[1].find(text.lower()):
+                result.update(self._needed[1][literal])
+        return result
+
+
+def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
+                  allowoverlap=False, marker='', site=None):
+    """
+    Return text with 'old' replaced by 'new', ignoring specified types of text.
+
+    Skips occurences of 'old' within exceptions; e.g., within nowiki tags or
+    HTML comments. If caseInsensitive is true, then use case insensitive
+    regex matching. If allowoverlap is true, overlapping occurences are all
+    replaced (watch out when using this, it might lead to infinite loops!).
+
+    To apply many replacements with the same exceptions, use a Replacer.
+
+    Parameters:
+        text            - a unicode string
+        old             - a compiled or uncompiled regular expression
+        new             - a unicode string (which can contain regular
+                          expression references), or a function which takes
+                          a match object as parameter. See parameter repl of
+                          re.sub().
+        exceptions      - a list of strings which signal what to leave out,
+                          e.g. ['math', 'table', 'template']
+        caseInsensitive - a boolean
+        marker          - a string that will be added to the last replacement;
+                          if nothing is changed, it is added at the end
+
+    """
+    return Replacer(exceptions, caseInsensitive, allowoverlap,
+                    site).replace(text, old, new, marker)
 
 
 def removeDisabledParts(text, tags=['*']):
@@ -881,6 +1246,182 @@ def compileLinkR(withoutBracketed=False, onlyBracketed=False):
 # Functions dealing with templates
 #----------------------------------
 
+# tokens of template syntax: runs of braces, link brackets, parameter
+# separators and math tags, whose content is not parsed
+_TEMPLATE_TOKEN_REGEX = re.compile(ur'\{\{+|\}\}+|\[\[|\]\]|\||=|<math>[^<]+</math>')
+
+
+class TemplateNode(object):
+    """A template {{...}} or template parameter {{{...}}} in a text.
+
+    Instances are created by parse_templates(). Attributes:
+
+        text     - the text which was parsed
+        start    - position of the opening braces in text
+        end      - position after the closing braces in text
+        isValue  - True for template parameters {{{...}}}
+        parts    - list of (start, end, equals) for the name and every
+                   parameter, i.e. for each text part between the braces
+                   separated by '|'; equals is the position of the first
+                   '=' of a parameter outside of nested templates and links
+                   or None
+        children - the templates and template parameters inside of this one
+
+    """
+
+    def __init__(self, text, start, end, isValue, parts, children):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.isValue = isValue
+        self.parts = parts
+        self.children = children
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.wikitext())
+
+    def wikitext(self):
+        """Return the text of the template including its braces."""
+        return self.text[self.start:self.end]
+
+    def name(self):
+        """Return the stripped name of the template without 'msg:'."""
+        start, end, equals = self.parts[0]
+        if self.text.startswith('msg:', start, end):
+            start += 4
+        return self.text[start:end].strip()
+
+    def hasDynamicName(self):
+        """Return True if the name contains templates or math tags."""
+        nameEnd = self.parts[0][1]
+        for child in self.children:
+            if child.start < nameEnd:
+                return True
+        return '<math>' in self.text[self.parts[0][0]:nameEnd]
+
+    def params(self, named=True):
+        """Return the parameters as a list of (name, value) tuples.
+
+        name is None for unnamed parameters or if named is False; name and
+        value are not stripped.
+
+        """
+        result = []
+        for start, end, equals in self.parts[1:]:
+            if named and equals is not None:
+                result.append((self.text[start:equals],
+                               self.text[equals + 1:end]))
+            else:
+                result.append((None, self.text[start:end]))
+        return result
+
+    def walk(self):
+        """Yield all nested templates and then this one.
+
+        The templates are yielded in the order of their ends in the text.
+
+        """
+        for child in self.children:
+            for node in child.walk():
+                yield node
+        yield self
+
+
+class _TemplateFrame(object):
+    """An opened run of braces or link on the stack of parse_templates()."""
+
+    def __init__(self, start, count):
+        self.start = start
+        # number of opening braces, 0 for links
+        self.count = count
+        if count:
+            self.parts = [[start + count, None, None]]
+            self.children = []
+
+
+def parse_templates(text):
+    """Return the templates and template parameters found in text.
+
+    The text is scanned once, so this takes linear time. Return value is a
+    list of TemplateNode objects for the outermost templates, in the order
+    of the text; nested templates are found in their children. Like
+    MediaWiki, a run of more than three braces is closed from the inside
+    and braces which are not closed are ordinary text.
+
+    Comments and nowiki tags are not removed; use removeDisabledParts() on
+    text before if they should be ignored.
+
+    """
+    result = []
+    stack = []
+    # number of brace frames on the stack
+    braces = 0
+    for m in _TEMPLATE_TOKEN_REGEX.finditer(text):
+        token = m.group()
+        top = stack and stack[-1] or None
+        if token[0] == '{':
+            stack.append(_TemplateFrame(m.start(), len(token)))
+            braces += 1
+        elif token == '[[':
+            stack.append(_TemplateFrame(m.start(), 0))
+        elif token == '|':
+            if top is not None and top.count:
+                top.parts[-1][1] = m.start()
+                top.parts.append([m.end(), None, None])
+        elif token == '=':
+            if top is not None and top.count and len(top.parts) > 1 \
+                    and top.parts[-1][2] is None:
+                top.parts[-1][2] = m.start()
+        elif token == ']]':
+            if top is not None and not top.count:
+                stack.pop()
+        elif token[0] == '}':
+            pos = m.start()
+            closing = len(token)
+            while closing >= 2:
+                if not braces:
+                    break
+                # a link which is not closed is ordinary text
+                while not stack[-1].count:
+                    stack.pop()
+                top = stack[-1]
+                count = min(closing, top.count)
+                if count > 3:
+                    count = 3
+                top.parts[-1][1] = pos
+                node = TemplateNode(text, top.start + top.count - count,
+                                    pos + count, count == 3,
+                                    [tuple(part) for part in top.parts],
+                                    top.children)
+                pos += count
+                closing -= count
+                top.count -= count
+                if top.count < 2:
+                    # a single remaining brace is ordinary text
+                    stack.pop()
+                    braces -= 1
+                    _addTemplateNodes(stack, result, [node])
+                else:
+                    # the remaining braces enclose the closed template
+                    top.parts = [[top.start + top.count, None, None]]
+                    top.children = [node]
+    # templates within braces which are not closed
+    for frame in stack:
+        if frame.count:
+            result.extend(frame.children)
+    result.sort(key=lambda node: node.start)
+    return result
+
+
+def _addTemplateNodes(stack, result, nodes):
+    """Add nodes to the innermost opened template or to the result."""
+    for frame in reversed(stack):
+        if frame.count:
+            frame.children.extend(nodes)
+            return
+    result.extend(nodes)
+
+
 def extract_templates_and_params(text, asList=False):
     """Return a list of templates found in text.
 
@@ -893,6 +1434,7 @@ def extract_templates_and_params(text, asList=False):
     integer value corresponding to its position among the unnamed parameters,
     and if this results multiple parameters with the same name, only the last
     value provided will be returned.
+    Nested templates are listed before the templates containing them.
 
     @param text: The wikitext from which templates are extracted
     @type text: unicode or string
@@ -903,80 +1445,17 @@ def extract_templates_and_params(text, asList=False):
     # remove commented-out stuff etc.
     thistxt = removeDisabledParts(text)
 
-    # marker for inside templates or parameters
-    marker1 = findmarker(thistxt)
-
-    # marker for links
-    marker2 = findmarker(thistxt, u'##', u'#')
-
-    # marker for math
-    marker3 = findmarker(thistxt, u'%%', u'%')
-
-    # marker for value parameter
-    marker4 = findmarker(thistxt, u'§§', u'§')
-
     result = []
-    Rmath = re.compile(ur'<math>[^<]+</math>')
-    Rvalue = re.compile(r'{{{.+?}}}')
-    Rmarker1 = re.compile(ur'%s(\d+)%s' % (marker1, marker1))
-    Rmarker2 = re.compile(ur'%s(\d+)%s' % (marker2, marker2))
-    Rmarker3 = re.compile(ur'%s(\d+)%s' % (marker3, marker3))
-    Rmarker4 = re.compile(ur'%s(\d+)%s' % (marker4, marker4))
-
-    # Replace math with markers
-    maths = {}
-    count = 0
-    for m in Rmath.finditer(thistxt):
-        count += 1
-        item = m.group()
-        thistxt = thistxt.replace(item, '%s%d%s' % (marker3, count, marker3))
-        maths[count] = item
-
-    values = {}
-    count = 0
-    for m in Rvalue.finditer(thistxt):
-        count += 1
-        # If we have digits between brackets, restoring from dict may fail.
-        # So we need to change the index. We have to search in the origin text.
-        while u'}}}%d{{{' % count in text:
-            count += 1
-        item = m.group()
-        thistxt = thistxt.replace(item, '%s%d%s' % (marker4, count, marker4))
-        values[count] = item
-
-    inside = {}
-    seen = set()
-    count = 0
-    while TEMP_REGEX.search(thistxt) is not None:
-        for m in TEMP_REGEX.finditer(thistxt):
-            # Make sure it is not detected again
-            item = m.group()
-            if item in seen:
-                continue  # speed up
-            seen.add(item)
-            count += 1
-            while u'}}%d{{' % count in text:
-                count += 1
-            thistxt = thistxt.replace(item,
-                                      '%s%d%s' % (marker1, count, marker1))
-
-            # Make sure stored templates don't contain markers
-            for m2 in Rmarker1.finditer(item):
-                item = item.replace(m2.group(), inside[int(m2.group(1))])
-            for m2 in Rmarker3.finditer(item):
-                item = item.replace(m2.group(), maths[int(m2.group(1))])
-            for m2 in Rmarker4.finditer(item):
-                item = item.replace(m2.group(), values[int(m2.group(1))])
-            inside[count] = item
-
-            # Name
-            name = m.group('name').strip()
-            m2 = Rmarker1.search(name) or Rmath.search(name)
-            if m2 is not None:
+    for template in parse_templates(thistxt):
+        for node in template.walk():
+            if node.isValue or node.hasDynamicName():
                 # Doesn't detect templates whose name changes,
                 # or templates whose name contains math tags
                 continue
 
+            # Name
+            name = node.name()
+
             # {{#if: }}
             if not name or name.startswith('#'):
                 continue
@@ -1006,49 +1485,20 @@ def extract_templates_and_params(text, asList=False):
 ##                continue
 
             # Parameters
-            paramString = m.group('params')
-            params = {}
-            numbered_param = 1
-            if paramString:
-                # Replace wikilinks with markers
-                links = {}
-                count2 = 0
-                for m2 in pywikibot.Rlink.finditer(paramString):
-                    count2 += 1
-                    item = m2.group(0)
-                    paramString = paramString.replace(
-                        item, '%s%d%s' % (marker2, count2, marker2))
-                    links[count2] = item
-                # Parse string
-                markedParams = paramString.split('|')
-                # Replace markers
-                for param in markedParams:
-                    if not asList and "=" in param:
-                        param_name, param_val = param.split("=", 1)
-                    else:
+            if asList:
+                params = [param_val.strip()
+                          for param_name, param_val in node.params(False)]
+            else:
+                params = {}
+                numbered_param = 1
+                for param_name, param_val in node.params():
+                    if param_name is None:
                         param_name = unicode(numbered_param)
-                        param_val = param
                         numbered_param += 1
-                    count = len(inside)
-                    for m2 in Rmarker1.finditer(param_val):
-                        param_val = param_val.replace(m2.group(),
-                                                      inside[int(m2.group(1))])
-                    for m2 in Rmarker2.finditer(param_val):
-                        param_val = param_val.replace(m2.group(),
-                                                      links[int(m2.group(1))])
-                    for m2 in Rmarker3.finditer(param_val):
-                        param_val = param_val.replace(m2.group(),
-                                                      maths[int(m2.group(1))])
-                    for m2 in Rmarker4.finditer(param_val):
-                        param_val = param_val.replace(m2.group(),
-                                                      values[int(m2.group(1))])
                     params[param_name.strip()] = param_val.strip()
 
             # Add it to the result
-            if asList:
-                result.append((name, params.values()))
-            else:
-                result.append((name, params))
+            result.append((name, params))
     return result
 
 
@@ -3,7 +3,7 @@
 Mechanics to slow down wiki read and/or write rate.
 """
 #
-# (C) Pywikipedia bot team, 2008
+# (C) Pywikipedia bot team, 2008-2013
 #
 # Distributed under the terms of the MIT license.
 #
@@ -13,6 +13,7 @@ import wikipedia as pywikibot
 import config
 
 import math
+import sqlite3
 import threading
 import time
 
@@ -22,11 +23,82 @@ pid = False     # global process identifier
                 # throttle objects created by this process.
 
 
+class TokenBucket(object):
+    """Token bucket of one host for either read or write access.
+
+    A token is refilled every 'delay' seconds, up to 'capacity' tokens.
+    Every request takes one token; if none is left, the request has to wait
+    until the next token is due. Tokens are reserved before waiting, so the
+    bucket is not locked while a thread sleeps and concurrent requests are
+    spaced out one after another.
+
+    """
+    def __init__(self, capacity=1):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.time()
+
+    def refill(self, delay):
+        """Add the tokens due since the last call at the given delay.
+
+        The caller must hold the lock of the Throttle owning this bucket.
+
+        """
+        now = time.time()
+        if delay > 0:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.last) / delay)
+        else:
+            self.tokens = self.capacity
+        self.last = now
+
+    def reserve(self, delay, cost=1.0):
+        """Take cost tokens and return the seconds to wait before the request.
+
+        The first token is needed for this request; the remainder of cost
+        is charged to the following requests. The caller must hold the lock
+        of the Throttle owning this bucket.
+
+        """
+        self.refill(delay)
+        self.tokens -= 1
+        wait = max(0.0, -self.tokens * delay)
+        self.tokens -= max(0.0, cost - 1)
+        return wait
+
+    def waittime(self, delay):
+        """Return the seconds a request would have to wait right now."""
+        if delay <= 0:
+            return 0.0
+        tokens = min(self.capacity,
+                     self.tokens + (time.time() - self.last) / delay)
+        return max(0.0, (1 - tokens) * delay)
+
+
+class _HostState(object):
+    """For internal use only - the throttle state of a single host."""
+    def __init__(self, capacity):
+        self.read = TokenBucket(capacity)
+        self.write = TokenBucket(capacity)
+        self.process_multiplicity = 1
+        self.checktime = 0
+        self.backoff = 1.0        # delay factor raised by server lag
+        self.pausedUntil = 0.0    # no requests before this time
+
+
 class Throttle(object):
-    """Control rate of access to wiki server
+    """Control rate of access to wiki servers
+
+    Calling this object blocks the calling thread until the host of the
+    given site (default: the home wiki) may be accessed again. Every host
+    has its own token buckets for read and for write access, so a bot
+    working on many wikis is not slowed down to the rate of a single one.
 
-    Calling this object blocks the calling thread until at least 'delay'
-    seconds have passed since the previous call.
+    The delays are multiplied by the number of bot processes working on the
+    same host. These processes are registered in a small sqlite database
+    shared by all bots using the same base directory. Server lag reported by
+    the wiki (see pause()) delays all further requests to that
+    host and lowers its rate until the lag is gone.
 
     The framework initiates two Throttle objects: get_throttle to control
     the rate of read access, and put_throttle to control the rate of write
@@ -34,10 +106,10 @@ class Throttle(object):
 
     """
     def __init__(self, mindelay=None, maxdelay=None, writedelay=None,
-                 multiplydelay=True, verbosedelay=False, write=False):
+                 multiplydelay=True, verbosedelay=False, write=False,
+                 burst=None):
         self.lock = threading.RLock()
-        self.mysite = None
-        self.ctrlfilename = config.datafilepath('pywikibot', 'throttle.ctrl')
+        self.ctrlfilename = config.datafilepath('pywikibot', 'throttle.db')
         self.mindelay = mindelay
         if self.mindelay is None:
             self.mindelay = config.minthrottle
@@ -47,86 +119,84 @@ class Throttle(object):
         self.writedelay = writedelay
         if self.writedelay is None:
             self.writedelay = config.put_throttle
-        self.last_read = 0
-        self.last_write = 0
-        self.next_multiplicity = 1.0
+        self.burst = burst
+        if self.burst is None:
+            self.burst = config.throttle_burst
+        self.hosts = {}
         self.checkdelay = 120  # Check logfile again after this many seconds
         self.dropdelay = 360   # Ignore processes that have not made
                                # a check in this many seconds
         self.releasepid = 1200 # Free the process id after this many seconds
-        self.lastwait = 0.0
         self.delay = 0
-        self.checktime = 0
         self.verbosedelay = verbosedelay
         self.multiplydelay = multiplydelay
-        if self.multiplydelay:
-            self.checkMultiplicity()
         self.setDelay()
         self.write = write
 
-    def checkMultiplicity(self):
-        """Count running processes for site and set process_multiplicity."""
+    def _host(self, site):
+        """Return the host name of site, default is the home wiki."""
+        if site is None:
+            site = pywikibot.getSite()
+        return site.hostname()
+
+    def _state(self, host):
+        """Return the _HostState of host; the caller must hold the lock."""
+        if host not in self.hosts:
+            self.hosts[host] = _HostState(self.burst)
+        state = self.hosts[host]
+        if self.multiplydelay and \
+           time.time() > state.checktime + self.checkdelay:
+            self.checkMultiplicity(host)
+        return state
+
+    def _connect(self):
+        db = sqlite3.connect(self.ctrlfilename, timeout=30)
+        db.execute('CREATE TABLE IF NOT EXISTS processes ('
+                   'pid INTEGER, site TEXT, time REAL, '
+                   'PRIMARY KEY (pid, site))')
+        return db
+
+    def checkMultiplicity(self, host=None):
+        """Count running processes for host and set process_multiplicity."""
         global pid
+        if host is None:
+            host = self._host(None)
         self.lock.acquire()
-        mysite = self.mysite = str(pywikibot.getSite())
-        if pywikibot.verbose:
-            pywikibot.output(u"Checking multiplicity: pid = %(pid)s" % globals())
         try:
-            processes = []
-            my_pid = pid or 1  # start at 1 if global pid not yet set
-            count = 1
-            # open throttle.log
+            state = self.hosts.setdefault(host, _HostState(self.burst))
+            if pywikibot.verbose:
+                pywikibot.output(u"Checking multiplicity: pid = %(pid)s"
+                                 % globals())
+            now = time.time()
             try:
-                f = open(self.ctrlfilename, 'r')
-            except IOError:
+                db = self._connect()
+                try:
+                    db.execute('DELETE FROM processes WHERE time < ?',
+                               (now - self.releasepid,))
+                    if not pid:
+                        # next unused process id, start at 1
+                        pid = (db.execute('SELECT MAX(pid) FROM processes'
+                                          ).fetchone()[0] or 0) + 1
+                    db.execute('INSERT OR REPLACE INTO processes '
+                               'VALUES (?, ?, ?)', (pid, host, now))
+                    count = db.execute('SELECT COUNT(*) FROM processes '
+                                       'WHERE site = ? AND time >= ?',
+                                       (host, now - self.dropdelay)
+                                       ).fetchone()[0]
+                    db.commit()
+                finally:
+                    db.close()
+            except sqlite3.Error:
+                # Sometimes the database is locked or corrupted;
+                # assume we are alone
                 if not pid:
-                    pass
-                else:
-                    raise
-            else:
-                now = time.time()
-                for line in f.readlines():
-                    # parse line; format is "pid timestamp site"
-                    try:
-                        line = line.split(' ')
-                        this_pid = int(line[0])
-                        ptime = int(line[1].split('.')[0])
-                        this_site = line[2].rstrip()
-                    except (IndexError, ValueError):
-                        continue    # Sometimes the file gets corrupted
-                                    # ignore that line
-                    if now - ptime > self.releasepid:
-                        continue    # process has expired, drop from file
-                    if now - ptime <= self.dropdelay \
-                       and this_site == mysite \
-                       and this_pid != pid:
-                        count += 1
-                    if this_site != self.mysite or this_pid != pid:
-                        processes.append({'pid': this_pid,
-                                          'time': ptime,
-                                          'site': this_site})
-                    if not pid and this_pid >= my_pid:
-                        my_pid = this_pid+1 # next unused process id
-
-            if not pid:
-                pid = my_pid
-            self.checktime = time.time()
-            processes.append({'pid': pid,
-                              'time': self.checktime,
-                              'site': mysite})
-            processes.sort(key=lambda p:(p['pid'], p['site']))
-            try:
-                f = open(self.ctrlfilename, 'w')
-                for p in processes:
-                    f.write("%(pid)s %(time)s %(site)s\n" % p)
-            except IOError:
-                pass
-            else:
-                f.close()
-            self.process_multiplicity = count
+                    pid = 1
+                count = 1
+            state.checktime = now
+            state.process_multiplicity = max(1, count)
             if self.verbosedelay or pywikibot.verbose:
                 pywikibot.output(
-                    u"Found %(count)s %(mysite)s processes running, including this one."
+                    u"Found %(count)s %(host)s processes running, including this one."
                     % locals())
         finally:
             self.lock.release()
@@ -135,153 +205,146 @@ class Throttle(object):
         """Set the nominal delays in seconds. Defaults to config values."""
         self.lock.acquire()
         try:
-            maxdelay = self.maxdelay
             if delay is None:
                 delay = self.mindelay
             if writedelay is None:
                 writedelay = config.put_throttle
+            # Tokens earned so far count at the old delays; the new ones
+            # apply from now on, without refilling the buckets
+            for state in self.hosts.itervalues():
+                state.read.refill(self._delay(state, False))
+                state.write.refill(self._delay(state, True))
             if absolute:
                 self.maxdelay = delay
                 self.mindelay = delay
             self.delay = delay
             self.writedelay = min(max(self.mindelay, writedelay),
                                   self.maxdelay)
-            # Start the delay count now, not at the next check
-            self.last_read = self.last_write = time.time()
         finally:
             self.lock.release()
 
-    def getDelay(self, write=False):
+    def getDelay(self, write=False, site=None):
         """Return the actual delay, accounting for multiple processes.
 
-        This value is the maximum wait between reads/writes, not taking
-        account of how much time has elapsed since the last access.
+        This value is the time between reads/writes to the host of site,
+        not taking account of how much time has elapsed since the last
+        access.
 
         """
+        self.lock.acquire()
+        try:
+            return self._delay(self._state(self._host(site)), write)
+        finally:
+            self.lock.release()
+
+    def _delay(self, state, write):
         if write:
             thisdelay = self.writedelay
         else:
             thisdelay = self.delay
+        thisdelay = min(max(thisdelay * state.backoff, self.mindelay),
+                        self.maxdelay)
         if self.multiplydelay: # We're checking for multiple processes
-            if time.time() > self.checktime + self.checkdelay:
-                self.checkMultiplicity()
-            if thisdelay < (self.mindelay * self.next_multiplicity):
-                thisdelay = self.mindelay * self.next_multiplicity
-            elif thisdelay > self.maxdelay:
-                thisdelay = self.maxdelay
-            thisdelay *= self.process_multiplicity
+            thisdelay *= state.process_multiplicity
         return thisdelay
 
-    def waittime(self, write=False):
+    def waittime(self, write=False, site=None):
         """Return waiting time in seconds if a query would be made right now"""
-        # Take the previous requestsize in account calculating the desired
-        # delay this time
-        thisdelay = self.getDelay(write=write)
-        now = time.time()
-        if write:
-            ago = now - self.last_write
-        else:
-            ago = now - self.last_read
-        if ago < thisdelay:
-            delta = thisdelay - ago
-            return delta
-        else:
-            return 0.0
+        write = write or self.write
+        self.lock.acquire()
+        try:
+            state = self._state(self._host(site))
+            if write:
+                bucket = state.write
+            else:
+                bucket = state.read
+            return max(bucket.waittime(self._delay(state, write)),
+                       state.pausedUntil - time.time())
+        finally:
+            self.lock.release()
 
     def drop(self):
         """Remove me from the list of running bot processes."""
         # drop all throttles with this process's pid, regardless of site
-        self.checktime = 0
-        processes = []
-        try:
-            f = open(self.ctrlfilename, 'r')
-        except IOError:
+        for state in self.hosts.itervalues():
+            state.checktime = 0
+        if not pid:
             return
-        else:
-            now = time.time()
-            for line in f.readlines():
-                try:
-                    line = line.split(' ')
-                    this_pid = int(line[0])
-                    ptime = int(line[1].split('.')[0])
-                    this_site = line[2].rstrip()
-                except (IndexError,ValueError):
-                    continue    # Sometimes the file gets corrupted
-                                # ignore that line
-                if now - ptime <= self.releasepid \
-                   and this_pid != pid:
-                    processes.append({'pid': this_pid,
-                                      'time': ptime,
-                                      'site': this_site})
-        processes.sort(key=lambda p:p['pid'])
         try:
-            f = open(self.ctrlfilename, 'w')
-            for p in processes:
-                f.write("%(pid)s %(time)s %(site)s\n" % p)
-        except IOError:
-            return
-        f.close()
+            db = self._connect()
+            try:
+                db.execute('DELETE FROM processes WHERE pid = ?', (pid,))
+                db.commit()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            pass
 
-    def __call__(self, requestsize=1, write=False):
-        """Block the calling program if the throttle time has not expired.
+    def __call__(self, requestsize=1, write=False, site=None):
+        """Block the calling thread if the throttle time has not expired.
 
         Parameter requestsize is the number of Pages to be read/written;
         multiply delay time by an appropriate factor.
 
-        Because this seizes the throttle lock, it will prevent any other
-        thread from writing to the same site the script started with
-        until the wait expires.
+        Only requests to the same host as site (default: the home wiki)
+        are delayed by this call; the lock is not held while sleeping.
 
         """
+        write = write or self.write
         self.lock.acquire()
         try:
-            wait = self.waittime(write=write or self.write)
-            # Calculate the multiplicity of the next delay based on how
-            # big the request is that is being posted now.
+            state = self._state(self._host(site))
+            now = time.time()
+            if now >= state.pausedUntil and state.backoff > 1:
+                # the server is not lagged anymore, speed up again
+                state.backoff = max(1.0, state.backoff * 0.75)
+            if write:
+                bucket = state.write
+            else:
+                bucket = state.read
             # We want to add "one delay" for each factor of two in the
             # size of the request. Getting 64 pages at once allows 6 times
-            # the delay time for the server.
-            self.next_multiplicity = math.log(1+requestsize)/math.log(2.0)
-            # Announce the delay if it exceeds a preset limit
-            if wait > 0:
-                if wait > config.noisysleep or pywikibot.verbose:
-                    pywikibot.output(
-                        u"Sleeping for %(wait).1f seconds, %(now)s"
-                        % {'wait': wait,
-                           'now' : time.strftime("%Y-%m-%d %H:%M:%S",
-                                                 time.localtime())
-                        } )
-                time.sleep(wait)
-            if write or self.write:
-                self.last_write = time.time()
-            else:
-                self.last_read = time.time()
+            # the delay time for the server before the next request.
+            cost = max(1.0, math.log(1 + requestsize) / math.log(2.0))
+            wait = bucket.reserve(self._delay(state, write), cost)
+            wait = max(wait, state.pausedUntil - now)
         finally:
             self.lock.release()
+        # Announce the delay if it exceeds a preset limit
+        if wait > 0:
+            if wait > config.noisysleep or pywikibot.verbose:
+                pywikibot.output(
+                    u"Sleeping for %(wait).1f seconds, %(now)s"
+                    % {'wait': wait,
+                       'now' : time.strftime("%Y-%m-%d %H:%M:%S",
+                                             time.localtime())
+                    } )
+            time.sleep(wait)
 
-    def lag(self, lagtime):
-        """Seize the throttle lock due to server lag.
+    def pause(self, seconds, site=None):
+        """Hold back all requests to the host of site for some seconds.
 
-        This will prevent any thread from accessing this site.
+        Use this when the server asked us to come back later, e.g. with a
+        Retry-After header. The delay for this host is raised until requests
+        are served without lag again. The calling thread is blocked, too.
 
         """
         started = time.time()
         self.lock.acquire()
         try:
-            # start at 1/2 the current server lag time
-            # wait at least 5 seconds but not more than 120 seconds
-            delay = min(max(5, lagtime//2), 120)
-            # account for any time we waited while acquiring the lock
-            wait = delay - (time.time() - started)
-            if wait > 0:
-                if wait > config.noisysleep:
-                    pywikibot.output(
-                        u"Sleeping for %(wait).1f seconds, %(now)s"
-                        % {'wait': wait,
-                           'now': time.strftime("%Y-%m-%d %H:%M:%S",
-                                                time.localtime())
-                        } )
-                time.sleep(wait)
+            state = self._state(self._host(site))
+            state.pausedUntil = max(state.pausedUntil, started + seconds)
+            state.backoff = min(state.backoff * 2,
+                                self.maxdelay / float(self.mindelay or 1))
+            wait = state.pausedUntil - time.time()
         finally:
             self.lock.release()
-
+        if wait > 0:
+            if wait > config.noisysleep:
+                pywikibot.output(
+                    u"Sleeping for %(wait).1f seconds, %(now)s"
+                    % {'wait': wait,
+                       'now': time.strftime("%Y-%m-%d %H:%M:%S",
+                                            time.localtime())
+                    } )
+            time.sleep(wait)
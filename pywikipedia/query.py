@@ -16,6 +16,16 @@ This module allow you to use the API in a simple and easy way.
 
     print query.GetData(params)
 
+    # follow the query continuations and get the members one by one
+    params = {
+        'list'      :'categorymembers',
+        'cmtitle'   :'Category:Physics',
+        'cmlimit'   :'max',
+        }
+
+    for member in query.iterate(params):
+        print member['title']
+
 """
 #
 # (C) Yuri Astrakhan, 2006
@@ -25,6 +35,7 @@ This module allow you to use the API in a simple and easy way.
 __version__ = '$Id$'
 #
 
+import re
 import time
 import wikipedia as pywikibot
 import config
@@ -63,7 +74,7 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
     titlecount = 0
 
     for k,v in params.iteritems():
-        if k == u'file':
+        if k in (u'file', u'chunk'):
             data[k] = v
         elif type(v) == list:
             if k in [u'titles', u'pageids', u'revids', u'ususers'] and len(v) > 10:
@@ -90,7 +101,7 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
 
     if pywikibot.verbose: #dump params info.
         pywikibot.output(u"==== API action:%s ====" % params[u'action'])
-        if data and 'file' not in data:
+        if data and 'file' not in data and 'chunk' not in data:
             pywikibot.output(u"%s: (%d items)" % (data.keys()[0], titlecount))
 
         for k, v in params.iteritems():
@@ -133,10 +144,11 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
     while retryCount >= 0:
         try:
             jsontext = "Nothing received"
-            if params['action'] == 'upload' and ('file' in data):
+            if params['action'] == 'upload' and data:
                 import upload
+                key = data.keys()[0]
                 res, jsontext = upload.post_multipart(site, path, params.items(),
-                  (('file', params['filename'].encode(site.encoding()), data['file']),),
+                  ((key, params['filename'].encode(site.encoding()), data[key]),),
                   site.cookies(sysop=sysop)
                   )
             elif params['action'] in postAC or params['action'][:5]=='wbset':
@@ -158,6 +170,25 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
                     pywikibot.output('Received a bad login token error from the server.  Attempting to refresh.')
                     params['token'] = site.getToken(sysop = sysop, getagain = True)
                     continue
+                if errorDetails["code"] == 'maxlag' and retryCount > 0:
+                    # the database servers are lagged; hold back all
+                    # requests to this site, then try again. If they stay
+                    # lagged, the error is returned to the caller.
+                    retryCount -= 1
+                    lag = re.search(r'(\d+) seconds? lagged',
+                                    errorDetails.get('info', ''))
+                    if lag:
+                        lag = int(lag.group(1))
+                    else:
+                        lag = 5
+                    if params['action'] in postAC:
+                        throttle = pywikibot.put_throttle
+                    else:
+                        throttle = pywikibot.get_throttle
+                    # start at 1/2 the current server lag time, wait at
+                    # least 5 seconds but not more than 120 seconds
+                    throttle.pause(min(max(5, lag // 2), 120), site=site)
+                    continue
 
             if back_response:
                 return res, jsontext
@@ -186,6 +217,95 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
                 pywikibot.debugDump('ApiGetDataParse', site, str(error) + '\n%s\n%s' % (site.hostname(), path), jsontext)
     raise lastError
 
+def iterate(params, site=None, limit=None, sysop=False, throttle=False):
+    """Yield the results of an API query, following its continuations.
+
+    Only one request is done at a time and the next one is sent when the
+    items of the previous one are consumed, so even huge result sets are
+    iterated in constant memory.
+
+    For 'list' modules the entries of these lists are yielded, for 'prop'
+    and 'generator' queries the page dicts of data['query']['pages']. With
+    the 'query-continue' of MediaWiki before 1.21, the generator of a query
+    with 'prop' modules is only continued when these modules are done with
+    its pages, so a page can be yielded several times with parts of its
+    properties.
+    Limit parameters ('aplimit', 'cmlimit', ...) are reduced to what the
+    account may request (5000 with apihighlimits, 500 otherwise) and to
+    the number of items still wanted; 'max' is passed to the API.
+
+    params   - query parameters like for GetData; the dict is not changed.
+    limit    - maximum number of items to yield; None for all.
+    throttle - wait for get_throttle before each request.
+
+    """
+    if not site:
+        site = pywikibot.getSite()
+    params = dict(params)
+    params['action'] = 'query'
+    if 'list' in params:
+        modules = params['list']
+        if isinstance(modules, basestring):
+            modules = modules.split('|')
+    else:
+        modules = None
+
+    if site.isAllowed('apihighlimits', sysop):
+        maxlimit = 5000
+    else:
+        maxlimit = 500
+    limitkeys = [k for k in params if k.endswith('limit') and k != 'limit'
+                 and params[k] != 'max']
+    generator = params.get('generator')
+    # parameters set by the last 'query-continue' of the 'prop' modules
+    propcontinue = []
+    count = 0
+    while True:
+        for k in limitkeys:
+            params[k] = min(int(params[k]), maxlimit)
+            if limit is not None:
+                params[k] = min(params[k], limit - count)
+        if throttle:
+            pywikibot.get_throttle(site=site)
+        # GetData removes long title lists from the dict it gets
+        data = GetData(dict(params), site, sysop=sysop)
+        if 'error' in data:
+            raise RuntimeError("API query error: %s" % data['error'])
+        if 'query' in data:
+            if modules:
+                items = []
+                for module in modules:
+                    items.extend(data['query'].get(module, []))
+            else:
+                items = data['query'].get('pages', {}).values()
+            for item in items:
+                yield item
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+        if 'continue' in data:
+            # continuation of MediaWiki 1.21 and later
+            params.update(data['continue'])
+        elif 'query-continue' in data and generator:
+            for key in propcontinue:
+                del params[key]
+            propcontinue = []
+            for module, values in data['query-continue'].iteritems():
+                if module != generator:
+                    params.update(values)
+                    propcontinue.extend(values)
+            if not propcontinue:
+                if generator not in data['query-continue']:
+                    return
+                # the pages of this batch are done, get the next one
+                params.update(data['query-continue'][generator])
+        elif 'query-continue' in data:
+            for module in data['query-continue'].itervalues():
+                params.update(module)
+        else:
+            return
+
+
 def GetInterwikies(site, titles, extraParams = None ):
     """ Usage example: data = GetInterwikies('ru','user:yurik')
     titles may be either ane title (as a string), or a list of strings
@@ -177,22 +177,11 @@ class RedirectGenerator:
             params['apnamespace'] = ns
             if self.api_start:
                 params['apfrom'] = self.api_start
-            done = False
-            while not done:
-                pywikibot.output(u'\nRetrieving pages...', newline=False)
-                data = query.GetData(params, self.site)
-                if 'error' in data:
-                    raise RuntimeError("API query error: %s" % data['error'])
-                if "limits" in data:  # process aplimit = max
-                    params['aplimit'] = int(data['limits']['allpages'])
-                for x in data['query']['allpages']:
-                    done = self.api_until and x['title'] >= self.api_until
-                    if done: break
-                    yield x['pageid']
-                if not done and 'query-continue' in data:
-                    params.update(data['query-continue']['allpages'])
-                else:
+            pywikibot.output(u'\nRetrieving pages...', newline=False)
+            for x in query.iterate(params, self.site):
+                if self.api_until and x['title'] >= self.api_until:
                     break
+                yield x['pageid']
 
     def _next_redirect_group(self):
         """
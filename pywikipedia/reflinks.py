@@ -39,12 +39,15 @@ See [[:en:User:DumZiBoT/refLinks]] for more information on the bot.
 __version__ = '$Id$'
 #
 
-import sys, re, urllib2, httplib, socket, codecs, ftplib
-import subprocess, tempfile, os, gzip, StringIO
+import sys, re, urllib2, urlparse, httplib, socket, codecs, ftplib, zlib
+import subprocess, tempfile, os, shutil, threading, Queue, traceback
+from collections import deque
 import wikipedia as pywikibot
 from BeautifulSoup import UnicodeDammit
+import config
 import pagegenerators
 import noreferences
+from pywikibot.comms.connectionpool import ConnectionPool
 
 docuReplacements = {
     '&params;': pagegenerators.parameterHelp
@@ -392,18 +395,208 @@ class DuplicateReferences:
                 u'<ref name=%s />' % name, text)
         return text
 
+# What became of a reference, see ReferencesRobot.getTitle()
+TITLE = 0
+LINK = 1
+DEAD = 2
+
+class PooledResponse:
+    """
+    File-like HTTP response, as returned by urllib2.urlopen(). When it is
+    closed after having been read completely, its keep-alive connection is
+    put back into the pool to load the next page from the same host.
+    """
+    def __init__(self, url, response, conn, connections, identifier):
+        self.url = url
+        self.response = response
+        self.conn = conn
+        self.connections = connections
+        self.identifier = identifier
+
+    def info(self):
+        return self.response.msg
+
+    def geturl(self):
+        return self.url
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def close(self):
+        if self.conn is None:
+            return
+        response = self.response
+        if not response.isclosed() and response.length is not None \
+                and response.length <= 64 * 1024:
+            # cheaper to read the rest than to open a new connection
+            try:
+                response.read()
+            except (httplib.HTTPException, socket.error):
+                pass
+        if response.isclosed() and not response.will_close:
+            self.connections.push_connection(self.identifier, self.conn)
+        else:
+            self.conn.close()
+            self.connections.release(self.identifier)
+        self.conn = None
+
+def urlopen(url, connections, timeout=20, maxRedirects=10):
+    """
+    Open url like urllib2.urlopen(), following redirects. HTTP connections
+    are taken from and given back to connections, a ConnectionPool, so that
+    many references to the same server don't need a new connection each.
+    """
+    for i in range(maxRedirects):
+        scheme, host, path, query, fragment = urlparse.urlsplit(url)
+        if scheme not in ('http', 'https'):
+            return urllib2.urlopen(url, timeout=timeout)
+        path = path or '/'
+        if query:
+            path += '?' + query
+        header = {'User-Agent': 'Python-urllib/%s' % urllib2.__version__}
+        if scheme == 'https':
+            connect = lambda: httplib.HTTPSConnection(host, timeout=timeout)
+        else:
+            connect = lambda: httplib.HTTPConnection(host, timeout=timeout)
+        conn, response = connections.request((scheme, host), connect, 'GET',
+                                             path, None, header)
+        f = PooledResponse(url, response, conn, connections, (scheme, host))
+        location = response.getheader('Location')
+        if response.status in (301, 302, 303, 307) and location:
+            f.close()
+            url = urlparse.urljoin(url, location)
+            continue
+        if response.status >= 400:
+            f.close()
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+        return f
+    raise urllib2.HTTPError(url, response.status,
+                            'Too many redirects', response.msg, None)
+
+class FetchThread(threading.Thread):
+    """Loads references queued in a TitleFetcher"""
+
+    def __init__(self, fetcher):
+        threading.Thread.__init__(self)
+        self.fetcher = fetcher
+        self.setDaemon(True)
+
+    def run(self):
+        while True:
+            item = self.fetcher.queue.get()
+            if item is None:
+                return
+            ref, page = item
+            result = None, None
+            try:
+                result = self.fetcher.getTitle(ref, page)
+            except Exception:
+                pywikibot.output(u'Exception while loading %s :' % ref.link)
+                traceback.print_exc()
+            self.fetcher.done(ref.url, result)
+
+class TitleFetcher:
+    """
+    Loads references in threads, ahead of the page they are needed for.
+    The results of the last maxResults URLs are remembered, so that they
+    are not loaded again when another page cites them.
+
+    getTitle(ref, page) is called in the threads and has to return a
+    (kind, title) tuple, kind being TITLE, LINK, DEAD or None.
+    """
+    def __init__(self, getTitle, threads, maxResults=10000):
+        self.getTitle = getTitle
+        self.queue = Queue.Queue()
+        self.connections = ConnectionPool(max_idle=threads)
+        self.lock = threading.Lock()
+        # URL -> (kind, title)
+        self.results = {}
+        # the URLs of self.results, oldest first
+        self.resultOrder = deque()
+        self.maxResults = max(1, maxResults)
+        # URL -> threading.Event, for the URLs still being loaded
+        self.loading = {}
+        self.threads = []
+        for i in range(threads):
+            thread = FetchThread(self)
+            thread.start()
+            self.threads.append(thread)
+
+    def add(self, ref, page):
+        """Queue ref, found on page, for loading if it hasn't been yet."""
+        self.lock.acquire()
+        try:
+            if ref.url in self.results or ref.url in self.loading:
+                return self.loading.get(ref.url)
+            event = self.loading[ref.url] = threading.Event()
+        finally:
+            self.lock.release()
+        self.queue.put((ref, page))
+        return event
+
+    def done(self, url, result):
+        self.lock.acquire()
+        try:
+            self.results[url] = result
+            self.resultOrder.append(url)
+            if len(self.resultOrder) > self.maxResults:
+                del self.results[self.resultOrder.popleft()]
+            event = self.loading.pop(url)
+        finally:
+            self.lock.release()
+        event.result = result
+        event.set()
+
+    def result(self, ref, page):
+        """Return the (kind, title) tuple for ref, waiting until it is loaded."""
+        while True:
+            self.lock.acquire()
+            try:
+                if ref.url in self.results:
+                    return self.results[ref.url]
+            finally:
+                self.lock.release()
+            # the result may have been dropped already, so load it again
+            event = self.add(ref, page)
+            if event is not None:
+                # wait with a timeout to stay responsive to KeyboardInterrupt
+                while not event.isSet():
+                    event.wait(1)
+                return event.result
+
+    def close(self):
+        # forget the references nobody is waiting for
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(30)
+        self.connections.close()
+
 class ReferencesRobot:
-    def __init__(self, generator, acceptall=False, limit=None, ignorepdf=False):
+    def __init__(self, generator, acceptall=False, limit=None, ignorepdf=False,
+                 threads=None, lookahead=20):
         """
         - generator : Page generator
         - acceptall : boolean, is -always on ?
         - limit : int, stop after n modified pages
         - ignorepdf : boolean
+        - threads : int, how many references are loaded at the same time,
+                    config.reflinks_threads by default
+        - lookahead : int, for how many pages ahead references are loaded
         """
         self.generator = generator
         self.acceptall = acceptall
         self.limit = limit
         self.ignorepdf = ignorepdf
+        self.threads = threads or config.reflinks_threads
+        self.lookahead = lookahead
+        self.maxSize = config.reflinks_max_size
         self.site = pywikibot.getSite()
         self.stopPage = pywikibot.Page(self.site,
                                        pywikibot.translate(self.site, stopPage))
@@ -487,7 +680,7 @@ class ReferencesRobot:
         pywikibot.output( u'PDF file.' )
         fd, infile = tempfile.mkstemp()
         urlobj = os.fdopen(fd, 'r+w')
-        urlobj.write(f.read())
+        shutil.copyfileobj(f, urlobj)
         try:
             pdfinfo_out = subprocess.Popen([r"pdfinfo","/dev/stdin"],
                                            stdin=urlobj, stdout=subprocess.PIPE,
@@ -510,27 +703,232 @@ class ReferencesRobot:
             urlobj.close()
             os.unlink(infile)
 
-    def run(self):
+    def getTitle(self, ref, page):
         """
-        Runs the Bot
+        Load the beginning of the page ref links to, and return a
+        (kind, title) tuple saying how to replace the reference: TITLE with
+        the page title, LINK with the bare link, DEAD with a dead link tag,
+        or None to leave it alone. Called from the TitleFetcher threads.
         """
-        pywikibot.setAction(pywikibot.translate(self.site, msg))
+        f = None
         try:
-            deadLinks = codecs.open(listof404pages, 'r', 'latin_1').read()
-        except IOError:
+            try:
+                url = ref.url.encode('ascii')
+            except UnicodeError:
+                url = urllib2.quote(ref.url.encode("utf8"), "://")
+            f = urlopen(url, self.fetcher.connections)
+            #Try to get Content-Type from server
+            headers = f.info()
+            contentType = headers.getheader('Content-Type')
+            if contentType and not self.MIME.search(contentType):
+                if ref.link.lower().endswith('.pdf') and \
+                   not self.ignorepdf:
+                    # If file has a PDF suffix
+                    self.getPDFTitle(ref, f)
+                else:
+                    pywikibot.output(
+                        u'\03{lightyellow}WARNING\03{default} : media : %s '
+                        % ref.link)
+                if ref.title:
+                    if not re.match(
+                        '(?i) *microsoft (word|excel|visio)',
+                        ref.title):
+                        ref.transform(ispdf=True)
+                        return TITLE, ref.title
+                    else:
+                        pywikibot.output(
+                            '\03{lightyellow}WARNING\03{default} : PDF title blacklisted : %s '
+                            % ref.title)
+                return LINK, None
+            # Get the real url where we end (http redirects !)
+            redir = f.geturl()
+            if redir != ref.link and \
+               domain.findall(redir) == domain.findall(ref.link):
+                if soft404.search(redir) and \
+                   not soft404.search(ref.link):
+                    pywikibot.output(
+                        u'\03{lightyellow}WARNING\03{default} : Redirect 404 : %s '
+                        % ref.link)
+                    return None, None
+                if dirIndex.match(redir) and \
+                   not dirIndex.match(ref.link):
+                    pywikibot.output(
+                        u'\03{lightyellow}WARNING\03{default} : Redirect to root : %s '
+                        % ref.link)
+                    return None, None
+
+            # Only the beginning of the page is read, the title is in there
+            linkedpagetext = f.read(self.maxSize)
+            # uncompress if necessary
+            if headers.get('Content-Encoding') in ('gzip', 'x-gzip'):
+                # a truncated stream can be uncompressed as far as it goes
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                linkedpagetext = decompressor.decompress(linkedpagetext,
+                                                         self.maxSize)
+
+        except UnicodeError:
+            #example : http://www.adminet.com/jo/20010615¦/ECOC0100037D.html
+            # in [[fr:Cyanure]]
             pywikibot.output(
-                'You need to download http://www.twoevils.org/files/wikipedia/404-links.txt.gz and to ungzip it in the same directory')
-            raise
-        socket.setdefaulttimeout(30)
-        editedpages = 0
+                u'\03{lightred}Bad link\03{default} : %s in %s'
+                % (ref.url, page.title(asLink=True)))
+            return None, None
+        except urllib2.HTTPError, e:
+            pywikibot.output(u'HTTP error (%s) for %s on %s'
+                             % (e.code, ref.url,
+                                page.title(asLink=True)),
+                            toStdout = True)
+            # 410 Gone, indicates that the resource has been purposely
+            # removed
+            if e.code == 410 or \
+               (e.code == 404 and (u'\t%s\t' % ref.url in self.deadLinks)):
+                return DEAD, None
+            return None, None
+        except (urllib2.URLError,
+                socket.error,
+                IOError,
+                httplib.error,
+                zlib.error), e:
+        #except (urllib2.URLError, socket.timeout, ftplib.error, httplib.error, socket.error), e:
+            pywikibot.output(u'Can\'t retrieve page %s : %s'
+                             % (ref.url, e))
+            return None, None
+        except ValueError:
+            #Known bug of httplib, google for :
+            #"httplib raises ValueError reading chunked content"
+            return None, None
+        finally:
+            if f:
+                f.close()
+
+        #remove <script>/<style>/comments/CDATA tags
+        linkedpagetext = self.NON_HTML.sub('', linkedpagetext)
+
+        meta_content = self.META_CONTENT.search(linkedpagetext)
+        enc = []
+        s = None
+        if contentType:
+            # use charset from http header
+            s = self.CHARSET.search(contentType)
+        if meta_content:
+            tag = meta_content.group()
+            # Prefer the contentType from the HTTP header :
+            if not contentType:
+                contentType = tag
+            if not s:
+                # use charset from html
+                s = self.CHARSET.search(tag)
+        if s:
+            tmp = s.group('enc').strip("\"' ").lower()
+            naked = re.sub('[ _\-]', '', tmp)
+            # Convert to python correct encoding names
+            if naked == "gb2312":
+                enc.append("gbk")
+            elif naked == "shiftjis":
+                enc.append("shift jis 2004")
+                enc.append("cp932")
+            elif naked == "xeucjp":
+                enc.append("euc-jp")
+            else:
+                enc.append(tmp)
+        else:
+            pywikibot.output(u'No charset found for %s' % ref.link)
+            #continue            # do not process pages without charset
+        if not contentType:
+            pywikibot.output(u'No content-type found for %s' % ref.link)
+            return None, None
+        elif not self.MIME.search(contentType):
+            pywikibot.output(
+                u'\03{lightyellow}WARNING\03{default} : media : %s '
+                % ref.link)
+            return LINK, None
+
+        # Ugly hacks to try to survive when both server and page
+        # return no encoding.
+        # Uses most used encodings for each national suffix
+        if u'.ru' in ref.link or u'.su' in ref.link:
+            # see http://www.sci.aha.ru/ATL/ra13a.htm : no server
+            # encoding, no page encoding
+            enc = enc + ['koi8-r', 'windows-1251']
+        elif u'.jp' in ref.link:
+            enc.append("shift jis 2004")
+            enc.append("cp932")
+        elif u'.kr' in ref.link:
+            enc.append("euc-kr")
+            enc.append("cp949")
+        elif u'.zh' in ref.link:
+            enc.append("gbk")
+
+        #print(enc)
+        u = UnicodeDammit(linkedpagetext, overrideEncodings = enc)
+        #print(u.triedEncodings)
+
+
+        if not u.unicode:
+            #Some page have utf-8 AND windows-1252 characters,
+            #Can't easily parse them. (~1 on 1000)
+            pywikibot.output('%s : Hybrid encoding...' % ref.link)
+            return LINK, None
+
+
+        # Retrieves the first non empty string inside <title> tags
+        for m in self.TITLE.finditer(u.unicode):
+            t = m.group()
+            if t:
+                ref.title = t
+                ref.transform()
+                if ref.title:
+                    break;
+
+        if not ref.title:
+            pywikibot.output(u'%s : No title found...' % ref.link)
+            return LINK, None
+        if enc and u.originalEncoding not in enc:
+            # BeautifulSoup thinks that the original encoding of our
+            # page was not one of the encodings we specified. Output a
+            # warning.
+            pywikibot.output(
+                u'\03{lightpurple}ENCODING\03{default} : %s (%s)'
+                % (ref.link, ref.title))
+
+        # XXX Ugly hack
+        if u'Ã©' in ref.title:
+            pywikibot.output(u'%s : Hybrid encoding...' % ref.link)
+            return LINK, None
+
+        if self.titleBlackList.match(ref.title):
+            pywikibot.output(
+                u'\03{lightred}WARNING\03{default} %s : Blacklisted title (%s)'
+                % (ref.link, ref.title))
+            return LINK, None
+
+        # Truncate long titles. 175 is arbitrary
+        if len(ref.title) > 175:
+            ref.title = ref.title[:175] + "..."
+        return TITLE, ref.title
+
+    def references(self, text):
+        """Yield a RefLink and the match for each bare reference in text."""
+        for match in linksInRef.finditer(pywikibot.removeDisabledParts(text)):
+            link = match.group(u'url')
+            #debugging purpose
+            #print link
+            if u'jstor.org' in link:
+                #TODO: Clean URL blacklist
+                continue
+            yield RefLink(link, match.group('name')), match
+
+    def preload(self):
+        """
+        Yield the pages of the generator, having queued the references of
+        the next self.lookahead pages for loading already. Pages which can't
+        be edited are skipped.
+        """
+        pending = deque()
         for page in self.generator:
             try:
                 # Load the page's text from the wiki
-                new_text = page.get()
-                if not page.canBeEdited():
-                    pywikibot.output(u"You can't edit page %s"
-                                      % page.title(asLink=True))
-                    continue
+                page.get()
             except pywikibot.NoPage:
                 pywikibot.output(u'Page %s not found' % page.title(asLink=True))
                 continue
@@ -538,233 +936,51 @@ class ReferencesRobot:
                 pywikibot.output(u'Page %s is a redirect'
                                  % page.title(asLink=True))
                 continue
+            if not page.canBeEdited():
+                # don't load the references of pages which are skipped
+                pywikibot.output(u"You can't edit page %s"
+                                  % page.title(asLink=True))
+                continue
+            for ref, match in self.references(page.get()):
+                self.fetcher.add(ref, page)
+            pending.append(page)
+            if len(pending) > self.lookahead:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
 
-            for match in linksInRef.finditer(pywikibot.removeDisabledParts(page.get())):
-            #for each link to change
-                link = match.group(u'url')
-                #debugging purpose
-                #print link
-                if u'jstor.org' in link:
-                    #TODO: Clean URL blacklist
-                    continue
-
-                ref = RefLink(link, match.group('name'))
-                f = None
-                try:
-                    socket.setdefaulttimeout(20)
-                    try:
-                        f = urllib2.urlopen(ref.url.decode("utf8"))
-                    except UnicodeError:
-                        ref.url = urllib2.quote(ref.url.encode("utf8"),"://")
-                        f = urllib2.urlopen(ref.url)
-                    #Try to get Content-Type from server
-                    headers = f.info()
-                    contentType = headers.getheader('Content-Type')
-                    if contentType and not self.MIME.search(contentType):
-                        if ref.link.lower().endswith('.pdf') and \
-                           not self.ignorepdf:
-                            # If file has a PDF suffix
-                            self.getPDFTitle(ref, f)
-                        else:
-                            pywikibot.output(
-                                u'\03{lightyellow}WARNING\03{default} : media : %s '
-                                % ref.link)
-                        if ref.title:
-                            if not re.match(
-                                '(?i) *microsoft (word|excel|visio)',
-                                ref.title):
-                                ref.transform(ispdf=True)
-                                repl = ref.refTitle()
-                            else:
-                                pywikibot.output(
-                                    '\03{lightyellow}WARNING\03{default} : PDF title blacklisted : %s '
-                                    % ref.title)
-                                repl = ref.refLink()
-                        else:
-                            repl = ref.refLink()
-                        new_text = new_text.replace(match.group(), repl)
-                        continue
-                    # Get the real url where we end (http redirects !)
-                    redir = f.geturl()
-                    if redir != ref.link and \
-                       domain.findall(redir) == domain.findall(link):
-                        if soft404.search(redir) and \
-                           not soft404.search(ref.link):
-                            pywikibot.output(
-                                u'\03{lightyellow}WARNING\03{default} : Redirect 404 : %s '
-                                % ref.link)
-                            continue
-                        if dirIndex.match(redir) and \
-                           not dirIndex.match(ref.link):
-                            pywikibot.output(
-                                u'\03{lightyellow}WARNING\03{default} : Redirect to root : %s '
-                                % ref.link)
-                            continue
-
-                    # uncompress if necessary
-                    if headers.get('Content-Encoding') in ('gzip', 'x-gzip'):
-                        # XXX: small issue here: the whole page is downloaded
-                        # through f.read(). It might fetch big files/pages.
-                        # However, truncating an encoded gzipped stream is not
-                        # an option, for unzipping will fail.
-                        compressed = StringIO.StringIO(f.read())
-                        f = gzip.GzipFile(fileobj=compressed)
-
-                    # Read the first 1,000,000 bytes (0.95 MB)
-                    linkedpagetext = f.read(1000000)
-                    socket.setdefaulttimeout(None)
-
-                except UnicodeError:
-                    #example : http://www.adminet.com/jo/20010615¦/ECOC0100037D.html
-                    # in [[fr:Cyanure]]
-                    pywikibot.output(
-                        u'\03{lightred}Bad link\03{default} : %s in %s'
-                        % (ref.url, page.title(asLink=True)))
-                    continue
-                except urllib2.HTTPError, e:
-                    pywikibot.output(u'HTTP error (%s) for %s on %s'
-                                     % (e.code, ref.url,
-                                        page.title(asLink=True)),
-                                    toStdout = True)
-                    # 410 Gone, indicates that the resource has been purposely
-                    # removed
-                    if e.code == 410 or \
-                       (e.code == 404 and (u'\t%s\t' % ref.url in deadLinks)):
-                        repl = ref.refDead()
-                        new_text = new_text.replace(match.group(), repl)
-                    continue
-                except (urllib2.URLError,
-                        socket.error,
-                        IOError,
-                        httplib.error), e:
-                #except (urllib2.URLError, socket.timeout, ftplib.error, httplib.error, socket.error), e:
-                    pywikibot.output(u'Can\'t retrieve page %s : %s'
-                                     % (ref.url, e))
-                    continue
-                except ValueError:
-                    #Known bug of httplib, google for :
-                    #"httplib raises ValueError reading chunked content"
-                    continue
-                finally:
-                    if f:
-                        f.close()
-
-                #remove <script>/<style>/comments/CDATA tags
-                linkedpagetext = self.NON_HTML.sub('', linkedpagetext)
-
-                meta_content = self.META_CONTENT.search(linkedpagetext)
-                enc = []
-                s = None
-                if contentType:
-                    # use charset from http header
-                    s = self.CHARSET.search(contentType)
-                if meta_content:
-                    tag = meta_content.group()
-                    # Prefer the contentType from the HTTP header :
-                    if not contentType:
-                        contentType = tag
-                    if not s:
-                        # use charset from html
-                        s = self.CHARSET.search(tag)
-                if s:
-                    tmp = s.group('enc').strip("\"' ").lower()
-                    naked = re.sub('[ _\-]', '', tmp)
-                    # Convert to python correct encoding names
-                    if naked == "gb2312":
-                        enc.append("gbk")
-                    elif naked == "shiftjis":
-                        enc.append("shift jis 2004")
-                        enc.append("cp932")
-                    elif naked == "xeucjp":
-                        enc.append("euc-jp")
-                    else:
-                        enc.append(tmp)
-                else:
-                    pywikibot.output(u'No charset found for %s' % ref.link)
-                    #continue            # do not process pages without charset
-                if not contentType:
-                    pywikibot.output(u'No content-type found for %s' % ref.link)
-                    continue
-                elif not self.MIME.search(contentType):
-                    pywikibot.output(
-                        u'\03{lightyellow}WARNING\03{default} : media : %s '
-                        % ref.link)
-                    repl = ref.refLink()
-                    new_text = new_text.replace(match.group(), repl)
-                    continue
-
-                # Ugly hacks to try to survive when both server and page
-                # return no encoding.
-                # Uses most used encodings for each national suffix
-                if u'.ru' in ref.link or u'.su' in ref.link:
-                    # see http://www.sci.aha.ru/ATL/ra13a.htm : no server
-                    # encoding, no page encoding
-                    enc = enc + ['koi8-r', 'windows-1251']
-                elif u'.jp' in ref.link:
-                    enc.append("shift jis 2004")
-                    enc.append("cp932")
-                elif u'.kr' in ref.link:
-                    enc.append("euc-kr")
-                    enc.append("cp949")
-                elif u'.zh' in ref.link:
-                    enc.append("gbk")
-
-                #print(enc)
-                u = UnicodeDammit(linkedpagetext, overrideEncodings = enc)
-                #print(u.triedEncodings)
-
-
-                if not u.unicode:
-                    #Some page have utf-8 AND windows-1252 characters,
-                    #Can't easily parse them. (~1 on 1000)
-                    repl = ref.refLink()
-                    new_text = new_text.replace(match.group(), repl)
-                    pywikibot.output('%s : Hybrid encoding...' % ref.link)
-                    continue
-
-
-                # Retrieves the first non empty string inside <title> tags
-                for m in self.TITLE.finditer(u.unicode):
-                    t = m.group()
-                    if t:
-                        ref.title = t
-                        ref.transform()
-                        if ref.title:
-                            break;
-
-                if not ref.title:
-                    repl = ref.refLink()
-                    new_text = new_text.replace(match.group(), repl)
-                    pywikibot.output(u'%s : No title found...' % ref.link)
-                    continue
-                if enc and u.originalEncoding not in enc:
-                    # BeautifulSoup thinks that the original encoding of our
-                    # page was not one of the encodings we specified. Output a
-                    # warning.
-                    pywikibot.output(
-                        u'\03{lightpurple}ENCODING\03{default} : %s (%s)'
-                        % (ref.link, ref.title))
-
-                # XXX Ugly hack
-                if u'Ã©' in ref.title:
-                    repl = ref.refLink()
-                    new_text = new_text.replace(match.group(), repl)
-                    pywikibot.output(u'%s : Hybrid encoding...' % ref.link)
-                    continue
+    def run(self):
+        """
+        Runs the Bot
+        """
+        pywikibot.setAction(pywikibot.translate(self.site, msg))
+        try:
+            self.deadLinks = codecs.open(listof404pages, 'r', 'latin_1').read()
+        except IOError:
+            pywikibot.output(
+                'You need to download http://www.twoevils.org/files/wikipedia/404-links.txt.gz and to ungzip it in the same directory')
+            raise
+        self.fetcher = TitleFetcher(self.getTitle, self.threads)
+        try:
+            self.replaceReferences()
+        finally:
+            self.fetcher.close()
 
-                if self.titleBlackList.match(ref.title):
+    def replaceReferences(self):
+        editedpages = 0
+        for page in self.preload():
+            new_text = page.get()
+            for ref, match in self.references(page.get()):
+            #for each link to change
+                kind, ref.title = self.fetcher.result(ref, page)
+                if kind == TITLE:
+                    repl = ref.refTitle()
+                elif kind == LINK:
                     repl = ref.refLink()
-                    new_text = new_text.replace(match.group(), repl)
-                    pywikibot.output(
-                        u'\03{lightred}WARNING\03{default} %s : Blacklisted title (%s)'
-                        % (ref.link, ref.title))
+                elif kind == DEAD:
+                    repl = ref.refDead()
+                else:
                     continue
-
-                # Truncate long titles. 175 is arbitrary
-                if len(ref.title) > 175:
-                    ref.title = ref.title[:175] + "..."
-
-                repl = ref.refTitle()
                 new_text = new_text.replace(match.group(), repl)
 
             # Add <references/> when needed, but ignore templates !
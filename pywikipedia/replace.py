@@ -30,7 +30,13 @@ Furthermore, the following command line parameters are supported:
 
 -xmlstart         (Only works with -xml) Skip all articles in the XML dump
                   before the one specified (may also be given as
-                  -xmlstart:Article).
+                  -xmlstart:Article). If the index of the dump has been
+                  built (see xmlreader.XmlDump.build_index), the dump is
+                  read from this article on.
+
+-workers:N        (Only works with -xml) Parse the XML dump and check its
+                  pages in N processes. -workers alone uses one process per
+                  CPU. The pages are found in the order of the dump.
 
 -save             Saves the titles of the articles to a file instead of
                   modifying the articles. This way you may collect titles to
@@ -185,6 +191,19 @@ docuReplacements = {
 }
 
 
+class XmlDumpEntryFilter(object):
+    """
+    Filter for XmlDump.parallel_parse() which lets through the entries an
+    XmlDumpReplacePageGenerator yields pages for, and the one to start with.
+    """
+    def __init__(self, generator):
+        self.generator = generator
+
+    def __call__(self, entry):
+        return entry.title == self.generator.xmlStart \
+               or self.generator.isChanged(entry)
+
+
 class XmlDumpReplacePageGenerator:
     """
     Iterator that will yield Pages that might contain text to replace.
@@ -199,11 +218,15 @@ class XmlDumpReplacePageGenerator:
         * exceptions   - A dictionary which defines when to ignore an
                          occurence. See docu of the ReplaceRobot
                          constructor below.
+        * workers      - If not None, the dump is parsed and its entries
+                         are checked in this many processes (0 means one
+                         per CPU).
 
     """
-    def __init__(self, xmlFilename, xmlStart, replacements, exceptions):
+    def __init__(self, xmlFilename, xmlStart, replacements, exceptions,
+                 workers=None):
         self.xmlFilename = xmlFilename
-        self.replacements = replacements
+        self.replacements = pywikibot.ReplacementIndex(replacements)
         self.exceptions = exceptions
         self.xmlStart = xmlStart
         self.skipping = bool(xmlStart)
@@ -215,8 +238,31 @@ class XmlDumpReplacePageGenerator:
             self.excsInside += self.exceptions['inside']
         import xmlreader
         self.site = pywikibot.getSite()
+        self.replacer = pywikibot.Replacer(self.excsInside, site=self.site)
         dump = xmlreader.XmlDump(self.xmlFilename)
-        self.parser = dump.parse()
+        self.parser = None
+        if self.skipping and dump.has_index():
+            try:
+                self.parser = dump.seek(self.xmlStart)
+                self.skipping = False
+            except KeyError:
+                pywikibot.warning(u'%s is not in the index of the dump.'
+                                  % self.xmlStart)
+        # the entries are checked by the processes parsing the dump
+        self.parallel = self.parser is None and workers is not None
+        if self.parallel:
+            self.parser = dump.parallel_parse(processes=workers or None,
+                                              filter=XmlDumpEntryFilter(self))
+        elif self.parser is None:
+            self.parser = dump.parse()
+
+    def __getstate__(self):
+        # the parser and the site are not needed by the filter in the
+        # processes parsing the dump, and can't be pickled
+        state = self.__dict__.copy()
+        del state['parser']
+        del state['site']
+        return state
 
     def __iter__(self):
         try:
@@ -225,14 +271,10 @@ class XmlDumpReplacePageGenerator:
                     if entry.title != self.xmlStart:
                         continue
                     self.skipping = False
-                if not self.isTitleExcepted(entry.title) \
-                        and not self.isTextExcepted(entry.text):
-                    new_text = entry.text
-                    for old, new in self.replacements:
-                        new_text = pywikibot.replaceExcept(
-                            new_text, old, new, self.excsInside, self.site)
-                    if new_text != entry.text:
-                        yield pywikibot.Page(self.site, entry.title)
+                if self.parallel and entry.title != self.xmlStart \
+                        or self.isChanged(entry):
+                    yield pywikibot.Page.fromNormalizedTitle(self.site,
+                                                             entry.title)
         except KeyboardInterrupt:
             try:
                 if not self.skipping:
@@ -261,6 +303,17 @@ class XmlDumpReplacePageGenerator:
                     return True
         return False
 
+    def isChanged(self, entry):
+        """
+        Return True if the replacements change the text of the XmlEntry
+        and it is not excepted.
+        """
+        if self.isTitleExcepted(entry.title) \
+                or self.isTextExcepted(entry.text):
+            return False
+        new_text = self.replacer.replaceAll(entry.text, self.replacements)
+        return new_text != entry.text
+
 
 class ReplaceRobot:
     """
@@ -326,7 +379,7 @@ class ReplaceRobot:
 
         """
         self.generator = generator
-        self.replacements = replacements
+        self.replacements = pywikibot.ReplacementIndex(replacements)
         self.exceptions = exceptions
         self.acceptall = acceptall
         self.allowoverlap = allowoverlap
@@ -339,6 +392,13 @@ class ReplaceRobot:
         self.editSummary = editSummary
         self.articles = articles
         self.exctitles = exctitles
+        inside = []
+        if "inside-tags" in self.exceptions:
+            inside += self.exceptions['inside-tags']
+        if "inside" in self.exceptions:
+            inside += self.exceptions['inside']
+        self.replacer = pywikibot.Replacer(inside,
+                                           allowoverlap=self.allowoverlap)
 
         # An edit counter to split the file by 100 titles if -save or -savenew
         # is on, and to display the number of edited articles otherwise.
@@ -376,17 +436,12 @@ class ReplaceRobot:
         Returns the text which is generated by applying all replacements to
         the given text.
         """
+        if self.sleep is None:
+            return self.replacer.replaceAll(original_text, self.replacements)
         new_text = original_text
-        exceptions = []
-        if "inside-tags" in self.exceptions:
-            exceptions += self.exceptions['inside-tags']
-        if "inside" in self.exceptions:
-            exceptions += self.exceptions['inside']
         for old, new in self.replacements:
-            if self.sleep is not None:
-                time.sleep(self.sleep)
-            new_text = pywikibot.replaceExcept(new_text, old, new, exceptions,
-                                               allowoverlap=self.allowoverlap)
+            time.sleep(self.sleep)
+            new_text = self.replacer.replace(new_text, old, new)
         return new_text
 
     def writeEditCounter(self):
@@ -633,6 +688,8 @@ def main(*args):
     # Between a regex and another (using -fix) sleep some time (not to waste
     # too much CPU
     sleep = None
+    # Number of processes checking the pages of the XML dump
+    workers = None
     # Do not save the page titles, rather work on wiki
     filename = None # The name of the file to save titles
     titlefile = None # The file object itself
@@ -656,6 +713,11 @@ def main(*args):
                     u'Please enter the dumped article to start with:')
             else:
                 xmlStart = arg[10:]
+        elif arg.startswith('-workers'):
+            if len(arg) == 8:
+                workers = 0
+            else:
+                workers = int(arg[9:])
         elif arg.startswith('-xml'):
             if len(arg) == 4:
                 xmlFilename = i18n.input('pywikibot-enter-xml-filename')
@@ -894,7 +956,7 @@ def main(*args):
         except NameError:
             xmlStart = None
         gen = XmlDumpReplacePageGenerator(xmlFilename, xmlStart,
-                                          replacements, exceptions)
+                                          replacements, exceptions, workers)
     elif useSql:
         whereClause = 'WHERE (%s)' % ' OR '.join(
             ["old_text RLIKE '%s'" % prepareRegexForMySQL(old.pattern)
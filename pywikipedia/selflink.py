@@ -97,7 +97,8 @@ class XmlDumpSelflinkPageGenerator:
                                       re.escape(entry.title[1:]))
             selflinkR = re.compile(r'\[\[' + title + '(\|[^\]]*)?\]\]')
             if selflinkR.search(entry.text):
-                yield pywikibot.Page(mysite, entry.title)
+                yield pywikibot.Page.fromNormalizedTitle(mysite,
+                                                         entry.title)
                 continue
 
 class SelflinkBot:
@@ -165,23 +165,26 @@ class XmlDumpTemplatePageGenerator:
         import xmlreader
         mysite = pywikibot.getSite()
         dump = xmlreader.XmlDump(self.xmlfilename)
-        # regular expression to find the original template.
+
         # {{vfd}} does the same thing as {{Vfd}}, so both will be found.
         # The old syntax, {{msg:vfd}}, will also be found.
-        # TODO: check site.nocapitalize()
-        templatePatterns = []
-        for template in self.templates:
-            templatePattern = template.title(withNamespace=False)
-            if not pywikibot.getSite().nocapitalize:
-                templatePattern = '[' + templatePattern[0].upper() + templatePattern[0].lower() + ']' + templatePattern[1:]
-            templatePattern = re.sub(' ', '[_ ]', templatePattern)
-            templatePatterns.append(templatePattern)
-        templateRegex = re.compile(r'\{\{ *([mM][sS][gG]:)?(?:%s) *(?P<parameters>\|[^}]+|) *}}' % '|'.join(templatePatterns))
+        def normalize(name):
+            name = name.replace(u'_', u' ')
+            if not mysite.nocapitalize:
+                name = name[:1].upper() + name[1:]
+            return name
+        titles = set([normalize(template.title(withNamespace=False))
+                      for template in self.templates])
 
         for entry in dump.parse():
-            if templateRegex.search(entry.text):
-                page = pywikibot.Page(mysite, entry.title)
-                yield page
+            if '{{' not in entry.text:
+                continue
+            for template in pywikibot.parse_templates(entry.text):
+                if [node for node in template.walk() if not node.isValue
+                        and normalize(node.name()) in titles]:
+                    yield pywikibot.Page.fromNormalizedTitle(mysite,
+                                                             entry.title)
+                    break
 
 
 class TemplateRobot:
@@ -0,0 +1,57 @@
+"""Time pywikibot.debug() calls of a disabled level, which should cost
+hardly more than an empty function call, and writing to the logfile
+directly and in a background thread.
+
+Run from the pywikipedia directory; the optional argument is the number of
+calls.
+"""
+#
+# (C) Pywikipedia bot team, 2013
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+#
+import sys, os, time, logging, tempfile
+sys.path.append(os.getcwd())
+
+import wikipedia as pywikibot
+
+calls = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+title = u'Page title'
+
+def nothing(text, layer):
+    pass
+
+def timeit(name, function):
+    start = time.time()
+    for i in xrange(calls):
+        function()
+    elapsed = time.time() - start
+    print '%-36s %8.3f s %6.2f us/call' % (name, elapsed,
+                                          elapsed * 1000000 / calls)
+
+timeit('empty function',
+       lambda: nothing(u'Loaded %s' % title, 'bench'))
+timeit('disabled debug, formatted by caller',
+       lambda: pywikibot.debug(u'Loaded %s' % title, 'bench'))
+timeit('disabled debug, lazy arguments',
+       lambda: pywikibot.debug(u'Loaded %s', 'bench', args=(title,)))
+
+# write records to a logfile, like with -log
+log = logging.getLogger('pywiki.bench')
+log.propagate = False
+log.setLevel(logging.DEBUG)
+handle, filename = tempfile.mkstemp()
+os.close(handle)
+for name in ('logfile', 'logfile in a background thread'):
+    handler = logging.FileHandler(filename)
+    if name != 'logfile':
+        handler = pywikibot.AsyncLogHandler(handler)
+    log.addHandler(handler)
+    timeit(name, lambda: log.debug(u'Loaded %s', title))
+    log.removeHandler(handler)
+    start = time.time()
+    handler.close()
+    print '%-36s %8.3f s' % ('  closing the handler', time.time() - start)
+os.unlink(filename)
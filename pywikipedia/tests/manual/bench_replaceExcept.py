@@ -0,0 +1,32 @@
+"""Time pywikibot.replaceExcept() on large pages to show that it scales
+linearly with the number of matches.
+
+Run from the pywikipedia directory; the optional argument is the largest
+number of lines of the page.
+"""
+#
+# (C) Pywikipedia bot team, 2013
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+#
+import sys, os, time
+sys.path.append(os.getcwd())
+
+import wikipedia as pywikibot
+
+line = u'* teh [[foo]] <!-- teh --> and teh {{bar|teh}} <nowiki>teh</nowiki>\n'
+exceptions = ['comment', 'nowiki', 'link', 'template']
+largest = len(sys.argv) > 1 and int(sys.argv[1]) or 64000
+site = pywikibot.getSite()
+
+lines = 1000
+while lines <= largest:
+    text = line * lines
+    start = time.time()
+    pywikibot.replaceExcept(text, r'\bteh\b', u'the', exceptions, site=site)
+    elapsed = time.time() - start
+    print '%7d lines %9d bytes %8.3f s %6.2f us/line' % (
+        lines, len(text), elapsed, elapsed * 1000000 / lines)
+    lines *= 2
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for category.py"""
+__version__ = '$Id$'
+
+import os
+import re
+import tempfile
+import unittest
+import test_utils
+
+import category
+import query
+import wikipedia
+from test_xmlreader import path
+from test_catlib import FakeCategory
+
+
+class CategoryDatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.site = wikipedia.getSite('en', 'wikipedia')
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        self.catDB = category.CategoryDatabase(filename=self.filename)
+        # no recent changes are needed
+        self.catDB.refreshed.add(self.site.sitename())
+
+    def tearDown(self):
+        self.catDB.dump()
+        os.unlink(self.filename)
+
+    def titles(self, pages):
+        return [page.title() for page in pages]
+
+    def test_contents(self):
+        cat = FakeCategory(self.site, u'Category:B')
+        self.assertEqual([u'Category:C', u'Category:D'],
+                         self.titles(self.catDB.getSubcats(cat)))
+        self.assertEqual([u'Page B'], self.titles(self.catDB.getArticles(cat)))
+        # the data is kept on disk
+        self.catDB.dump()
+        self.catDB = category.CategoryDatabase(filename=self.filename)
+        self.catDB.refreshed.add(self.site.sitename())
+        cat = wikipedia.Page(self.site, u'Category:B')
+        self.assertEqual([u'Category:C', u'Category:D'],
+                         self.titles(self.catDB.getSubcats(cat)))
+
+    def test_update(self):
+        cat = FakeCategory(self.site, u'Category:B')
+        self.catDB.getArticles(cat)
+        self.catDB.update(self.site, {
+            u'Page B': (0, set()),
+            u'Page E': (0, set([u'Category:B'])),
+            u'Category:C': (14, set()),
+        }, u'2013-01-01T00:00:00Z')
+        self.assertEqual([u'Page E'], self.titles(self.catDB.getArticles(cat)))
+        self.assertEqual([u'Category:D'],
+                         self.titles(self.catDB.getSubcats(cat)))
+        self.catDB.rebuild()
+        self.catDB.refreshed.add(self.site.sitename())
+        self.assertEqual([u'Page B'], self.titles(self.catDB.getArticles(cat)))
+
+    def loadDump(self, pages):
+        """Load a dump with the pages given as (title, text) tuples."""
+        xml = open(path + '/data/article-pear.xml').read()
+        start = xml.index('<page>')
+        end = xml.rindex('</page>') + len('</page>')
+        # the text of every revision
+        textR = re.compile('<text.*?</text>', re.S)
+        entries = []
+        for title, links in pages:
+            page = xml[start:end].replace('<title>Pear</title>',
+                                          '<title>%s</title>' % title)
+            entries.append(textR.sub('<text>%s</text>' % links, page))
+        handle, filename = tempfile.mkstemp('.xml')
+        try:
+            os.write(handle, xml[:start] + '\n'.join(entries) + xml[end:])
+            os.close(handle)
+            self.catDB.loadDump(self.site, filename)
+        finally:
+            os.remove(filename)
+
+    def test_loadDump(self):
+        self.loadDump([(u'Pear', u'[[Category:Pyrus|P]]'),
+                       (u'Category:Pyrus', u'[[category:Maloideae]]'),
+                       (u'Apple', u'[[Category:Maloideae]]')])
+        cat = wikipedia.Page(self.site, u'Category:Maloideae')
+        self.assertEqual([u'Apple'], self.titles(self.catDB.getArticles(cat)))
+        self.assertEqual(1, self.catDB.countArticles(cat))
+        self.assertEqual([u'Category:Pyrus'],
+                         self.titles(self.catDB.getSubcats(cat)))
+        self.assertEqual([u'Apple', u'Pear'],
+                         self.titles(self.catDB.getArticles(cat, recurse=True)))
+        cat = wikipedia.Page(self.site, u'Category:Pyrus')
+        self.assertEqual([u'Category:Maloideae'],
+                         self.titles(self.catDB.getSupercats(cat)))
+
+    def test_recurse(self):
+        # every category of a level is in both categories of the level
+        # above, so there are 2 ** 20 paths to the lowest one; the lowest is
+        # in the highest again
+        pages = []
+        for level in range(1, 21):
+            links = u'[[Category:%d a]] [[Category:%d b]]' % (level - 1,
+                                                              level - 1)
+            pages.append((u'Category:%d a' % level, links))
+            pages.append((u'Category:%d b' % level, links))
+            pages.append((u'Page %d' % level, u'[[Category:%d a]]' % level))
+        pages.append((u'Category:0 a', u'[[Category:20 b]]'))
+        self.loadDump(pages)
+        visited = []
+        contents = self.catDB._contents
+        def count(cat):
+            visited.append(cat.title())
+            return contents(cat)
+        self.catDB._contents = count
+        cat = wikipedia.Page(self.site, u'Category:0 a')
+        titles = self.titles(self.catDB.getArticles(cat, recurse=True))
+        self.assertEqual(20, len(titles))
+        self.assertEqual(set([u'Page %d' % level for level in range(1, 21)]),
+                         set(titles))
+        self.assertEqual(len(visited), 2 * len(set(visited)))
+        # 0 a, 1 a, 1 b, 2 a, 2 b
+        del visited[:]
+        self.assertEqual([u'Page 1', u'Page 2'],
+                         self.titles(self.catDB.getArticles(cat, recurse=2)))
+        self.assertEqual(5, len(set(visited)))
+
+    def fakeRecentChanges(self, changes, categories):
+        """Replace query.iterate by a fake one returning the recent changes
+        given as (title, ns) tuples and the categories of these pages.
+
+        """
+        self.queries = []
+        def iterate(params, site, limit=None):
+            self.queries.append(dict(params))
+            if 'prop' in params:
+                return [{'title': title, 'categories': [
+                            {'title': cat} for cat in categories.get(title, [])]}
+                        for title in params['titles']]
+            if limit == 1 and params['rcdir'] == 'newer':
+                return [{'timestamp': u'2002-01-01T00:00:00Z'}]
+            if limit == 1:
+                return [{'timestamp': u'2013-01-01T00:00:00Z'}]
+            return [{'title': title, 'ns': ns,
+                     'timestamp': u'2012-01-01T00:00:00Z'}
+                    for title, ns in changes]
+        self.iterate = query.iterate
+        query.iterate = iterate
+
+    def restoreRecentChanges(self):
+        query.iterate = self.iterate
+
+    def test_refresh(self):
+        self.loadDump([(u'Pear', u'[[Category:Pyrus]]'),
+                       (u'Apple', u'[[Category:Maloideae]]')])
+        self.fakeRecentChanges([(u'Pear', 0), (u'Quince', 0)],
+                               {u'Quince': [u'Category:Pyrus', u'Category:X']})
+        try:
+            self.catDB.refresh(self.site)
+        finally:
+            self.restoreRecentChanges()
+        # only the changes which can change category links are asked for
+        self.assertEqual(['edit', 'new', 'log'], self.queries[1]['rctype'])
+        self.assertEqual([u'Pear', u'Quince'],
+                         sorted(self.queries[2]['titles']))
+        cat = wikipedia.Page(self.site, u'Category:Pyrus')
+        self.assertEqual([u'Quince'], self.titles(self.catDB.getArticles(cat)))
+        self.assertEqual(u'2012-01-01T00:00:00Z',
+                         self.catDB._timestamp(self.site))
+
+    def test_refresh_unknown(self):
+        # without any listed category, the changes are not needed
+        self.catDB._setTimestamp(self.site, u'2002-08-31T03:27:15Z')
+        self.fakeRecentChanges([(u'Pear', 0)], {})
+        try:
+            self.catDB.refresh(self.site)
+        finally:
+            self.restoreRecentChanges()
+        self.assertEqual(2, len(self.queries))
+        self.assertEqual(u'2013-01-01T00:00:00Z',
+                         self.catDB._timestamp(self.site))
+
+    def test_refresh_many(self):
+        self.loadDump([(u'Pear', u'[[Category:Pyrus]]'),
+                       (u'Category:Pyrus', u'[[Category:Maloideae]]')])
+        self.catDB.maxChanges = 2
+        self.fakeRecentChanges([(u'Page %d' % i, 0) for i in range(5)], {})
+        try:
+            self.catDB.refresh(self.site)
+        finally:
+            self.restoreRecentChanges()
+        # the categories of the changed pages are not asked for
+        self.assertFalse([params for params in self.queries
+                          if 'prop' in params])
+        self.assertEqual([(None, None), (None, None)], self.catDB.db.execute(
+            'SELECT listed, superlisted FROM categories').fetchall())
+        self.assertEqual(u'2013-01-01T00:00:00Z',
+                         self.catDB._timestamp(self.site))
+
+if __name__ == '__main__':
+    unittest.main()
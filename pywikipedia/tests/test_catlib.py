@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for catlib.py"""
+__version__ = '$Id$'
+
+import unittest
+import test_utils
+
+import catlib
+import wikipedia
+
+
+# Category:A contains B and C, B contains C and D, C contains A again
+TREE = {
+    u'A': [u'B', u'C', u'Page A'],
+    u'B': [u'C', u'D', u'Page B'],
+    u'C': [u'A', u'Page C'],
+    u'D': [u'Page D', u'Page A'],
+}
+
+
+class FakeCategory(catlib.Category):
+    """A Category whose members are listed from TREE."""
+
+    def _parseCategory(self, purge=False, startFrom=None, sortby=None,
+                       sortdir=None, endsort=None):
+        for title in TREE[self.title(withNamespace=False)]:
+            if title.startswith(u'Page'):
+                yield catlib.ARTICLE, wikipedia.Page(self.site(), title)
+            else:
+                yield catlib.SUBCATEGORY, FakeCategory(self.site(),
+                                                       u'Category:' + title)
+
+
+class CategoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.site = wikipedia.getSite('en', 'wikipedia')
+        self.cat = FakeCategory(self.site, u'Category:A')
+
+    def titles(self, pages):
+        return [page.title(withNamespace=False) for page in pages]
+
+    def test_articles(self):
+        self.assertEqual([u'Page A'], self.titles(self.cat.articles()))
+        self.assertEqual([u'Page A', u'Page B', u'Page C'],
+                         self.titles(self.cat.articles(recurse=1)))
+        self.assertEqual([u'Page A', u'Page B', u'Page C', u'Page D',
+                          u'Page A'],
+                         self.titles(self.cat.articles(recurse=True)))
+        self.assertEqual([u'Page A', u'Page B', u'Page C', u'Page D'],
+                         self.titles(self.cat.articles(recurse=True,
+                                                       cacheResults=True)))
+
+    def test_subcategories(self):
+        self.assertEqual([u'B', u'C', u'C', u'D', u'A'],
+                         self.titles(self.cat.subcategories(recurse=True)))
+        self.assertEqual([u'B', u'C', u'D', u'A'],
+                         self.titles(self.cat.subcategories(
+                             recurse=True, cacheResults=True)))
+        self.assertEqual([u'A', u'B', u'C', u'D'],
+                         self.titles(self.cat.subcategoriesList(recurse=True)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for diskcache.py"""
+__version__ = '$Id$'
+
+import os
+import unittest
+import test_utils
+
+import diskcache
+
+
+class DiskCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.data = [(u'Message%d' % i, u'Text ä %d' % i) for i in range(1000)]
+        self.data.append((u'Ärger7', u'Text ä 7'))
+
+    def test_lookup(self):
+        cache = diskcache.CachedReadOnlyDictI(self.data, prefix='test-',
+                                              max_size=5)
+        try:
+            self.assertEqual(1001, len(cache))
+            self.assertEqual(u'Text ä 5', cache[u'message5'])
+            self.assertEqual(u'Text ä 999', cache['MESSAGE999'])
+            self.assertTrue(u'message0' in cache)
+            self.assertFalse(u'message1000' in cache)
+            self.assertRaises(KeyError, cache.__getitem__, u'')
+            # non-ASCII keys are lowercased the same way when written and
+            # when looked up, whether given as unicode or UTF-8
+            self.assertEqual(u'Text ä 7', cache[u'ärger7'])
+            self.assertEqual(u'Text ä 7', cache[u'ÄRGER7'.encode('utf-8')])
+            for key, value in self.data:
+                self.assertEqual(value, cache[key])
+            self.assertEqual(5, len(cache.cache))
+        finally:
+            cache.delete()
+        self.assertFalse(os.path.exists(cache.cache_path))
+
+    def test_persistent(self):
+        name = 'test-diskcache-%d' % os.getpid()
+        self.assertEqual(None, diskcache.CachedReadOnlyDictI.load(name))
+        cache = diskcache.CachedReadOnlyDictI(self.data, name=name)
+        cache.delete()
+        try:
+            cache = diskcache.CachedReadOnlyDictI.load(name)
+            self.assertEqual(u'Text ä 42', cache[u'message42'])
+            cache.delete()
+        finally:
+            os.unlink(cache.cache_path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/comms/http.py and connectionpool.py"""
+__version__ = '$Id$'
+
+import errno
+import httplib
+import socket
+import threading
+import time
+import unittest
+import urllib2
+import BaseHTTPServer
+import SocketServer
+import test_utils
+
+from pywikibot.comms import connectionpool, http
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answer every request, then close the connection silently."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.lock.acquire()
+        server.requests.append((self.command, self.path))
+        server.lock.release()
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.path == '/slow' and len(server.requests) > 1:
+            time.sleep(1)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+        # the client still believes the connection is alive
+        self.close_connection = not server.keep_open
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StaleConnectionTestCase(unittest.TestCase):
+
+    def test_stale_connection(self):
+        reset = socket.error(errno.ECONNRESET, 'reset')
+        empty = httplib.BadStatusLine('')
+        self.assertTrue(connectionpool.stale_connection(reset, False))
+        self.assertTrue(connectionpool.stale_connection(reset, False, 'data'))
+        self.assertTrue(connectionpool.stale_connection(reset, True))
+        self.assertFalse(connectionpool.stale_connection(reset, True, 'data'))
+        self.assertTrue(connectionpool.stale_connection(empty, True))
+        self.assertFalse(connectionpool.stale_connection(empty, True, 'data'))
+        self.assertFalse(connectionpool.stale_connection(
+            httplib.BadStatusLine('garbage'), True))
+        self.assertFalse(connectionpool.stale_connection(
+            socket.timeout('timed out'), False))
+        self.assertFalse(connectionpool.stale_connection(
+            socket.error(errno.ECONNREFUSED, 'refused'), False))
+
+
+class Connection(object):
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def test_max_idle(self):
+        pool = connectionpool.ConnectionPool(max_idle=2)
+        conns = [Connection() for i in range(3)]
+        for host in 'aab':
+            self.assertEqual(None, pool.pop_connection(host))
+        for host, conn in zip('aab', conns):
+            pool.push_connection(host, conn)
+        # the connection idle for the longest time is closed
+        self.assertEqual([True, False, False], [c.closed for c in conns])
+        self.assertEqual(conns[1], pool.pop_connection('a'))
+        self.assertEqual(None, pool.pop_connection('a'))
+        pool.release('a')
+        pool.push_connection('a', conns[1])
+        pool.close()
+        self.assertEqual([True, True, True], [c.closed for c in conns])
+        self.assertEqual(1, pool.stats()['reused'])
+
+
+class KeepAliveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.keep_open = False
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.base = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        self.pool = connectionpool.ConnectionPool(2, 2)
+        self.opener = urllib2.build_opener(http.KeepAliveHandler(self.pool))
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def open_twice(self, path, data=None, timeout=10):
+        self.assertEqual('ok', self.opener.open(self.base + path, data,
+                                                timeout).read())
+        # give the server time to close the connection
+        time.sleep(0.1)
+        return self.opener.open(self.base + path, data, timeout).read()
+
+    def test_get_retried(self):
+        self.assertEqual('ok', self.open_twice('page'))
+        self.assertEqual(1, self.pool.stats()['stale'])
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_post_not_resent(self):
+        self.assertRaises(urllib2.URLError, self.open_twice, 'page', 'a=b')
+        self.assertEqual(0, self.pool.stats()['stale'])
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_timeout_not_retried(self):
+        self.server.keep_open = True
+        self.assertRaises(urllib2.URLError, self.open_twice, 'slow',
+                          timeout=0.3)
+        self.assertEqual(2, len(self.server.requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,7 @@ __version__ = '$Id$'
 import unittest
 import test_pywiki, test_wikipedia
 
-import sys, time
+import sys, time, threading
 
 import wikipedia as pywikibot
 import pagegenerators
@@ -24,6 +24,19 @@ import pagegenerators
 PAGE_SET_GENERIC = test_wikipedia.PAGE_SET_Page_getSections[:5]
 
 
+class CountingPreloader(pagegenerators.PreloadingGenerator):
+    """Remembers the batches it has loaded."""
+
+    def __init__(self, *args, **kwargs):
+        pagegenerators.PreloadingGenerator.__init__(self, *args, **kwargs)
+        self.loaded = []
+
+    def preload(self, page_list, retry=False):
+        self.loaded.append(page_list)
+        return pagegenerators.PreloadingGenerator.preload(self, page_list,
+                                                          retry)
+
+
 class PyWikiPageGeneratorsTestCase(test_pywiki.PyWikiTestCase):
 
     def setUp(self):
@@ -61,6 +74,59 @@ class PyWikiPageGeneratorsTestCase(test_pywiki.PyWikiTestCase):
                            call=True)
         # more tests ... ?!
 
+    def getall(self, site, pages, *args, **kwargs):
+        self.fail('%d pages loaded from %s' % (len(pages), site))
+
+    def test_PreloadingGenerator_prefetch(self):
+        # pages already loaded are not fetched again, so no server access
+        getall, pywikibot.getall = pywikibot.getall, self.getall
+        try:
+            self._test_PreloadingGenerator_prefetch()
+        finally:
+            pywikibot.getall = getall
+
+    def _test_PreloadingGenerator_prefetch(self):
+        pages = []
+        for i in range(25):
+            page = pywikibot.Page(self.site, u'Preload %d' % i)
+            page._contents = u'x' * 100
+            pages.append(page)
+        for depth, maxBytes in ((0, None), (1, None), (3, None), (3, 150)):
+            gen = pagegenerators.PreloadingGenerator(iter(pages), pageNumber=4,
+                                                     depth=depth,
+                                                     maxBytes=maxBytes)
+            self.assertEqual(pages, list(gen))
+        # stopping early must not hang the background thread
+        gen = iter(pagegenerators.PreloadingGenerator(iter(pages),
+                                                      pageNumber=4, depth=1))
+        self.assertEqual(pages[0], gen.next())
+        gen.close()
+        self.assertFalse([thread for thread in threading.enumerate()
+                          if thread.getName() == 'Preload-Thread'])
+        # with depth 1, only one batch is loaded ahead of the one in use
+        preloader = CountingPreloader(iter(pages), pageNumber=4, depth=1)
+        gen = iter(preloader)
+        self.assertEqual(pages[0], gen.next())
+        for i in range(100):
+            if len(preloader.loaded) >= 2:
+                break
+            time.sleep(0.02)
+        time.sleep(0.2)
+        self.assertEqual(2, len(preloader.loaded))
+        gen.close()
+
+    def test_PreloadingGenerator_sites(self):
+        sites = [self.site, pywikibot.getSite('en', 'wikipedia'),
+                 pywikibot.getSite('fr', 'wikipedia')]
+        pages = []
+        for i in range(12):
+            page = pywikibot.Page(sites[i % 3], u'Preload %d' % i)
+            page._contents = u'x'
+            pages.append(page)
+        gen = pagegenerators.PreloadingGenerator(iter(pages), pageNumber=5)
+        # the original order is kept although the sites are loaded apart
+        self.assertEqual(pages, list(gen))
+
     # (RegexFilterPageGenerator)
 
     def test_sequence_and_buffering(self):
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pagestore.py"""
+__version__ = '$Id$'
+
+import gc
+import os
+import unittest
+import test_utils
+
+import config
+import pagestore
+import wikipedia
+
+
+class Owner(object):
+    pass
+
+
+class PageContentStoreTestCase(unittest.TestCase):
+
+    def test_store(self):
+        store = pagestore.PageContentStore(100)
+        owners = [Owner() for i in range(50)]
+        try:
+            keys = [store.add(owner, u'Text ä %d' % i)
+                    for i, owner in enumerate(owners)]
+            self.assertTrue(store.memory <= 100)
+            self.assertTrue(os.path.exists(store.path))
+            self.assertEqual(50, len(store))
+            for i, key in enumerate(keys):
+                self.assertEqual(u'Text ä %d' % i, store[key])
+            key = store.add(owners[0], 'bytes')
+            self.assertEqual(str, type(store[key]))
+            store.discard(keys[1])
+            self.assertFalse(keys[1] in store)
+            self.assertRaises(KeyError, store.__getitem__, keys[1])
+            del owners[2]
+            gc.collect()
+            self.assertFalse(keys[2] in store)
+            self.assertTrue(keys[3] in store)
+        finally:
+            store.close()
+        self.assertFalse(os.path.exists(store.path))
+        self.assertEqual(0, len(store))
+
+    def test_memory_only(self):
+        store = pagestore.PageContentStore(1000)
+        owner = Owner()
+        key = store.add(owner, u'Text')
+        self.assertEqual(u'Text', store[key])
+        self.assertEqual(None, store.path)
+        store.close()
+
+
+class PageContentsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = config.page_contents_memory
+        self.store = wikipedia._pageContentStore
+        config.page_contents_memory = 100
+        wikipedia._pageContentStore = None
+        self.site = wikipedia.getSite('en', 'wikipedia')
+
+    def tearDown(self):
+        wikipedia.pageContentStore().close()
+        config.page_contents_memory = self.memory
+        wikipedia._pageContentStore = self.store
+
+    def test_contents(self):
+        store = wikipedia.pageContentStore()
+        pages = [wikipedia.Page(self.site, u'Page %d' % i) for i in range(20)]
+        self.assertFalse(pages[0]._hasContents())
+        self.assertRaises(AttributeError, getattr, pages[0], '_contents')
+        for i, page in enumerate(pages):
+            page._contents = u'Text ä %d' % i
+        self.assertEqual(20, len(store))
+        # the texts are not kept in the pages
+        self.assertFalse('_contents' in pages[0].__dict__)
+        self.assertTrue(store.path is not None)
+        for i, page in enumerate(pages):
+            self.assertTrue(page._hasContents())
+            self.assertEqual(u'Text ä %d' % i, page._contents)
+        key = pages[0]._contentsKey
+        pages[0]._contents = u'New text'
+        self.assertFalse(key in store)
+        self.assertEqual(u'New text', pages[0]._contents)
+        key = pages[1]._contentsKey
+        del pages[1]._contents
+        self.assertFalse(pages[1]._hasContents())
+        self.assertFalse(key in store)
+        # the text of a page is dropped with the page
+        key = pages[2]._contentsKey
+        del pages[2]
+        gc.collect()
+        self.assertFalse(key in store)
+        self.assertEqual(18, len(store))
+        # other objects than texts are kept in the page
+        pages[3]._contents = None
+        self.assertTrue(pages[3]._hasContents())
+        self.assertEqual(None, pages[3]._contents)
+        self.assertEqual(17, len(store))
+
+if __name__ == '__main__':
+    unittest.main()
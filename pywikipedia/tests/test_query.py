@@ -154,5 +154,136 @@ class PyWikiQueryTestCase(tests.test_pywiki.PyWikiTestCase):
         }}
         self.assertEqualQueryResult(params, expectedresult)
 
+    def test_iterate(self):
+        params = {
+            'list': 'allpages',
+            'apfrom': u'Example',
+            'aplimit': 2,
+        }
+        titles = [page['title']
+                  for page in query.iterate(params, self.site, limit=5)]
+        # five titles from three requests, without repetitions
+        self.assertEqual(5, len(titles))
+        self.assertEqual(5, len(set(titles)))
+        self.assertEqual(sorted(titles), titles)
+        self.assertEqual(2, params['aplimit'])
+
+class FakeSite:
+    """Answers the first request with a maxlag error."""
+
+    def __init__(self):
+        self.answers = ['{"error": {"code": "maxlag", "info": '
+                        '"Waiting for 10.0.0.1: 12 seconds lagged"}}',
+                        '{"query": {}}']
+
+    def versionnumber(self):
+        return 20
+
+    def api_address(self):
+        return '/w/api.php?'
+
+    def urlEncode(self, query):
+        return ''
+
+    def getUrl(self, path, retry=None, sysop=False, data=None):
+        return self.answers.pop(0)
+
+
+class MaxlagTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.paused = []
+        self.pause = pywikibot.get_throttle.pause
+        pywikibot.get_throttle.pause = lambda seconds, site: \
+                                       self.paused.append((seconds, site))
+
+    def tearDown(self):
+        pywikibot.get_throttle.pause = self.pause
+
+    def test_maxlag(self):
+        site = FakeSite()
+        data = query.GetData({'action': 'query', 'meta': 'siteinfo'}, site)
+        self.assertEqual({'query': {}}, data)
+        self.assertEqual([(6, site)], self.paused)
+
+    def test_maxlag_retries(self):
+        site = FakeSite()
+        site.answers = site.answers[:1] * 4
+        data = query.GetData({'action': 'query', 'meta': 'siteinfo'}, site,
+                             retryCount=2)
+        # the servers stay lagged, so the error is given back after the
+        # retries are used up
+        self.assertEqual('maxlag', data['error']['code'])
+        self.assertEqual(2, len(self.paused))
+        self.assertEqual(1, len(site.answers))
+
+
+class IterateSite:
+
+    def isAllowed(self, right, sysop=False):
+        return False
+
+
+class IterateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.GetData = query.GetData
+        query.GetData = self.fakeGetData
+
+    def tearDown(self):
+        query.GetData = self.GetData
+
+    def fakeGetData(self, params, site, sysop=False):
+        self.requests.append(params)
+        return self.answers.pop(0)
+
+    def test_continue(self):
+        self.answers = [
+            {'query': {'allpages': [{'title': u'A'}, {'title': u'B'}]},
+             'continue': {'apcontinue': u'C', 'continue': u'-||'}},
+            {'query': {'allpages': [{'title': u'C'}, {'title': u'D'}]},
+             'continue': {'apcontinue': u'E', 'continue': u'-||'}},
+            {'query': {'allpages': [{'title': u'E'}]}},
+        ]
+        params = {'list': 'allpages', 'aplimit': 2}
+        titles = [page['title'] for page in
+                  query.iterate(params, IterateSite(), limit=5)]
+        self.assertEqual([u'A', u'B', u'C', u'D', u'E'], titles)
+        self.assertEqual({'list': 'allpages', 'aplimit': 2}, params)
+        self.assertEqual([2, 2, 1],
+                         [request['aplimit'] for request in self.requests])
+        self.assertEqual(u'E', self.requests[2]['apcontinue'])
+
+    def test_limit(self):
+        self.answers = [{'query': {'allpages': [{'title': u'A'}]},
+                         'continue': {'apcontinue': u'B'}}]
+        params = {'list': 'allpages', 'aplimit': 5000}
+        titles = [page['title'] for page in
+                  query.iterate(params, IterateSite(), limit=1)]
+        self.assertEqual([u'A'], titles)
+        # at most what the account may request and what is still wanted
+        self.assertEqual(1, self.requests[0]['aplimit'])
+        self.assertEqual(1, len(self.requests))
+
+    def test_query_continue(self):
+        self.answers = [
+            {'query': {'pages': {'1': {'title': u'A', 'categories': [u'1']}}},
+             'query-continue': {'categories': {'clcontinue': u'1|2'},
+                                'allpages': {'gapcontinue': u'B'}}},
+            {'query': {'pages': {'1': {'title': u'A', 'categories': [u'2']}}},
+             'query-continue': {'allpages': {'gapcontinue': u'B'}}},
+            {'query': {'pages': {'2': {'title': u'B', 'categories': [u'3']}}}},
+        ]
+        params = {'generator': 'allpages', 'prop': 'categories'}
+        pages = list(query.iterate(params, IterateSite()))
+        self.assertEqual([u'1', u'2', u'3'],
+                         [page['categories'][0] for page in pages])
+        # the generator is continued after the categories of its pages
+        self.assertEqual(u'1|2', self.requests[1]['clcontinue'])
+        self.assertFalse('gapcontinue' in self.requests[1])
+        self.assertEqual(u'B', self.requests[2]['gapcontinue'])
+        self.assertFalse('clcontinue' in self.requests[2])
+
 if __name__ == "__main__":
     unittest.main()
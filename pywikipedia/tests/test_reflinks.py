@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for reflinks.py"""
+__version__ = '$Id$'
+
+import threading
+import unittest
+import urllib2
+import BaseHTTPServer
+import SocketServer
+import test_utils
+
+import reflinks
+from pywikibot.comms.connectionpool import ConnectionPool
+import wikipedia
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.lock.acquire()
+        server.requests.append(self.path)
+        server.connections.add(self.client_address)
+        server.lock.release()
+        if self.path == '/moved':
+            self.send_response(301)
+            self.send_header('Location', '/page')
+            body = ''
+        elif self.path == '/gone':
+            self.send_response(410)
+            body = ''
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            body = '<title>Page</title>' + 'x' * 1000
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.connections = set()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.base = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        self.connections = ConnectionPool(max_idle=2)
+
+    def tearDown(self):
+        self.connections.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_urlopen(self):
+        f = reflinks.urlopen(self.base + 'moved', self.connections)
+        self.assertEqual(self.base + 'page', f.geturl())
+        self.assertEqual('text/html', f.info().getheader('Content-Type'))
+        self.assertEqual('<title>', f.read(7))
+        f.close()
+        try:
+            reflinks.urlopen(self.base + 'gone', self.connections)
+        except urllib2.HTTPError, e:
+            self.assertEqual(410, e.code)
+        else:
+            self.fail('no HTTPError')
+        self.assertEqual(['/moved', '/page', '/gone'], self.server.requests)
+        # the partly read page is short enough to be drained and reused
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_fetcher(self):
+        site = wikipedia.getSite('en', 'wikipedia')
+        page = wikipedia.Page(site, u'Page')
+        loaded = []
+
+        def getTitle(ref, page):
+            loaded.append(ref.url)
+            return reflinks.TITLE, ref.url[-1]
+
+        fetcher = reflinks.TitleFetcher(getTitle, 4)
+        try:
+            refs = [reflinks.RefLink(u'http://www.example.org/%d#%d'
+                                     % (i % 3, i), u'') for i in range(9)]
+            for ref in refs:
+                fetcher.add(ref, page)
+            for i, ref in enumerate(refs):
+                self.assertEqual((reflinks.TITLE, str(i % 3)),
+                                 fetcher.result(ref, page))
+        finally:
+            fetcher.close()
+        self.assertEqual(3, len(loaded))
+
+    def test_maxResults(self):
+        site = wikipedia.getSite('en', 'wikipedia')
+        page = wikipedia.Page(site, u'Page')
+        loaded = []
+
+        def getTitle(ref, page):
+            loaded.append(ref.url)
+            return reflinks.TITLE, ref.url[-1]
+
+        fetcher = reflinks.TitleFetcher(getTitle, 1, maxResults=2)
+        try:
+            for i in (0, 1, 1, 2, 0):
+                ref = reflinks.RefLink(u'http://www.example.org/%d' % i, u'')
+                self.assertEqual((reflinks.TITLE, str(i)),
+                                 fetcher.result(ref, page))
+        finally:
+            fetcher.close()
+        # the result of the first URL was dropped before it came again
+        self.assertEqual(4, len(loaded))
+        self.assertEqual(2, len(fetcher.results))
+
+
+class Page:
+
+    def __init__(self, title, editable):
+        self._title = title
+        self.editable = editable
+
+    def get(self):
+        return u'<ref>http://www.example.org/%s</ref>' % self._title
+
+    def title(self, asLink=False):
+        return self._title
+
+    def canBeEdited(self):
+        return self.editable
+
+
+class Fetcher:
+
+    def __init__(self):
+        self.urls = []
+
+    def add(self, ref, page):
+        self.urls.append(ref.url)
+
+
+class Robot(reflinks.ReferencesRobot):
+    """A ReferencesRobot which needs neither the wiki nor the web."""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.fetcher = Fetcher()
+        self.lookahead = 1
+
+
+class PreloadTestCase(unittest.TestCase):
+
+    def test_preload(self):
+        bot = Robot([Page(u'a', True), Page(u'b', False), Page(u'c', True)])
+        self.assertEqual([u'a', u'c'],
+                         [page.title() for page in bot.preload()])
+        # the references of pages which can't be edited are not loaded
+        self.assertEqual([u'http://www.example.org/a',
+                          u'http://www.example.org/c'], bot.fetcher.urls)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for replace.py"""
+__version__ = '$Id$'
+
+import os
+import re
+import tempfile
+import unittest
+import test_utils
+
+import replace
+import xmlreader
+from test_xmlreader import path
+
+
+class XmlDumpReplacePageGeneratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        xml = open(path + '/data/article-pear.xml').read()
+        start = xml.index('<page>')
+        end = xml.rindex('</page>') + len('</page>')
+        # the text of every revision
+        textR = re.compile('<text.*?</text>', re.S)
+        pages = []
+        for i in range(20):
+            page = xml[start:end].replace('<title>Pear</title>',
+                                          '<title>Pear %d</title>' % i)
+            text = u'Pear %d' % i
+            if i % 3 == 0:
+                text += u' has a needle'
+            pages.append(textR.sub('<text>%s</text>' % text, page))
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'dump.xml')
+        open(self.filename, 'w').write(xml[:start] + '\n'.join(pages)
+                                       + xml[end:])
+
+    def tearDown(self):
+        for filename in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, filename))
+        os.rmdir(self.directory)
+
+    def titles(self, xmlStart=None, workers=None):
+        gen = replace.XmlDumpReplacePageGenerator(
+            self.filename, xmlStart, [(re.compile(u'needle'), u'thread')],
+            {'title': [re.compile(u'Pear 9$')]}, workers)
+        return [page.title() for page in gen]
+
+    def test_workers(self):
+        expected = [u'Pear 0', u'Pear 3', u'Pear 6', u'Pear 12', u'Pear 15',
+                    u'Pear 18']
+        self.assertEqual(expected, self.titles())
+        # the same pages in the same order, whether the entries are checked
+        # in one, several or one process per CPU
+        for workers in (1, 3, 0):
+            self.assertEqual(expected, self.titles(workers=workers))
+
+    def test_xmlStart(self):
+        expected = [u'Pear 6', u'Pear 12', u'Pear 15', u'Pear 18']
+        for workers in (None, 3):
+            self.assertEqual(expected, self.titles(u'Pear 6', workers))
+            self.assertEqual(expected[1:], self.titles(u'Pear 7', workers))
+        # with an index, the dump is read from the start article on
+        xmlreader.XmlDump(self.filename).build_index()
+        for workers in (None, 3):
+            self.assertEqual(expected, self.titles(u'Pear 6', workers))
+            self.assertEqual(expected[1:], self.titles(u'Pear 7', workers))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@
 """Unit tests for pywikibot/textlib.py"""
 __version__ = '$Id$'
 
+import re
 import unittest
 from tests.test_pywiki import PyWikiTestCase
 
@@ -102,5 +103,118 @@ class PyWikiTextLibTestCase(PyWikiTestCase):
         result = 'Blah\r\n\r\n[[Category:Cat1]]\r\n[[Category:Cat2]]\r\n\r\n[[fr:Test]]'
         self.assertRoundtripCategory(result,2)
 
+    def test_replaceExcept(self):
+        text = u'foo <!-- foo --> <nowiki>foo</nowiki> [[foo]] foo'
+        self.assertEqual(textlib.replaceExcept(text, 'foo', 'bar',
+                                               ['comment', 'nowiki', 'link'],
+                                               site=self.site),
+                         u'bar <!-- foo --> <nowiki>foo</nowiki> [[foo]] bar')
+        self.assertEqual(textlib.replaceExcept(u'a{{a|a}}a', r'(a)', r'\1b',
+                                               ['template'], marker=u'$',
+                                               site=self.site),
+                         u'ab{{a|a}}ab$')
+        self.assertEqual(textlib.replaceExcept(u'aaa', 'aa', 'ba', [],
+                                               allowoverlap=True,
+                                               site=self.site),
+                         u'bba')
+        self.assertEqual(textlib.replaceExcept(u'ab <!--ab--> ab',
+                                               r'(?P<x>a)(b)', r'\2\g<x>',
+                                               ['comment'], site=self.site),
+                         u'ba <!--ab--> ba')
+        # a match of an exception inside another one doesn't hide the
+        # exceptions behind it
+        self.assertEqual(textlib.replaceExcept(u'<!-- [[ --> foo [[foo]] foo',
+                                               'foo', 'bar',
+                                               ['comment', 'link'],
+                                               site=self.site),
+                         u'<!-- [[ --> bar [[foo]] bar')
+        self.assertEqual(textlib.replaceExcept(
+                             u'<!-- <nowiki> --> foo <nowiki>foo</nowiki>',
+                             'foo', 'bar', ['comment', 'nowiki'],
+                             site=self.site),
+                         u'<!-- <nowiki> --> bar <nowiki>foo</nowiki>')
+        self.assertEqual(textlib.replaceExcept(u'<!-- [[ --> a [[a]] a',
+                                               'a', 'b', ['comment', 'link'],
+                                               allowoverlap=True,
+                                               site=self.site),
+                         u'<!-- [[ --> b [[a]] b')
+
+    def test_compiledExceptions(self):
+        textlib._compiledExceptions.clear()
+        for i in range(300):
+            # a new regex object, as re's cache may give when it churns
+            regex = re.compile(u'x%d' % (i % 3))
+            self.assertEqual(u'a', textlib.replaceExcept(
+                u'a', u'a', u'a', ['comment', regex], site=self.site))
+        self.assertEqual(3, len(textlib._compiledExceptions))
+        for i in range(300):
+            textlib.replaceExcept(u'a', u'a', u'a', [re.compile(u'y%d' % i)],
+                                  site=self.site)
+        self.assertTrue(len(textlib._compiledExceptions)
+                        <= textlib._MAX_COMPILED_EXCEPTIONS)
+
+    def test_Replacer(self):
+        replacer = textlib.Replacer(['comment', 'template'], site=self.site)
+        text = u'foo <!-- foo bar --> {{foo}} bar foo'
+        self.assertEqual(replacer.replaceAll(text, [('foo', 'bar'),
+                                                    ('bar', 'baz'),
+                                                    ('qux', 'quux')]),
+                         u'baz <!-- foo bar --> {{foo}} baz baz')
+        # the same text again, with replacements changing its length
+        self.assertEqual(replacer.replaceAll(text, [('o', 'oo'),
+                                                    ('f', '')]),
+                         u'oooo <!-- foo bar --> {{foo}} bar oooo')
+        self.assertEqual(replacer.replace(text, 'x', 'y', marker=u'$'),
+                         text + u'$')
+
+    def test_parse_templates(self):
+        text = u'{{a|b=[[c|d]]|{{e|{{{f|}}}}}}} {{{{g}}}} {{h'
+        templates = textlib.parse_templates(text)
+        self.assertEqual([t.wikitext() for t in templates],
+                         [u'{{a|b=[[c|d]]|{{e|{{{f|}}}}}}}', u'{{{g}}}'])
+        self.assertEqual(templates[0].name(), u'a')
+        self.assertEqual(templates[0].params(),
+                         [(u'b', u'[[c|d]]'), (None, u'{{e|{{{f|}}}}}')])
+        self.assertEqual([(t.wikitext(), t.isValue)
+                          for t in templates[0].walk()],
+                         [(u'{{{f|}}}', True), (u'{{e|{{{f|}}}}}', False),
+                          (templates[0].wikitext(), False)])
+        self.assertTrue(templates[1].isValue)
+
+    def test_extract_templates_and_params(self):
+        text = (u'{{msg:a|b|c = {{d|e=f}}<!-- {{g}} -->|h}} '
+                u'{{#if:x|{{i}}}} {{j{{k}}}} {{l|<math>{{m}}</math>}}')
+        self.assertEqual(textlib.extract_templates_and_params(text),
+                         [(u'd', {u'e': u'f'}),
+                          (u'a', {u'1': u'b', u'c': u'{{d|e=f}}',
+                                  u'2': u'h'}),
+                          (u'i', {}), (u'k', {}),
+                          (u'l', {u'1': u'<math>{{m}}</math>'})])
+        self.assertEqual(textlib.extract_templates_and_params(
+                             u'{{a|b|c=d|e}}', asList=True),
+                         [(u'a', [u'b', u'c=d', u'e'])])
+
+    def test_requiredLiterals(self):
+        def literals(pattern, flags=0):
+            result = textlib.requiredLiterals(re.compile(pattern, flags))
+            return result and sorted(result)
+        self.assertEqual(literals(r'\bteh\b'), [u'teh'])
+        self.assertEqual(literals(r'(?:foo|ba[rz])\s+x'),
+                         [u'bar', u'baz', u'foo'])
+        self.assertEqual(literals(r'a+(Bcd)?'), None)
+        self.assertEqual(literals(r'X(abc)+', re.I), [u'abc'])
+
+    def test_ReplacementIndex(self):
+        index = textlib.LiteralIndex([u'ab', u'abc', u'bcd', u'x'])
+        self.assertEqual(index.find(u'abcd'), set([u'ab', u'abc', u'bcd']))
+        replacements = [(r'\bteh\b', u'the'), (r'the (cat|dog)', u'a \\1'),
+                        (r'(?i)FOO', u'bar'), (r'\d+', u'N')]
+        index = textlib.ReplacementIndex(replacements)
+        self.assertEqual(index.candidates(u'teh foo'), set([0, 2, 3]))
+        replacer = textlib.Replacer([], site=self.site)
+        for text in [u'teh cat Foo 2', u'nothing', u'<!-- the dog -->']:
+            self.assertEqual(replacer.replaceAll(text, index),
+                             replacer.replaceAll(text, replacements))
+
 if __name__ == "__main__":
     unittest.main()
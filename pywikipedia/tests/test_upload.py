@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for upload.py"""
+__version__ = '$Id$'
+
+import StringIO
+import unittest
+import test_utils
+
+import config
+import query
+import upload
+
+
+class FakeSite:
+    def forceLogin(self):
+        pass
+
+    def has_api(self):
+        return True
+
+    def versionnumber(self):
+        return 20
+
+    def getToken(self):
+        return '+\\'
+
+
+class MultipartTestCase(unittest.TestCase):
+
+    def test_encode(self):
+        contentType, body = upload.encode_multipart_formdata(
+            [('comment', u'ä')],
+            [('file', 'a.png', StringIO.StringIO('0123456789'))])
+        boundary = contentType.split('boundary=')[1]
+        expected = '\r\n'.join([
+            '--' + boundary,
+            'Content-Disposition: form-data; name="comment"',
+            '',
+            u'ä'.encode('utf-8'),
+            '--' + boundary,
+            'Content-Disposition: form-data; name="file"; filename="a.png"',
+            'Content-Type: image/png',
+            '',
+            '0123456789',
+            '--' + boundary + '--',
+            ''])
+        self.assertEqual(len(expected), len(body))
+        self.assertEqual(expected[:5], body.read(5))
+        self.assertEqual(expected[5:], body.read())
+        self.assertEqual('', body.read())
+        body.seek(0)
+        self.assertEqual(expected, ''.join(iter(lambda: body.read(3), '')))
+
+    def test_chunk(self):
+        chunk = upload.FileChunk(StringIO.StringIO('0123456789'), 3, 4)
+        self.assertEqual(4, len(chunk))
+        self.assertEqual('345', chunk.read(3))
+        self.assertEqual('6', chunk.read())
+        chunk.seek(0)
+        self.assertEqual('3456', chunk.read(10))
+        self.assertEqual(7, len(upload.FileChunk(StringIO.StringIO('0123456789'),
+                                                 3)))
+
+
+class ChunkedUploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.GetData = query.GetData
+        self.chunkSize = config.upload_chunk_size
+        query.GetData = self.getData
+        config.upload_chunk_size = 4
+        self.received = ''
+        self.requests = []
+
+    def tearDown(self):
+        query.GetData = self.GetData
+        config.upload_chunk_size = self.chunkSize
+
+    def getData(self, params, site):
+        self.requests.append(dict(params))
+        if 'chunk' in params:
+            if params['offset'] != len(self.received):
+                return {'error': {'code': 'stashfailed',
+                                  'offset': len(self.received)}}
+            self.received += params['chunk'].read()
+            if len(self.received) == 8:
+                # the answer to this piece got lost
+                return {'error': {'code': 'internal_api_error'}}
+            if len(self.received) < params['filesize']:
+                return {'upload': {'result': u'Continue', 'filekey': 'key',
+                                   'offset': len(self.received)}}
+            return {'upload': {'result': u'Success', 'filekey': 'key'}}
+        self.assertEqual('key', params['filekey'])
+        return {'upload': {'result': u'Success'}}
+
+    def test_upload(self):
+        bot = upload.UploadRobot('File.png', keepFilename=True,
+                                 verifyDescription=False, targetSite=FakeSite())
+        bot._contents = '0123456789'
+        bot.read_file_content()
+        self.assertEqual(None, bot.upload_chunks(u'File.png'))
+        self.assertEqual(4, bot._offset)
+        # sending the same piece again tells where the server is
+        self.assertEqual('key', bot.upload_chunks(u'File.png'))
+        self.assertEqual('0123456789', self.received)
+        self.assertEqual([0, 4, 4, 8],
+                         [params['offset'] for params in self.requests])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for weblinkchecker.py"""
+__version__ = '$Id$'
+
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+import BaseHTTPServer
+import SocketServer
+import test_utils
+
+import weblinkchecker
+import wikipedia
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.lock.acquire()
+        server.requests += 1
+        server.connections.add(self.client_address)
+        server.active += 1
+        server.maxActive = max(server.maxActive, server.active)
+        server.lock.release()
+        time.sleep(0.02)
+        body = 'Text'
+        if 'dead' in self.path:
+            self.send_response(404)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        server.lock.acquire()
+        server.active -= 1
+        server.lock.release()
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class History:
+    def __init__(self):
+        self.dead = []
+
+    def setLinkAlive(self, url):
+        return False
+
+    def setLinkDead(self, url, error, page, day):
+        self.dead.append((page.title(), url.split('/')[-1], error))
+
+
+class LinkCheckPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.connections = set()
+        self.server.active = 0
+        self.server.maxActive = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        weblinkchecker.day = 7
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_pool(self):
+        site = wikipedia.getSite('en', 'wikipedia')
+        history = History()
+        pool = weblinkchecker.LinkCheckPool(history, threads=8, perHost=2)
+        base = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        for i in range(30):
+            page = wikipedia.Page(site, u'Page %d' % (i % 2))
+            if i % 10 == 0:
+                pool.add(page, base + 'dead')
+            else:
+                pool.add(page, base + 'alive%d' % (i % 5))
+        pool.close()
+        for thread in pool.threads:
+            thread.join(10)
+        pool.connections.close()
+        self.assertEqual(0, pool.pending())
+        # every URL is loaded once, on at most two connections at a time
+        self.assertEqual(6, self.server.requests)
+        self.assertEqual(2, self.server.maxActive)
+        self.assertTrue(len(self.server.connections) <= 2)
+        self.assertEqual([(u'Page 0', 'dead', '404 Not Found')] * 3,
+                         history.dead)
+
+    def test_maxResults(self):
+        site = wikipedia.getSite('en', 'wikipedia')
+        pool = weblinkchecker.LinkCheckPool(History(), threads=1, perHost=1,
+                                            maxResults=2)
+        base = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        page = wikipedia.Page(site, u'Page')
+        for name in ('alive0', 'alive1', 'alive1', 'alive2', 'alive0'):
+            pool.add(page, base + name)
+        pool.close()
+        pool.threads[0].join(10)
+        pool.connections.close()
+        # alive0 was dropped from the results before it came again
+        self.assertEqual(4, self.server.requests)
+        self.assertEqual(set([base + 'alive2', base + 'alive0']),
+                         set(pool.results))
+
+
+class HistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        self.history = weblinkchecker.History(None, filename=self.filename)
+        self.site = wikipedia.getSite('en', 'wikipedia')
+
+    def tearDown(self):
+        self.history.db.close()
+        os.unlink(self.filename)
+
+    def test_history(self):
+        url = 'http://www.example.org/dead'
+        page = wikipedia.Page(self.site, u'Page B')
+        self.history.setLinkDead(url, u'404 Not Found', page, 7)
+        # found again within an hour: not stored twice
+        self.history.setLinkDead(url, u'404 Not Found', page, 7)
+        self.assertEqual(1, len(self.history.entries(url)))
+        self.history.db.execute('UPDATE deadlinks SET date = date - 3600 * 2')
+        self.history.setLinkDead(url, u'404 Not Found',
+                                 wikipedia.Page(self.site, u'Page A'), 7)
+        self.assertEqual([u'Page B', u'Page A'],
+                         [entry[0] for entry in self.history.entries(url)])
+        self.assertEqual([u'Page A', u'Page B'],
+                         list(self.history.pageTitles()))
+        self.assertTrue(self.history.setLinkAlive(url))
+        self.assertFalse(self.history.setLinkAlive(url))
+        self.assertEqual([], list(self.history.pageTitles()))
+
+    def test_importDat(self):
+        handle, datfilename = tempfile.mkstemp()
+        os.write(handle, pickle.dumps({
+            'http://www.example.org/': [(u'Page', 1000000000.0, u'404')]}))
+        os.close(handle)
+        try:
+            self.history.importDat(datfilename)
+            self.assertFalse(os.path.exists(datfilename))
+            self.assertEqual([(u'Page', 1000000000.0, u'404')],
+                             self.history.entries('http://www.example.org/'))
+        finally:
+            os.unlink(datfilename + '.bak')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,9 @@ __version__ = '$Id$'
 import unittest
 import test_pywiki
 
+import logging
 import sys
+import time
 
 import wikipedia as pywikibot
 
@@ -210,6 +212,22 @@ class PyWikiWikipediaTestCase(test_pywiki.PyWikiTestCase):
     def test_Page(self):
         self._check_member(pywikibot, "Page", call=True)
 
+    def test_Page_title_cache(self):
+        for i in range(2):
+            page = pywikibot.Page(self.site, u'diskussion:foo_bar')
+            self.assertEqual(page.title(), u'Diskussion:Foo bar')
+            self.assertEqual(page.namespace(), 1)
+            # the same title in another default namespace
+            page = pywikibot.Page(self.site, u'foo_bar', defaultNamespace=10)
+            self.assertEqual(page.title(), u'Vorlage:Foo bar')
+            page = pywikibot.Page(self.site, u'foo_bar')
+            self.assertEqual(page.title(), u'Foo bar')
+        page = pywikibot.Page.fromNormalizedTitle(self.site, u'Kategorie:X')
+        self.assertEqual(page.namespace(), 14)
+        page = pywikibot.Page.fromNormalizedTitle(self.site, u'Foo', 0)
+        self.assertEqual(pywikibot.Page(self.site, u'Foo',
+                                        defaultNamespace=10).namespace(), 10)
+
     def test_Page_getSections(self):
         self._check_member(pywikibot.Page(self.site, PAGE_SINGLE_GENERIC),
                            "getSections", call=True)
@@ -251,6 +269,73 @@ class PyWikiWikipediaTestCase(test_pywiki.PyWikiTestCase):
         self._check_member(page, "get", call=True)
         page.get()
 
+    def test__GetAll_oneDoneApi(self):
+        pages = [pywikibot.Page(self.site, u'Foo'),
+                 pywikibot.Page(self.site, u'Foo#Bar'),
+                 pywikibot.Page(self.site, u'Missing')]
+        getall = pywikibot._GetAll(self.site, pages, False, False)
+        # pretend the API normalized the first title
+        getall._norm = {u'Foo': u'Foo'}
+        getall.buildIndex()
+        self.assertEqual(getall._index[u'Foo'], pages[:2])
+        self.assertEqual(pages[1].title(), u'Foo#Bar')
+        getall.oneDoneApi({'title': u'Foo', 'lastrevid': 1,
+                           'revisions': [{'user': u'Bot', 'timestamp': u'',
+                                          '*': u'== Bar ==\ntext'}],
+                           'protection': []})
+        getall.oneDoneApi({'title': u'Missing', 'missing': u''})
+        self.assertEqual(pages[0]._contents, u'== Bar ==\ntext')
+        self.assertEqual(pages[1]._contents, u'== Bar ==\ntext')
+        self.assertEqual(pages[2]._getexception, pywikibot.NoPage)
+        self.assertRaises(pywikibot.PageNotFound, getall.oneDoneApi,
+                          {'title': u'Other', 'missing': u''})
+
+    def test_put_async(self):
+        saved = []
+        class TestPage(pywikibot.Page):
+            def put(self, newtext, *args):
+                if newtext is None:
+                    raise pywikibot.PageNotSaved(u'test')
+                saved.append((self.site(), newtext))
+        results = []
+        def callback(page, error):
+            results.append(error)
+        sites = [self.site, pywikibot.getSite('en', 'wikipedia')]
+        for i in range(10):
+            page = TestPage(sites[i % 2], u'Put %d' % i)
+            page.put_async((i != 3 or None) and u'%d' % i, callback=callback)
+        while pywikibot.put_queue_status():
+            time.sleep(0.1)
+        # every site is saved to in order
+        for site in sites:
+            self.assertEqual([text for s, text in saved if s == site],
+                             [u'%d' % i for i in range(10)
+                              if sites[i % 2] == site and i != 3])
+        self.assertEqual(10, len(results))
+        self.assertEqual(1, len([e for e in results if e is not None]))
+        # the former single queue still takes pages
+        pywikibot.page_put_queue.put((TestPage(self.site, u'Put old'),
+                                      u'old', None, None, True, False,
+                                      callback))
+        while pywikibot.page_put_queue.qsize():
+            time.sleep(0.1)
+        self.assertEqual((self.site, u'old'), saved[-1])
+
+    def test_put_async_exit(self):
+        class ExitPage(pywikibot.Page):
+            def put(self, *args):
+                raise SystemExit
+        ExitPage(self.site, u'Put exit').put_async(u'')
+        while pywikibot.put_queue_status():
+            time.sleep(0.1)
+        # the thread stopped, but gave its slot back
+        slots = [pywikibot._put_slots.acquire(False)
+                 for i in range(pywikibot.config.put_threads)]
+        for slot in slots:
+            if slot:
+                pywikibot._put_slots.release()
+        self.assertTrue(all(slots))
+
     def test_DataPage(self):
         self._check_member(pywikibot, "DataPage", call=True)
 
@@ -295,5 +380,112 @@ class PyWikiWikipediaTestCase(test_pywiki.PyWikiTestCase):
         self._check_member(page, "removereferences", call=True)
         # more tests ... ?!
 
+class Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class Unprintable:
+    def __unicode__(self):
+        raise AssertionError('formatted for a disabled level')
+
+
+class LogOutputTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = Records()
+        self.log = logging.getLogger('pywiki.test')
+        self.log.addHandler(self.handler)
+        self.log.propagate = False
+
+    def tearDown(self):
+        self.log.removeHandler(self.handler)
+        self.log.setLevel(logging.NOTSET)
+
+    def test_lazy(self):
+        pywikibot.debug(u'%s', 'test', args=(Unprintable(),))
+        self.assertEqual([], self.handler.records)
+        self.log.setLevel(logging.DEBUG)
+        # enabled debug messages are displayed, too
+        output = pywikibot.ui.output
+        pywikibot.ui.output = lambda *args, **kwargs: None
+        try:
+            pywikibot.debug(u'%d pages', 'test', args=(5,))
+        finally:
+            pywikibot.ui.output = output
+        self.assertEqual(1, len(self.handler.records))
+        self.assertEqual(u'5 pages', self.handler.records[0].getMessage())
+        self.assertEqual('test_lazy', self.handler.records[0].caller_name)
+
+    def test_AsyncLogHandler(self):
+        handler = pywikibot.AsyncLogHandler(self.handler)
+        self.log.removeHandler(self.handler)
+        self.log.addHandler(handler)
+        try:
+            self.log.warning(u'%d pages', 7)
+            try:
+                raise ValueError
+            except ValueError:
+                self.log.exception(u'error')
+            handler.flush()
+            self.assertEqual([u'7 pages', u'error'],
+                             [record.getMessage()
+                              for record in self.handler.records])
+            self.assertTrue('ValueError' in self.handler.records[1].exc_text)
+        finally:
+            self.log.removeHandler(handler)
+            handler.close()
+        self.assertFalse(handler.thread.isAlive())
+
+    def test_AsyncLogHandler_flush(self):
+        # the last record is still being written when the buffer is empty
+        handle = self.handler.handle
+        def slowHandle(record):
+            time.sleep(0.1)
+            handle(record)
+        self.handler.handle = slowHandle
+        handler = pywikibot.AsyncLogHandler(self.handler)
+        self.log.removeHandler(self.handler)
+        self.log.addHandler(handler)
+        try:
+            self.log.warning(u'first')
+            handler.flush()
+            self.assertEqual(1, len(self.handler.records))
+            self.log.warning(u'second')
+            self.log.warning(u'third')
+            handler.flush()
+            self.assertEqual(3, len(self.handler.records))
+        finally:
+            self.log.removeHandler(handler)
+            handler.close()
+        # flushing a closed handler does not block
+        handler.flush()
+
+    def test_AsyncLogHandler_maxsize(self):
+        handle = self.handler.handle
+        def slowHandle(record):
+            time.sleep(0.01)
+            handle(record)
+        self.handler.handle = slowHandle
+        handler = pywikibot.AsyncLogHandler(self.handler, maxsize=3)
+        self.log.removeHandler(self.handler)
+        self.log.addHandler(handler)
+        try:
+            for i in range(10):
+                self.log.warning(u'%d', i)
+                # logging waits while the buffer is full
+                self.assertTrue(len(handler.buffer) <= 3)
+            handler.flush()
+            self.assertEqual([str(i) for i in range(10)],
+                             [record.getMessage()
+                              for record in self.handler.records])
+        finally:
+            self.log.removeHandler(handler)
+            handler.close()
+
 if __name__ == "__main__":
     unittest.main()
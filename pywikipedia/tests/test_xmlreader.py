@@ -6,8 +6,15 @@ import test_utils
 import xmlreader
 
 import os
+import Queue
+import tempfile
+import threading
+import time
 path = os.path.dirname(os.path.abspath(__file__) )
 
+def isEven(entry):
+    return int(entry.title.split()[1]) % 2 == 0
+
 class XmlReaderTestCase(unittest.TestCase):
     def test_XmlDumpAllRevs(self):
         pages = [r for r in xmlreader.XmlDump(path + "/data/article-pear.xml", allrevisions=True).parse()]
@@ -32,6 +39,122 @@ class XmlReaderTestCase(unittest.TestCase):
         pages = [r for r in xmlreader.XmlDump(path + "/data/article-pyrus.xml").parse()]
         self.assertTrue(pages[0].isredirect)
 
+    def _pages(self):
+        """Return the header, the revisions of Pear as 20 pages and the
+        footer of a dump"""
+        xml = open(path + "/data/article-pear.xml").read()
+        start = xml.index('<page>')
+        end = xml.rindex('</page>') + len('</page>')
+        pages = [xml[start:end].replace('<title>Pear</title>',
+                                        '<title>Pear %d</title>' % i)
+                               .replace('<id>24278</id>',
+                                        '<id>%d</id>' % (24278 + i))
+                 for i in range(20)]
+        return xml[:start], pages, xml[end:]
+
+    def test_XmlDumpParallel(self):
+        header, pages, footer = self._pages()
+        handle, filename = tempfile.mkstemp('.xml')
+        try:
+            os.write(handle, header + '\n'.join(pages) + footer)
+            os.close(handle)
+            dump = xmlreader.XmlDump(filename, allrevisions=True)
+            titles = [r.title for r in dump.new_parse()]
+            self.assertEquals(80, len(titles))
+            result = [r.title for r in dump.parallel_parse(processes=3,
+                                                          chunksize=2000)]
+            self.assertEquals(titles, result)
+            result = [r.title for r in dump.parallel_parse(processes=3,
+                                                          ordered=False,
+                                                          chunksize=2000)]
+            self.assertEquals(sorted(titles), sorted(result))
+            result = [r.title for r in dump.parallel_parse(filter=isEven,
+                                                          chunksize=2000)]
+            self.assertEquals([t for t in titles
+                               if int(t.split()[1]) % 2 == 0], result)
+        finally:
+            os.remove(filename)
+
+    def test_split_dump(self):
+        header, pages, footer = self._pages()
+        handle, filename = tempfile.mkstemp('.xml')
+        try:
+            # more than the first megabyte, which is split off at once
+            os.write(handle, header + '\n'.join(pages * 15) + footer)
+            os.close(handle)
+            tasks = Queue.Queue()
+            credits = threading.Semaphore(3)
+            splitter = threading.Thread(
+                target=xmlreader._split_dump,
+                args=(filename, tasks, Queue.Queue(), 2, 20000, credits))
+            splitter.setDaemon(True)
+            splitter.start()
+            time.sleep(0.5)
+            # no more chunks are split off than there are credits
+            self.assertEquals(3, tasks.qsize())
+            self.assertTrue(splitter.isAlive())
+            for i in range(100):
+                credits.release()
+            splitter.join(10)
+            self.assertFalse(splitter.isAlive())
+            chunks = [tasks.get() for i in range(tasks.qsize())]
+            self.assertEquals(range(len(chunks) - 2),
+                              [chunk[0] for chunk in chunks[:-2]])
+            self.assertEquals([None, None], chunks[-2:])
+        finally:
+            os.remove(filename)
+
+    def test_XmlDumpIndex(self):
+        import bz2
+        header, pages, footer = self._pages()
+        directory = tempfile.mkdtemp()
+        try:
+            # an uncompressed dump and a multistream dump of 3 pages per
+            # stream
+            plain = os.path.join(directory, 'dump.xml')
+            open(plain, 'w').write(header + '\n'.join(pages) + footer)
+            multi = os.path.join(directory, 'dump.xml.bz2')
+            streams = [header] + ['\n'.join(pages[i:i + 3])
+                                  for i in range(0, 20, 3)]
+            streams[-1] += footer
+            open(multi, 'wb').write(''.join([bz2.compress(stream)
+                                             for stream in streams]))
+            # an ordinary bz2 dump is a single stream
+            single = os.path.join(directory, 'single.xml.bz2')
+            open(single, 'wb').write(bz2.compress(header + '\n'.join(pages)
+                                                  + footer))
+            for filename in (plain, multi, single):
+                dump = xmlreader.XmlDump(filename)
+                self.assertFalse(dump.has_index())
+                # an index which has not been built is not used
+                self.assertEquals(0, len(dump.index))
+                self.assertFalse(dump.has_index())
+                self.assertFalse(xmlreader.XmlDump(filename).has_index())
+                dump.build_index()
+                self.assertTrue(dump.has_index())
+                self.assertTrue(xmlreader.XmlDump(filename).has_index())
+                self.assertEquals(20, len(dump.index))
+                entry = dump.get(u'Pear 13')
+                self.assertEquals(u'Pear 13', entry.title)
+                self.assertTrue(entry.text.startswith('Pears are [[tree]]s'))
+                self.assertEquals(None, dump.get(u'Apple'))
+                self.assertEquals(u'Pear 4', dump.get(pageid=24282).title)
+                self.assertEquals([u'Pear %d' % i for i in range(7, 20)],
+                                  [r.title for r in dump.seek(u'Pear 7')])
+                self.assertRaises(KeyError, dump.seek, u'Apple')
+                dump = xmlreader.XmlDump(filename, allrevisions=True)
+                self.assertEquals(16, len(list(dump.seek(u'Pear 16'))))
+                # the last revision
+                self.assertEquals(u'PierreAbbat',
+                                  dump.get(u'Pear 5').username)
+            offsets = set([dump.index.find(u'Pear %d' % i)[0]
+                           for i in range(20)])
+            self.assertEquals(set([0]), offsets)
+        finally:
+            for filename in os.listdir(directory):
+                os.remove(os.path.join(directory, filename))
+            os.rmdir(directory)
+
     def test_MediaWikiXmlHandler(self):
         handler = xmlreader.MediaWikiXmlHandler()
         pages = []
@@ -29,6 +29,11 @@ __version__='$Id$'
 import os, sys, time
 import urllib
 import mimetypes
+import shutil
+import socket
+import tempfile
+import httplib
+import StringIO
 import wikipedia as pywikibot
 import config, query
 
@@ -49,11 +54,13 @@ def encode_multipart_formdata(fields, files):
     """
     @param fields: sequence of (name, value) elements for regular form fields.
     @param files: sequence of (name, filename, value) elements for data to be
-        uploaded as files
-    @return: (content_type, body) ready for httplib.HTTP instance
+        uploaded as files; value is a string, an open file or a FileChunk
+    @return: (content_type, body) ready for httplib.HTTP instance, body
+        being a MultipartBody which reads the files while it is sent
 
     """
     boundary = '----------ThIs_Is_tHe_bouNdaRY_$'
+    parts = []
     lines = []
     for (key, value) in fields:
         lines.append('--' + boundary)
@@ -69,12 +76,86 @@ def encode_multipart_formdata(fields, files):
                      % (key, filename))
         lines.append('Content-Type: %s' % get_content_type(filename))
         lines.append('')
-        lines.append(value)
+        parts.append('\r\n'.join(lines) + '\r\n')
+        parts.append(value)
+        lines = ['']
     lines.append('--' + boundary + '--')
     lines.append('')
-    body = '\r\n'.join(lines)
+    parts.append('\r\n'.join(lines))
     content_type = 'multipart/form-data; boundary=%s' % boundary
-    return content_type, body
+    return content_type, MultipartBody(parts)
+
+class FileChunk:
+    """
+    Read length bytes of the open file fileobj, starting at offset, like a
+    file of its own. By default the rest of the file from offset is read.
+
+    """
+    def __init__(self, fileobj, offset=0, length=None):
+        if length is None:
+            fileobj.seek(0, 2)
+            length = fileobj.tell() - offset
+        self.fileobj = fileobj
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    def __len__(self):
+        return self.length
+
+    def seek(self, position):
+        self.position = position
+
+    def read(self, size=-1):
+        if size < 0 or size > self.length - self.position:
+            size = self.length - self.position
+        if size <= 0:
+            return ''
+        # the file may be shared, e.g. by the chunks of an upload
+        self.fileobj.seek(self.offset + self.position)
+        data = self.fileobj.read(size)
+        self.position += len(data)
+        return data
+
+class MultipartBody:
+    """
+    Request body made of strings and files, which is read part by part
+    while it is sent, so that uploaded files need not fit into memory.
+
+    It can be rewound with seek(0) to send the request again.
+
+    """
+    def __init__(self, parts):
+        self.parts = []
+        for part in parts:
+            if isinstance(part, basestring):
+                part = FileChunk(StringIO.StringIO(part), 0, len(part))
+            elif not isinstance(part, FileChunk):
+                part = FileChunk(part)
+            self.parts.append(part)
+        self.seek(0)
+
+    def __len__(self):
+        return sum([len(part) for part in self.parts])
+
+    def seek(self, position):
+        if position != 0:
+            raise ValueError(u'MultipartBody can only be rewound')
+        for part in self.parts:
+            part.seek(0)
+        self.index = 0
+
+    def read(self, size=-1):
+        data = []
+        while self.index < len(self.parts) and size != 0:
+            block = self.parts[self.index].read(size)
+            if not block:
+                self.index += 1
+                continue
+            data.append(block)
+            if size > 0:
+                size -= len(block)
+        return ''.join(data)
 
 def get_content_type(filename):
     return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
@@ -91,6 +172,9 @@ class UploadRobot:
 
         """
         self._retrieved = False
+        # progress of a chunked upload, see upload_chunks()
+        self._offset = 0
+        self._filekey = None
         self.url = url
         self.urlEncoding = urlEncoding
         self.description = description
@@ -113,13 +197,21 @@ class UploadRobot:
         return "://" in self.url or os.path.exists(self.url)
 
     def read_file_content(self):
-        """Return name of temp file in which remote file is saved."""
-        if not self._retrieved or self.uploadByUrl:
+        """
+        Open the file to upload as self._file. A remote file is downloaded
+        into a temporary file, block by block.
+
+        """
+        if hasattr(self, '_contents'):
+            # the contents were given by the caller
+            self._file = StringIO.StringIO(self._contents)
+        elif not self._retrieved or self.uploadByUrl:
             # Get file contents
             pywikibot.output(u'Reading file %s' % self.url)
             if '://' in self.url:
                 resume = False
                 dt = 15
+                self._file = tempfile.TemporaryFile()
 
                 while not self._retrieved:
                     uo = pywikibot.MyURLopener
@@ -141,16 +233,16 @@ class UploadRobot:
                     accept_ranges = file.info().getheader(
                         'Accept-Ranges') == 'bytes'
 
-                    if resume:
-                        self._contents += file.read()
-                    else:
-                        self._contents = file.read()
+                    if not resume:
+                        self._file.seek(0)
+                        self._file.truncate()
+                    shutil.copyfileobj(file, self._file)
 
                     file.close()
                     self._retrieved = True
 
                     if content_len:
-                        rlen = len(self._contents)
+                        rlen = self._file.tell()
                         content_len = int(content_len)
                         if rlen < content_len:
                             self._retrieved = False
@@ -173,9 +265,7 @@ u"No check length to retrieved data is possible.")
                 # Opening local files with MyURLopener would be possible, but we
                 # don't do it because it only accepts ASCII characters in the
                 # filename.
-                file = open(self.url,"rb")
-                self._contents = file.read()
-                file.close()
+                self._file = open(self.url,"rb")
 
     def process_filename(self):
         """Return base filename portion of self.url"""
@@ -255,7 +345,7 @@ u"No check length to retrieved data is possible.")
         if not self.targetSite.has_api() or self.targetSite.versionnumber() < 16:
             return self._uploadImageOld(debug)
 
-        if not hasattr(self,'_contents'):
+        if not hasattr(self, '_file'):
             self.read_file_content()
 
         filename = self.process_filename()
@@ -271,8 +361,16 @@ u"No check length to retrieved data is possible.")
             params['sessionkey'] = sessionKey
         if self.uploadByUrl:
             params['url'] = self.url
-        elif not self.uploadByUrl and not sessionKey:
-            params['file'] = self._contents
+        elif not sessionKey:
+            size = len(FileChunk(self._file))
+            if self._filekey or (config.upload_chunk_size
+                                 and size > config.upload_chunk_size
+                                 and self.targetSite.versionnumber() >= 20):
+                params['filekey'] = self.upload_chunks(filename)
+                if not params['filekey']:
+                    return
+            else:
+                params['file'] = FileChunk(self._file, 0, size)
 
         if self.ignoreWarning:
             params['ignorewarnings'] = 1
@@ -325,8 +423,70 @@ u"No check length to retrieved data is possible.")
                 pywikibot.output(u"Upload successful.")
                 return filename #data['filename']
 
+    def upload_chunks(self, filename):
+        """
+        Upload self._file to the upload stash in pieces of
+        config.upload_chunk_size bytes, with the chunked upload protocol of
+        MediaWiki 1.20. Each piece is sent as it is read from the file.
+
+        The offset confirmed by the server is kept, so when the connection
+        drops the upload resumes there instead of starting again.
+        Return the file key of the stashed file, or None if the upload
+        failed or was aborted.
+
+        """
+        size = len(FileChunk(self._file))
+        while self._offset < size:
+            chunk = FileChunk(self._file, self._offset,
+                              min(config.upload_chunk_size,
+                                  size - self._offset))
+            params = {
+                'action': 'upload',
+                'token': self.targetSite.getToken(),
+                'filename': filename,
+                'filesize': size,
+                'offset': self._offset,
+                'chunk': chunk,
+                'stash': 1,
+            }
+            if self._filekey:
+                params['filekey'] = self._filekey
+            if self.ignoreWarning:
+                params['ignorewarnings'] = 1
+            pywikibot.output(u'Uploading bytes %d-%d of %d to %s...'
+                             % (self._offset, self._offset + len(chunk),
+                                size, self.targetSite))
+            try:
+                data = query.GetData(params, self.targetSite)
+            except (pywikibot.MaxTriesExceededError, pywikibot.ServerError,
+                    IOError, httplib.HTTPException), error:
+                pywikibot.output(u'%s' % error)
+                answer = pywikibot.inputChoice(
+                    u'Upload of %s interrupted at byte %d. Resume?'
+                    % (filename, self._offset), ['Yes', 'No'], ['y', 'N'], 'N')
+                if answer == 'y':
+                    continue
+                return
+            if 'error' in data:
+                pywikibot.output("%s" % data)
+                offset = int(data['error'].get('offset', self._offset))
+                if offset != self._offset:
+                    # the server has got another part of the file than we
+                    # thought, e.g. when only its answer was lost; go on
+                    # from where it is
+                    self._offset = offset
+                    continue
+                return
+            data = data['upload']
+            self._filekey = data['filekey']
+            if data['result'] == u'Continue':
+                self._offset = int(data['offset'])
+            else:
+                self._offset = size
+        return self._filekey
+
     def _uploadImageOld(self, debug=False):
-        if not hasattr(self,'_contents'):
+        if not hasattr(self, '_file'):
             self.read_file_content()
 
         filename = self.process_filename()
@@ -375,7 +535,7 @@ u"No check length to retrieved data is possible.")
                 response, returned_html = post_multipart(
                     self.targetSite, self.targetSite.upload_address(),
                     formdata.items(),
-                    (('wpUploadFile', encodedFilename, self._contents),),
+                    (('wpUploadFile', encodedFilename, self._file),),
                     cookies = self.targetSite.cookies())
             # There are 2 ways MediaWiki can react on success: either it gives
             # a 200 with a success message, or it gives a 302 (redirection).
@@ -7,8 +7,8 @@ max_external_links, which defaults to 50.
 The bot won't change any wiki pages, it will only report dead links such that
 people can fix or remove the links themselves.
 
-The bot will store all links found dead in a .dat file in the deadlinks
-subdirectory. To avoid the removing of links which are only temporarily
+The bot will store all links found dead in a .db file in the deadlinks
+subdirectory; the .dat file of former versions is imported. To avoid the removing of links which are only temporarily
 unavailable, the bot ONLY reports links which were reported dead at least
 two times, with a time lag of at least one week. Such links will be logged to a
 .txt file in the deadlinks subdirectory.
@@ -22,7 +22,7 @@ feature, set report_dead_links_on_talk = True in your user-config.py, or
 specify "-talk" on the command line. Adding "-notalk" switches this off
 irrespective of the configuration variable.
 
-When a link is found alive, it will be removed from the .dat file.
+When a link is found alive, it will be removed from the .db file.
 
 These command line parameters can be used to specify which pages to work on:
 
@@ -62,6 +62,9 @@ max_external_links        - The maximum number of web pages that should be
                             is congested, and will then think that the page
                             is offline.
 
+max_external_links_per_host - The maximum number of web pages of the same
+                            host that should be loaded simultaneously.
+
 report_dead_links_on_talk - If set to true, causes the script to report dead
                             links on the article's talk page if (and ONLY if)
                             the linked page has been unavailable at least two
@@ -94,13 +97,15 @@ Syntax examples:
 #
 __version__='$Id$'
 
-import sys, re
+import os, sys, re
 import codecs, pickle
 import httplib, socket, urlparse, urllib, urllib2
-import threading, time
+import threading, time, traceback
+from collections import deque
 import pywikibot
 from pywikibot import i18n
 import config, pagegenerators
+from pywikibot.comms.connectionpool import ConnectionPool
 
 docuReplacements = {
     '&params;': pagegenerators.parameterHelp
@@ -197,12 +202,17 @@ class LinkChecker(object):
     Warning: Also returns false if your Internet connection isn't working
     correctly! (This will give a Socket Error)
     '''
-    def __init__(self, url, redirectChain = [], serverEncoding=None, HTTPignore=[]):
+    def __init__(self, url, redirectChain = [], serverEncoding=None, HTTPignore=[],
+                 connections=None):
         """
         redirectChain is a list of redirects which were resolved by
         resolveRedirect(). This is needed to detect redirect loops.
+
+        connections is a ConnectionPool to reuse keep-alive connections
+        from; if it is None, a new connection is opened for every request.
         """
         self.url = url
+        self.connections = connections
         self.serverEncoding = serverEncoding
         self.header = {
             # 'User-agent': pywikibot.useragent,
@@ -226,6 +236,48 @@ class LinkChecker(object):
         elif self.scheme == 'https':
             return httplib.HTTPSConnection(self.host)
 
+    def request(self, method):
+        """
+        Send a request for the URL and set self.response. An idle
+        connection to the host is used if there is one; if it turns out to
+        be closed by the server meanwhile, the request is sent again on a new
+        connection.
+        """
+        url = '%s%s' % (self.path, self.query)
+        if self.connections is None:
+            conn = self.getConnection()
+            conn.request(method, url, None, self.header)
+            self.response = conn.getresponse()
+            return
+        conn, self.response = self.connections.request(
+            (self.scheme, self.host), self.getConnection, method, url, None,
+            self.header)
+        self.releaseConnection(conn)
+
+    def releaseConnection(self, conn):
+        """
+        Put conn into the pool if the rest of the response is short enough
+        to be read, so that the connection can be used again; give back its
+        slot without keeping it otherwise.
+        """
+        response = self.response
+        identifier = (self.scheme, self.host)
+        if response.version < 11 \
+                or (response.getheader('Connection') or '').lower() == 'close':
+            self.connections.release(identifier)
+            return
+        length = response.getheader('Content-Length')
+        try:
+            if response._method != 'HEAD' and (
+                    length is None or int(length) > 64 * 1024):
+                self.connections.release(identifier)
+                return
+            response.read()
+        except (ValueError, httplib.HTTPException, socket.error):
+            self.connections.release(identifier)
+            return
+        self.connections.push_connection(identifier, conn)
+
     def getEncodingUsedByServer(self):
         if not self.serverEncoding:
             try:
@@ -285,15 +337,11 @@ class LinkChecker(object):
         If useHEAD is true, uses the HTTP HEAD method, which saves bandwidth
         by not downloading the body. Otherwise, the HTTP GET method is used.
         '''
-        conn = self.getConnection()
         try:
             if useHEAD:
-                conn.request('HEAD', '%s%s' % (self.path, self.query), None,
-                             self.header)
+                self.request('HEAD')
             else:
-                conn.request('GET', '%s%s' % (self.path, self.query), None,
-                             self.header)
-            self.response = conn.getresponse()
+                self.request('GET')
             # read the server's encoding, in case we need it later
             self.readEncodingFromResponse(self.response)
         except httplib.BadStatusLine:
@@ -381,7 +429,8 @@ class LinkChecker(object):
                     # we don't use HEAD, but GET requests.
                     redirChecker = LinkChecker(self.redirectChain[0],
                                                serverEncoding=self.serverEncoding,
-                                               HTTPignore=self.HTTPignore)
+                                               HTTPignore=self.HTTPignore,
+                                               connections=self.connections)
                     return redirChecker.check(useHEAD = False)
                 else:
                     urlList = ['[%s]' % url for url in self.redirectChain + [self.url]]
@@ -394,7 +443,8 @@ class LinkChecker(object):
                     # we don't use HEAD, but GET requests.
                     redirChecker = LinkChecker(self.redirectChain[0],
                                                serverEncoding=self.serverEncoding,
-                                               HTTPignore = self.HTTPignore)
+                                               HTTPignore = self.HTTPignore,
+                                               connections=self.connections)
                     return redirChecker.check(useHEAD = False)
                 else:
                     urlList = ['[%s]' % url for url in self.redirectChain + [self.url]]
@@ -402,24 +452,23 @@ class LinkChecker(object):
             else:
                 redirChecker = LinkChecker(self.url, self.redirectChain,
                                            self.serverEncoding,
-                                           HTTPignore=self.HTTPignore)
+                                           HTTPignore=self.HTTPignore,
+                                           connections=self.connections)
                 return redirChecker.check(useHEAD = useHEAD)
         else:
-            try:
-                conn = self.getConnection()
-            except httplib.error, error:
-                return False, u'HTTP Error: %s' % error.__class__.__name__
-            try:
-                conn.request('GET', '%s%s'
-                             % (self.path, self.query), None, self.header)
-            except socket.error, error:
-                return False, u'Socket Error: %s' % repr(error[1])
-            try:
-                self.response = conn.getresponse()
-            except Exception, error:
-                return False, u'Error: %s' % error
-            # read the server's encoding, in case we need it later
-            self.readEncodingFromResponse(self.response)
+            if useHEAD:
+                # the status of a GET request is wanted
+                try:
+                    self.request('GET')
+                except httplib.error, error:
+                    return False, u'HTTP Error: %s' % error.__class__.__name__
+                except socket.error, error:
+                    return False, u'Socket Error: %s' % repr(error[1])
+                except Exception, error:
+                    return False, u'Error: %s' % error
+                # read the server's encoding, in case we need it later
+                self.readEncodingFromResponse(self.response)
+            # otherwise resolveRedirect() has already got the page
             # site down if the server status is between 400 and 499
             alive = self.response.status not in range(400, 500)
             if self.response.status in self.HTTPignore:
@@ -428,73 +477,291 @@ class LinkChecker(object):
 
 class LinkCheckThread(threading.Thread):
     '''
-    A thread responsible for checking one URL. After checking the page, it
-    will die.
+    A thread of a LinkCheckPool. It checks the URLs given by the pool one
+    after another until the pool is closed.
     '''
-    def __init__(self, page, url, history, HTTPignore):
+    def __init__(self, pool):
         threading.Thread.__init__(self)
-        self.page = page
-        self.url = url
+        self.pool = pool
+        # thread dies when program terminates
+        self.setDaemon(True)
+
+    def run(self):
+        while True:
+            task = self.pool.next()
+            if task is None:
+                return
+            host, page, url = task
+            try:
+                self.pool.check(page, url)
+            except:
+                pywikibot.output('Exception while processing URL %s in page %s'
+                                 % (url, page.title()))
+                traceback.print_exc()
+            self.pool.done(host)
+
+
+class LinkCheckPool:
+    '''
+    Checks URLs with a fixed number of LinkCheckThreads.
+
+    The URLs are queued per host. At most perHost URLs of one host are
+    checked at the same time and the hosts take turns, so a single server
+    is not flooded. The results of the last maxResults URLs are kept; if
+    such a URL is found on other pages, it is not loaded again.
+    '''
+    def __init__(self, history, HTTPignore=[], threads=None, perHost=None,
+                 maxResults=10000):
+        if threads is None:
+            threads = config.max_external_links
+        if perHost is None:
+            perHost = config.max_external_links_per_host
         self.history = history
-        # identification for debugging purposes
-        self.setName((u'%s - %s' % (page.title(), url)).encode('utf-8', 'replace'))
         self.HTTPignore = HTTPignore
+        self.perHost = max(1, perHost)
+        # the producer waits if more URLs are queued
+        self.maxQueued = max(1, threads) * 20
+        self.condition = threading.Condition()
+        # host -> deque of (page, url) waiting to be checked
+        self.queues = {}
+        # hosts which have waiting URLs and less than perHost active ones
+        self.ready = deque()
+        # host -> number of URLs being checked
+        self.active = {}
+        self.queued = 0
+        self.running = 0
+        self.closed = False
+        # url -> (alive, message) of the URLs checked last
+        self.results = {}
+        # the URLs of self.results, oldest first
+        self.resultOrder = deque()
+        self.maxResults = max(1, maxResults)
+        # url -> Event which is set when the URL has been checked
+        self.checking = {}
+        self.connections = ConnectionPool(max_idle=max(1, threads))
+        self.threads = [LinkCheckThread(self) for i in range(max(1, threads))]
+        for thread in self.threads:
+            thread.start()
+
+    def _host(self, url):
+        return urlparse.urlsplit(url)[1].lower()
+
+    def _makeReady(self, host):
+        '''Let host take its turn if it can; the caller holds the lock.'''
+        if self.queues.get(host) and host not in self.ready \
+                and self.active.get(host, 0) < self.perHost:
+            self.ready.append(host)
+            self.condition.notifyAll()
+
+    def add(self, page, url):
+        '''Queue url found on page. Blocks while too many URLs are queued.'''
+        host = self._host(url)
+        self.condition.acquire()
+        try:
+            while self.queued >= self.maxQueued:
+                # wait with a timeout to stay responsive to KeyboardInterrupt
+                self.condition.wait(1)
+            self.queues.setdefault(host, deque()).append((page, url))
+            self.queued += 1
+            self._makeReady(host)
+        finally:
+            self.condition.release()
 
-    def run(self):
-        linkChecker = LinkChecker(self.url, HTTPignore = self.HTTPignore)
+    def next(self):
+        '''Return the next (host, page, url) to check, waiting until there
+        is one. Returns None when the pool is closed and empty.
+
+        '''
+        self.condition.acquire()
+        try:
+            while not self.ready:
+                if self.closed and not self.queued:
+                    return None
+                self.condition.wait()
+            host = self.ready.popleft()
+            page, url = self.queues[host].popleft()
+            if not self.queues[host]:
+                del self.queues[host]
+            self.queued -= 1
+            self.running += 1
+            self.active[host] = self.active.get(host, 0) + 1
+            self._makeReady(host)
+            # there is room for the producer again
+            self.condition.notifyAll()
+            return host, page, url
+        finally:
+            self.condition.release()
+
+    def done(self, host):
+        self.condition.acquire()
         try:
-            ok, message = linkChecker.check()
+            self.running -= 1
+            self.active[host] -= 1
+            if not self.active[host]:
+                del self.active[host]
+            self._makeReady(host)
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def result(self, url):
+        '''Return (alive, message) for url, reusing recent results.'''
+        self.condition.acquire()
+        try:
+            if url in self.results:
+                return self.results[url]
+            event = self.checking.get(url)
+            if event is None:
+                self.checking[url] = threading.Event()
+        finally:
+            self.condition.release()
+        if event is not None:
+            # another thread is checking the same URL
+            event.wait()
+            return event.result
+        try:
+            linkChecker = LinkChecker(url, HTTPignore=self.HTTPignore,
+                                      connections=self.connections)
+            result = linkChecker.check()
         except:
-            pywikibot.output('Exception while processing URL %s in page %s'
-                             % (self.url, self.page.title()))
+            result = False, u'Error: %s' % sys.exc_info()[1]
             raise
+        finally:
+            self.condition.acquire()
+            try:
+                self.results[url] = result
+                self.resultOrder.append(url)
+                if len(self.resultOrder) > self.maxResults:
+                    del self.results[self.resultOrder.popleft()]
+                event = self.checking.pop(url)
+                event.result = result
+                event.set()
+            finally:
+                self.condition.release()
+        return result
+
+    def check(self, page, url):
+        ok, message = self.result(url)
         if ok:
-            if self.history.setLinkAlive(self.url):
+            if self.history.setLinkAlive(url):
                 pywikibot.output('*Link to %s in [[%s]] is back alive.'
-                                 % (self.url, self.page.title()))
+                                 % (url, page.title()))
         else:
             pywikibot.output('*[[%s]] links to %s - %s.'
-                             % (self.page.title(), self.url, message))
-            self.history.setLinkDead(self.url, message, self.page, day)
+                             % (page.title(), url, message))
+            self.history.setLinkDead(url, message, page, day)
 
+    def pending(self):
+        '''Return the number of URLs which are queued or being checked.'''
+        return self.queued + self.running
+
+    def close(self):
+        '''Let the threads end when all queued URLs are checked.'''
+        self.condition.acquire()
+        try:
+            self.closed = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
 
-class History:
-    ''' Stores previously found dead links. The URLs are dictionary keys, and
-    values are lists of tuples where each tuple represents one time the URL was
-    found dead. Tuples have the form (title, date, error) where title is the
-    wiki page where the URL was found, date is an instance of time, and error is
-    a string with error code and message.
 
-    We assume that the first element in the list represents the first time we
-    found this dead link, and the last element represents the last time.
+class History:
+    ''' Stores previously found dead links. For every URL, each time it was
+    found dead is stored as (title, date, error) where title is the wiki page
+    where the URL was found, date is an instance of time, and error is a
+    string with error code and message.
 
-    Example:
+    The first time we found a dead link is the one with the earliest date,
+    the last time the one with the latest date.
 
-    dict = {
-        'http://www.example.org/page': [
-            ('WikiPageTitle', DATE, '404: File not found'),
-            ('WikiPageName2', DATE, '404: File not found'),
-        ]
+    The history is kept in an sqlite database in the deadlinks subdirectory,
+    indexed by URL and by page title, so it is neither loaded at startup nor
+    written as a whole when the bot stops.
 
     '''
 
-    def __init__(self, reportThread):
+    def __init__(self, reportThread, filename=None):
+        import sqlite3
         self.reportThread = reportThread
         site = pywikibot.getSite()
         self.semaphore = threading.Semaphore()
-        self.datfilename = pywikibot.config.datafilepath('deadlinks',
-                               'deadlinks-%s-%s.dat'
-                               % (site.family.name, site.lang))
+        if filename is None:
+            filename = pywikibot.config.datafilepath('deadlinks',
+                           'deadlinks-%s-%s.db'
+                           % (site.family.name, site.lang))
+        self.filename = filename
         # Count the number of logged links, so that we can insert captions
         # from time to time
         self.logCount = 0
+        # the LinkCheckThreads use the connection, serialized by semaphore
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.text_factory = unicode
+        self.db.execute('CREATE TABLE IF NOT EXISTS deadlinks ('
+                        'url TEXT, title TEXT, date REAL, error TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS deadlinks_url '
+                        'ON deadlinks (url, date)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS deadlinks_title '
+                        'ON deadlinks (title)')
+        self.db.commit()
+        datfilename = pywikibot.config.datafilepath('deadlinks',
+                          'deadlinks-%s-%s.dat'
+                          % (site.family.name, site.lang))
+        if os.path.exists(datfilename):
+            self.importDat(datfilename)
+
+    def importDat(self, datfilename):
+        '''
+        Add the history stored by former versions of this script as a
+        pickled dict. The file is renamed to .bak afterwards.
+        '''
+        pywikibot.output(u'Importing dead link history from %s...'
+                         % pywikibot.config.shortpath(datfilename))
+        try:
+            datfile = open(datfilename, 'rb')
+            try:
+                historyDict = pickle.load(datfile)
+            finally:
+                datfile.close()
+        except (IOError, EOFError, pickle.UnpicklingError):
+            # history dump broken
+            historyDict = {}
+        self.semaphore.acquire()
         try:
-            datfile = open(self.datfilename, 'r')
-            self.historyDict = pickle.load(datfile)
-            datfile.close()
-        except (IOError, EOFError):
-            # no saved history exists yet, or history dump broken
-            self.historyDict = {}
+            for url, entries in historyDict.iteritems():
+                self.db.executemany('INSERT INTO deadlinks (url, title, date, '
+                                    'error) VALUES (?, ?, ?, ?)',
+                                    [(url,) + tuple(entry)
+                                     for entry in entries])
+            self.db.commit()
+        finally:
+            self.semaphore.release()
+        os.rename(datfilename, datfilename + '.bak')
+
+    def entries(self, url):
+        '''Return the list of (title, date, error) for url, oldest first.'''
+        self.semaphore.acquire()
+        try:
+            return self.db.execute('SELECT title, date, error FROM deadlinks '
+                                   'WHERE url = ? ORDER BY date',
+                                   (url,)).fetchall()
+        finally:
+            self.semaphore.release()
+
+    def pageTitles(self):
+        '''Yield the titles of all pages with dead links in sorted order.'''
+        title = u''
+        while True:
+            self.semaphore.acquire()
+            try:
+                titles = [row[0] for row in self.db.execute(
+                    'SELECT DISTINCT title FROM deadlinks WHERE title > ? '
+                    'ORDER BY title LIMIT 1000', (title,))]
+            finally:
+                self.semaphore.release()
+            if not titles:
+                return
+            for title in titles:
+                yield title
 
     def log(self, url, error, containingPage, archiveURL):
         """
@@ -505,7 +772,7 @@ class History:
             errorReport = u'* %s ([%s archive])\n' % (url, archiveURL)
         else:
             errorReport = u'* %s\n' % url
-        for (pageTitle, date, error) in self.historyDict[url]:
+        for (pageTitle, date, error) in self.entries(url):
             # ISO 8601 formulation
             isoDate = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(date))
             errorReport += "** In [[%s]] on %s, %s\n" % (pageTitle, isoDate,
@@ -515,13 +782,17 @@ class History:
                                                     'results-%s-%s.txt'
                                                     % (site.family.name,
                                                        site.lang))
-        txtfile = codecs.open(txtfilename, 'a', 'utf-8')
-        self.logCount += 1
-        if self.logCount % 30 == 0:
-            # insert a caption
-            txtfile.write('=== %s ===\n' % containingPage.title()[:3])
-        txtfile.write(errorReport)
-        txtfile.close()
+        self.semaphore.acquire()
+        try:
+            txtfile = codecs.open(txtfilename, 'a', 'utf-8')
+            self.logCount += 1
+            if self.logCount % 30 == 0:
+                # insert a caption
+                txtfile.write('=== %s ===\n' % containingPage.title()[:3])
+            txtfile.write(errorReport)
+            txtfile.close()
+        finally:
+            self.semaphore.release()
 
         if self.reportThread and not containingPage.isTalkPage():
             self.reportThread.report(url, errorReport, containingPage,
@@ -530,53 +801,55 @@ class History:
 
     def setLinkDead(self, url, error, page, day):
         """
-        Adds the fact that the link was found dead to the .dat file.
+        Adds the fact that the link was found dead to the history.
         """
-        self.semaphore.acquire()
         now = time.time()
-        if url in self.historyDict:
-            timeSinceFirstFound = now - self.historyDict[url][0][1]
-            timeSinceLastFound= now - self.historyDict[url][-1][1]
+        self.semaphore.acquire()
+        try:
+            first, last = self.db.execute('SELECT MIN(date), MAX(date) '
+                                          'FROM deadlinks WHERE url = ?',
+                                          (url,)).fetchone()
             # if the last time we found this dead link is less than an hour
             # ago, we won't save it in the history this time.
-            if timeSinceLastFound > 60 * 60:
-                self.historyDict[url].append((page.title(), now, error))
-            # if the first time we found this link longer than x day ago
-            # (default is a week), it should probably be fixed or removed.
-            # We'll list it in a file so that it can be removed manually.
-            if timeSinceFirstFound > 60 * 60 * 24 * day:
-                # search for archived page
-                iac = InternetArchiveConsulter(url)
-                archiveURL = iac.getArchiveURL()
-                self.log(url, error, page, archiveURL)
-        else:
-            self.historyDict[url] = [(page.title(), now, error)]
-        self.semaphore.release()
+            if last is None or now - last > 60 * 60:
+                self.db.execute('INSERT INTO deadlinks (url, title, date, '
+                                'error) VALUES (?, ?, ?, ?)',
+                                (url, page.title(), now, error))
+                self.db.commit()
+        finally:
+            self.semaphore.release()
+        # if the first time we found this link longer than x day ago
+        # (default is a week), it should probably be fixed or removed.
+        # We'll list it in a file so that it can be removed manually.
+        if first is not None and now - first > 60 * 60 * 24 * day:
+            # search for archived page
+            iac = InternetArchiveConsulter(url)
+            archiveURL = iac.getArchiveURL()
+            self.log(url, error, page, archiveURL)
 
     def setLinkAlive(self, url):
         """
-        If the link was previously found dead, removes it from the .dat file
+        If the link was previously found dead, removes it from the history
         and returns True, else returns False.
         """
-        if url in self.historyDict:
-            self.semaphore.acquire()
-            try:
-                del self.historyDict[url]
-            except KeyError:
-                # Not sure why this can happen, but I guess we can ignore this...
-                pass
+        self.semaphore.acquire()
+        try:
+            cursor = self.db.execute('DELETE FROM deadlinks WHERE url = ?',
+                                     (url,))
+            self.db.commit()
+            return cursor.rowcount > 0
+        finally:
             self.semaphore.release()
-            return True
-        else:
-            return False
 
     def save(self):
         """
-        Saves the .dat file to disk.
+        Saves the history to disk.
         """
-        datfile = open(self.datfilename, 'w')
-        pickle.dump(self.historyDict, datfile)
-        datfile.close()
+        self.semaphore.acquire()
+        try:
+            self.db.commit()
+        finally:
+            self.semaphore.release()
 
 class DeadLinkReportThread(threading.Thread):
     '''
@@ -675,8 +948,8 @@ class DeadLinkReportThread(threading.Thread):
 
 class WeblinkCheckerRobot:
     '''
-    Robot which will use several LinkCheckThreads at once to search for dead
-    weblinks on pages provided by the given generator.
+    Robot which will use a LinkCheckPool to search for dead weblinks on pages
+    provided by the given generator.
     '''
     def __init__(self, generator, HTTPignore = []):
         self.generator = generator
@@ -690,6 +963,7 @@ class WeblinkCheckerRobot:
             reportThread = None
         self.history = History(reportThread)
         self.HTTPignore = HTTPignore
+        self.pool = LinkCheckPool(self.history, HTTPignore)
 
     def run(self):
         for page in self.generator:
@@ -707,38 +981,15 @@ class WeblinkCheckerRobot:
                 if ignoreR.match(url):
                     ignoreUrl = True
             if not ignoreUrl:
-                # Limit the number of threads started at the same time. Each
-                # thread will check one page, then die.
-                while threading.activeCount() >= config.max_external_links:
-                    # wait 100 ms
-                    time.sleep(0.1)
-                thread = LinkCheckThread(page, url, self.history,
-                                         self.HTTPignore)
-                # thread dies when program terminates
-                thread.setDaemon(True)
-                thread.start()
+                self.pool.add(page, url)
 
 
 def RepeatPageGenerator():
     history = History(None)
-    pageTitles = set()
-    for (key, value) in history.historyDict.iteritems():
-        for entry in value:
-            pageTitle = entry[0]
-            pageTitles.add(pageTitle)
-    pageTitles = list(pageTitles)
-    pageTitles.sort()
-    for pageTitle in pageTitles:
+    for pageTitle in history.pageTitles():
         page = pywikibot.Page(pywikibot.getSite(), pageTitle)
         yield page
 
-def countLinkCheckThreads():
-    i = 0
-    for thread in threading.enumerate():
-        if isinstance(thread, LinkCheckThread):
-            i += 1
-    return i
-
 def check(url):
     """Peform a check on URL"""
     c = LinkChecker(url)
@@ -796,21 +1047,23 @@ def main():
         try:
             bot.run()
         finally:
+            bot.pool.close()
             waitTime = 0
             # Don't wait longer than 30 seconds for threads to finish.
-            while countLinkCheckThreads() > 0 and waitTime < 30:
+            while bot.pool.pending() > 0 and waitTime < 30:
                 try:
                     pywikibot.output(
-                        u"Waiting for remaining %i threads to finish, please wait..." % countLinkCheckThreads())
+                        u"Waiting for remaining %i links to be checked, please wait..." % bot.pool.pending())
                     # wait 1 second
                     time.sleep(1)
                     waitTime += 1
                 except KeyboardInterrupt:
                     pywikibot.output(u'Interrupted.')
                     break
-            if countLinkCheckThreads() > 0:
-                pywikibot.output(u'Remaining %i threads will be killed.'
-                                 % countLinkCheckThreads())
+            if bot.pool.pending() > 0:
+                pywikibot.output(u'Remaining %i links will not be checked.'
+                                 % bot.pool.pending())
+            bot.pool.connections.close()
                 # Threads will die automatically because they are daemonic.
             if bot.history.reportThread:
                 bot.history.reportThread.shutdown()
@@ -136,6 +136,7 @@ import os, sys
 import httplib, socket, urllib, urllib2, cookielib
 import traceback, pprint
 import time, threading, Queue
+from collections import deque
 import re, codecs, difflib
 try:
     from hashlib import md5
@@ -285,22 +286,83 @@ class Page(object):
           even reload it if it has been loaded before
 
     """
+    # Attributes which most Page objects never change are class attributes,
+    # so that they don't take space in every instance.
+
+    # if _editrestriction is True, it means that the page has been found
+    # to have an edit restriction, but we do not know yet whether the
+    # restriction affects us or not
+    _editrestriction = False
+    editRestriction = None
+    moveRestriction = None
+    _permalink = None
+    _userName = None
+    _comment = None
+    _ipedit = None
+    _editTime = None
+    _startTime = '0'
+    # For the Flagged Revisions MediaWiki extension
+    _revisionId = None
+    _deletedRevs = None
+
+    # The text of the page is kept in the shared content store if
+    # config.page_contents_memory is set, otherwise in the instance.
+    def _getContents(self):
+        try:
+            return self.__dict__['_contents']
+        except KeyError:
+            pass
+        try:
+            key = self.__dict__['_contentsKey']
+        except KeyError:
+            raise AttributeError('_contents')
+        return pageContentStore()[key]
+
+    def _setContents(self, contents):
+        self._delContents()
+        store = pageContentStore()
+        if store is not None and isinstance(contents, basestring):
+            self.__dict__['_contentsKey'] = store.add(self, contents)
+        else:
+            self.__dict__['_contents'] = contents
+
+    def _delContents(self):
+        self.__dict__.pop('_contents', None)
+        key = self.__dict__.pop('_contentsKey', None)
+        if key is not None:
+            pageContentStore().discard(key)
+
+    _contents = property(_getContents, _setContents, _delContents)
+
+    def _hasContents(self):
+        """Return True if the text of the page has been loaded.
+
+        Unlike hasattr(page, '_contents'), this does not get the text from
+        the content store.
+
+        """
+        return '_contents' in self.__dict__ or '_contentsKey' in self.__dict__
+
     def __init__(self, site, title, insite=None, defaultNamespace=0):
         """Instantiate a Page object.
 
         """
         try:
-            # if _editrestriction is True, it means that the page has been found
-            # to have an edit restriction, but we do not know yet whether the
-            # restriction affects us or not
-            self._editrestriction = False
-
             if site is None or isinstance(site, basestring):
                 site = getSite(site)
             self._site = site
 
-            if not insite:
+            if not insite or insite is site:
+                # titles parsed before on this site need no parsing
+                parsed = site._parsedTitles.get(title)
+                if parsed is not None and (parsed[4] is None
+                                           or parsed[4] == defaultNamespace):
+                    self._site, self._namespace, self._title, \
+                                self._section = parsed[:4]
+                    return
                 insite = site
+            else:
+                parsed = False
 
             # Clean up the name, it can come from anywhere.
             # Convert HTML entities to unicode
@@ -339,6 +401,8 @@ class Page(object):
             else:
                 prefix = False
             self._namespace = defaultNamespace
+            # the default namespace the title depends on
+            usedDefault = defaultNamespace
 
             #
             # This code was adapted from Title.php : secureAndSplit()
@@ -351,8 +415,10 @@ class Page(object):
                     if t.startswith(':'):
                         t = t[1:]
                         self._namespace = 0
+                        usedDefault = None
                     elif prefix:
                         self._namespace = 0
+                        usedDefault = None
                     else:
                         self._namespace = defaultNamespace
                     break
@@ -363,9 +429,10 @@ class Page(object):
                 if ns:
                     t = m.group(2)
                     self._namespace = ns
+                    usedDefault = None
                     break
 
-                if lowerNs in self._site.family.langs.keys():
+                if lowerNs in self._site.family.langs:
                     # Interwiki link
                     t = m.group(2)
 
@@ -438,17 +505,9 @@ not supported by PyWikipediaBot!"""
                 t += u'#' + self._section
 
             self._title = t
-            self.editRestriction = None
-            self.moveRestriction = None
-            self._permalink = None
-            self._userName = None
-            self._comment = None
-            self._ipedit = None
-            self._editTime = None
-            self._startTime = '0'
-            # For the Flagged Revisions MediaWiki extension
-            self._revisionId = None
-            self._deletedRevs = None
+            if parsed is not False:
+                site._cacheTitle(title, (self._site, self._namespace, t,
+                                         self._section, usedDefault))
         except NoSuchSite:
             raise
         except:
@@ -460,6 +519,32 @@ not supported by PyWikipediaBot!"""
                 )
             raise
 
+    @classmethod
+    def fromNormalizedTitle(cls, site, title, namespace=None):
+        """Return a page for a title which is known to be normalized.
+
+        Titles from the API or from XML dumps are normalized already, so
+        they don't need to be parsed like other titles.
+
+        @param title: the title with its namespace prefix
+        @param namespace: the number of the namespace of the page, if known
+
+        """
+        if u'#' not in title:
+            if namespace is None:
+                namespace = 0
+                if u':' in title:
+                    namespace = site.getNamespaceIndex(
+                        title.split(u':', 1)[0]) or 0
+            if namespace == 0:
+                # the title would be in the default namespace
+                usedDefault = 0
+            else:
+                usedDefault = None
+            site._cacheTitle(title, (site, namespace, title, None,
+                                     usedDefault))
+        return cls(site, title)
+
     @property
     def site(self):
         """Return the Site object for the wiki on which this Page resides."""
@@ -806,7 +891,7 @@ not supported by PyWikipediaBot!"""
             params[u'rvexpandtemplates'] = u''
 
         if throttle:
-            get_throttle()
+            get_throttle(site=self.site())
         textareaFound = False
         # retrying loop is done by query.GetData
         data = query.GetData(params, self.site(), sysop=sysop)
@@ -897,7 +982,7 @@ not supported by PyWikipediaBot!"""
         # Make sure Brion doesn't get angry by waiting if the last time a page
         # was retrieved was not long enough ago.
         if throttle:
-            get_throttle()
+            get_throttle(site=self.site())
         textareaFound = False
         retry_idle_time = 1
         while not textareaFound:
@@ -1085,7 +1170,7 @@ not supported by PyWikipediaBot!"""
             u'prop'   : u'sections',
         }
 
-        get_throttle()
+        get_throttle(site=self.site())
         output(u"Reading section info from %s via API..." % self.title(asLink=True))
 
         result = query.GetData(params, self.site())
@@ -1102,7 +1187,7 @@ not supported by PyWikipediaBot!"""
             # assign sections with wiki text and section byteoffset
             #pywikibot.output(u"  Reading wiki page text (if not already done).")
 
-            debug_data += str(len(self.__dict__.get('_contents',u''))) + '\n'
+            debug_data += str(len(getattr(self, '_contents', u''))) + '\n'
             self.get()
             debug_data += str(len(self._contents)) + '\n'
             debug_data += self._contents + '\n'
@@ -1195,7 +1280,7 @@ not supported by PyWikipediaBot!"""
                 u'rvsection' : section[u'index'],
             }
 
-            get_throttle()
+            get_throttle(site=self.site())
             output(u"  Reading section %s from %s via API..." % (section[u'index'], self.title(asLink=True)))
 
             result = query.GetData(params, self.site())
@@ -1735,7 +1820,7 @@ not supported by PyWikipediaBot!"""
 
             refPages = set()
             for blp in data:
-                pg = Page(self.site(), blp['title'], defaultNamespace = blp['ns'])
+                pg = Page.fromNormalizedTitle(self.site(), blp['title'], blp['ns'])
                 if pg in refPages:
                     continue
 
@@ -1743,7 +1828,7 @@ not supported by PyWikipediaBot!"""
                 refPages.add(pg)
                 if follow_redirects and 'redirect' in blp and 'redirlinks' in blp:
                     for p in blp['redirlinks']:
-                        plk = Page(self.site(), p['title'], defaultNamespace = p['ns'])
+                        plk = Page.fromNormalizedTitle(self.site(), p['title'], p['ns'])
                         if plk in refPages:
                             continue
 
@@ -1801,7 +1886,7 @@ not supported by PyWikipediaBot!"""
         refPages = set()
         while path:
             output(u'Getting references to %s' % self.title(asLink=True))
-            get_throttle()
+            get_throttle(site=self.site())
             txt = self.site().getUrl(path)
             body = BeautifulSoup(txt,
                                  convertEntities=BeautifulSoup.HTML_ENTITIES,
@@ -1962,7 +2047,8 @@ not supported by PyWikipediaBot!"""
         """Put page on queue to be saved to wiki asynchronously.
 
         Asynchronous version of put (takes the same arguments), which places
-        pages on a queue to be saved by a daemon thread. All arguments  are
+        pages on the queue of their site to be saved by a daemon thread. All
+        arguments are
         the same as for .put(), except --
 
         callback: a callable object that will be called after the page put
@@ -1974,16 +2060,8 @@ not supported by PyWikipediaBot!"""
         of which saves were successful.
 
         """
-        try:
-            page_put_queue.mutex.acquire()
-            try:
-                _putthread.start()
-            except (AssertionError, RuntimeError):
-                pass
-        finally:
-            page_put_queue.mutex.release()
-        page_put_queue.put((self, newtext, comment, watchArticle, minorEdit,
-                            force, callback))
+        _put_queue(self.site()).put((self, newtext, comment, watchArticle,
+                                     minorEdit, force, callback))
 
     def put(self, newtext, comment=None, watchArticle=None, minorEdit=True,
             force=False, sysop=False, botflag=True, maxTries=-1):
@@ -2036,8 +2114,8 @@ not supported by PyWikipediaBot!"""
         # If there is an unchecked edit restriction, we need to load the page
         if self._editrestriction:
             output(
-u'Page %s is semi-protected. Getting edit page to find out if we are allowed to edit.'
-                   % self.title(asLink=True))
+u'Page %s is semi-protected. Getting edit page to find out if we are allowed to edit.',
+                   args=(self.title(asLink=True),))
             oldtime = self.editTime()
             # Note: change_edit_time=True is always True since
             #       self.get() calls self._getEditPage without this parameter
@@ -2063,7 +2141,8 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
             if cc:
                 old = newtext
                 if verbose:
-                    output(u'Cosmetic Changes for %s-%s enabled.' % (self.site().family.name, self.site().lang))
+                    output(u'Cosmetic Changes for %s-%s enabled.',
+                           args=(self.site().family.name, self.site().lang))
                 import cosmetic_changes
                 from pywikibot import i18n
                 ccToolkit = cosmetic_changes.CosmeticChangesToolkit(self.site(), redirect=self.isRedirectPage(), namespace = self.namespace(), pageTitle=self.title())
@@ -2118,7 +2197,6 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
 
         retry_attempt = 0
         retry_delay = 1
-        dblagged = False
         params = {
             'action': 'edit',
             'title': self.title(),
@@ -2167,14 +2245,15 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
             maxTries -= 1
             # Check whether we are not too quickly after the previous
             # putPage, and wait a bit until the interval is acceptable
-            if not dblagged:
-                put_throttle()
+            put_throttle(site=self.site())
             # Which web-site host are we submitting to?
             if newPage:
-                output(u'Creating page %s via API' % self.title(asLink=True))
+                output(u'Creating page %s via API',
+                       args=(self.title(asLink=True),))
                 params['createonly'] = 1
             else:
-                output(u'Updating page %s via API' % self.title(asLink=True))
+                output(u'Updating page %s via API',
+                       args=(self.title(asLink=True),))
                 params['nocreate'] = 1
             # Submit the prepared information
             try:
@@ -2188,28 +2267,28 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
                 retry_attempt += 1
                 if retry_attempt > config.maxretries:
                     raise
-                output(u'Got a server error when putting %s; will retry in %i minute%s.' % (self.title(asLink=True), retry_delay, retry_delay != 1 and "s" or ""))
+                output(u'Got a server error when putting %s; will retry in %i minute%s.',
+                       args=(self.title(asLink=True), retry_delay,
+                             retry_delay != 1 and "s" or ""))
                 time.sleep(60 * retry_delay)
                 retry_delay *= 2
                 if retry_delay > 30:
                     retry_delay = 30
                 continue
             except ValueError: # API result cannot decode
-                output(u"Server error encountered; will retry in %i minute%s."
-                       % (retry_delay, retry_delay != 1 and "s" or ""))
+                output(u"Server error encountered; will retry in %i minute%s.",
+                       args=(retry_delay, retry_delay != 1 and "s" or ""))
                 time.sleep(60 * retry_delay)
                 retry_delay *= 2
                 if retry_delay > 30:
                     retry_delay = 30
                 continue
-            # If it has gotten this far then we should reset dblagged
-            dblagged = False
             # Check blocks
             self.site().checkBlocks(sysop = sysop)
             # A second text area means that an edit conflict has occured.
             if response.code == 500:
-                output(u"Server error encountered; will retry in %i minute%s."
-                       % (retry_delay, retry_delay != 1 and "s" or ""))
+                output(u"Server error encountered; will retry in %i minute%s.",
+                       args=(retry_delay, retry_delay != 1 and "s" or ""))
                 time.sleep(60 * retry_delay)
                 retry_delay *= 2
                 if retry_delay > 30:
@@ -2242,15 +2321,11 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
                 #------------------------
                 errorCode = data['error']['code']
                 #cannot handle longpageerror and PageNoSave yet
-                if errorCode == 'maxlag' or response.code == 503:
-                    # server lag; wait for the lag time and retry
-                    lagpattern = re.compile(r"Waiting for [\d.]+: (?P<lag>\d+) seconds? lagged")
-                    lag = lagpattern.search(data['error']['info'])
-                    timelag = int(lag.group("lag"))
-                    output(u"Pausing %d seconds due to database server lag." % min(timelag,300))
-                    dblagged = True
-                    time.sleep(min(timelag,300))
-                    continue
+                if errorCode == 'maxlag':
+                    # query.GetData() has already waited for the lagged
+                    # database servers as often as it may
+                    raise ServerError(u'Database server lag: %s'
+                                      % data['error']['info'])
                 elif errorCode == 'editconflict':
                     # 'editconflict':"Edit conflict detected",
                     raise EditConflict(u'An edit conflict has occured.')
@@ -2401,7 +2476,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
             # Check whether we are not too quickly after the previous
             # putPage, and wait a bit until the interval is acceptable
             if not dblagged:
-                put_throttle()
+                put_throttle(site=self.site())
             # Which web-site host are we submitting to?
             if newPage:
                 output(u'Creating page %s' % self.title(asLink=True))
@@ -2418,7 +2493,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
                             output(data, newline=False)
                         output(u"Pausing %d seconds due to database server lag." % wait)
                         dblagged = True
-                        time.sleep(wait)
+                        put_throttle.pause(wait, site=self.site())
                         wait = min(wait*2, 300)
                         continue
                     # Squid error 503
@@ -3128,7 +3203,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
                 'action': 'submit',
                 'pages': self.title()
             }
-            get_throttle(requestsize = 10)
+            get_throttle(requestsize = 10, site=self.site())
             now = time.time()
             response, data = self.site().postForm(address, predata)
             data = data.encode(self.site().encoding())
@@ -3251,7 +3326,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
         self.site().checkBlocks(sysop = sysop)
 
         if throttle:
-            put_throttle()
+            put_throttle(site=self.site())
         if reason is None:
             pywikibot.output(u'Moving %s to [[%s]].'
                              % (self.title(asLink=True), newtitle))
@@ -3299,7 +3374,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
             else:
                 output(u'Page %s moved to %s' % (self.title(), newtitle))
 
-            if hasattr(self, '_contents'):
+            if self._hasContents():
                 #self.__init__(self.site(), newtitle, defaultNamespace = self._namespace)
                 try:
                     self.get(force=True, get_redirect=True, throttle=False)
@@ -3324,7 +3399,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
         self.site().checkBlocks(sysop = sysop)
 
         if throttle:
-            put_throttle()
+            put_throttle(site=self.site())
         if reason is None:
             reason = input(u'Please enter a reason for the move:')
         if self.isTalkPage():
@@ -3375,7 +3450,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
             else:
                 output(u'Page %s moved to %s' % (self.title(), newtitle))
 
-            if hasattr(self, '_contents'):
+            if self._hasContents():
                 #self.__init__(self.site(), newtitle, defaultNamespace = self._namespace)
                 try:
                     self.get(force=True, get_redirect=True, throttle=False)
@@ -3446,7 +3521,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
         self.site().checkBlocks(sysop = True)
 
         if throttle:
-            put_throttle()
+            put_throttle(site=self.site())
         if reason is None:
             output(u'Deleting %s.' % (self.title(asLink=True)))
             reason = input(u'Please enter a reason for the deletion:')
@@ -3665,7 +3740,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
             comment = input(u'Please enter a reason for the undeletion:')
 
         if throttle:
-            put_throttle()
+            put_throttle(site=self.site())
 
         if self.site().has_api() and self.site().versionnumber() >= 12:
             params = {
@@ -3741,7 +3816,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
         else:
             editcreate, move = editcreate.lower(), move.lower()
         if throttle:
-            put_throttle()
+            put_throttle(site=self.site())
         if reason is None:
             reason = input(
               u'Please enter a reason for the change of the protection level:')
@@ -4002,7 +4077,7 @@ u'Page %s is semi-protected. Getting edit page to find out if we are allowed to
             u'titles'    : self.title(),
         }
 
-        pywikibot.get_throttle()
+        pywikibot.get_throttle(site=self.site())
         pywikibot.output(u"Purging page cache for %s." % self.title(asLink=True))
 
         result = query.GetData(params, self.site())
@@ -4124,7 +4199,7 @@ class DataPage(Page):
             # Check whether we are not too quickly after the previous
             # putPage, and wait a bit until the interval is acceptable
             if not dblagged:
-                put_throttle()
+                put_throttle(site=self.site())
             # Which web-site host are we submitting to?
             if newPage:
                 output(u'Creating page %s via API' % self)
@@ -4229,7 +4304,7 @@ class DataPage(Page):
             # Check whether we are not too quickly after the previous
             # putPage, and wait a bit until the interval is acceptable
             if not dblagged:
-                put_throttle()
+                put_throttle(site=self.site())
             output(u'Creating page %s via API' % self._originTitle)
             params['createonly'] = 1
             try:
@@ -4688,7 +4763,7 @@ class DataPage(Page):
         return search
 
     def get(self, *args, **kwargs):
-        if not hasattr(self, '_contents'):
+        if not self._hasContents():
             if self._title is None:
                 self._getentity(*args, **kwargs)
             else:
@@ -4970,7 +5045,7 @@ class ImagePage(Page):
                 raise RuntimeError("%s" % data['error'])
 
             for iu in data['query']["imageusage"]:
-                yield Page(self.site(), iu['title'], defaultNamespace=iu['ns'])
+                yield Page.fromNormalizedTitle(self.site(), iu['title'], iu['ns'])
 
             if 'query-continue' in data:
                 params.update(data['query-continue']['imageusage'])
@@ -5010,37 +5085,27 @@ class ImagePage(Page):
             #'': '',
         }
 
-        while True:
-            data = query.GetData(params, self.site())
-            if 'error' in data:
-                raise RuntimeError("%s" % data['error'])
-
-            for (page, globalusage) in data['query']['pages'].items():
-                for gu in globalusage['globalusage']:
-                    #FIXME : Should have a cleaner way to get the wiki where the image is used
-                    siteparts = gu['wiki'].split('.')
-                    if len(siteparts)==3:
-                        if siteparts[0] in self.site().fam().alphabetic and \
-                           siteparts[1] in ['wikipedia', 'wiktionary',
-                                            'wikibooks', 'wikiquote',
-                                            'wikisource']:
-                            code = siteparts[0]
-                            fam = siteparts[1]
-                        elif siteparts[0] in ['meta', 'incubator'] and \
-                             siteparts[1] == u'wikimedia':
-                            code = code = siteparts[0]
-                            fam = code = siteparts[0]
-                        else:
-                            code = None
-                            fam = None
-                        if code and fam:
-                            site = getSite(code=code, fam=fam)
-                            yield Page(site, gu['title'])
-
-            if 'query-continue' in data:
-                params.update(data['query-continue']['globalusage'])
-            else:
-                break
+        for globalusage in query.iterate(params, self.site()):
+            for gu in globalusage.get('globalusage', []):
+                #FIXME : Should have a cleaner way to get the wiki where the image is used
+                siteparts = gu['wiki'].split('.')
+                if len(siteparts)==3:
+                    if siteparts[0] in self.site().fam().alphabetic and \
+                       siteparts[1] in ['wikipedia', 'wiktionary',
+                                        'wikibooks', 'wikiquote',
+                                        'wikisource']:
+                        code = siteparts[0]
+                        fam = siteparts[1]
+                    elif siteparts[0] in ['meta', 'incubator'] and \
+                         siteparts[1] == u'wikimedia':
+                        code = code = siteparts[0]
+                        fam = code = siteparts[0]
+                    else:
+                        code = None
+                        fam = None
+                    if code and fam:
+                        site = getSite(code=code, fam=fam)
+                        yield Page(site, gu['title'])
 
 
 class _GetAll(object):
@@ -5053,10 +5118,11 @@ class _GetAll(object):
         self.sleeptime = 15
 
         for page in pages:
-            if (not hasattr(page, '_contents') and not hasattr(page, '_getexception')) or force:
+            if (not page._hasContents() and not hasattr(page, '_getexception')) or force:
                 self.pages.append(page)
             elif verbose:
-                output(u"BUGWARNING: %s already done!" % page.title(asLink=True))
+                output(u"BUGWARNING: %s already done!",
+                       args=(page.title(asLink=True),))
 
     def sleep(self):
         time.sleep(self.sleeptime)
@@ -5078,7 +5144,8 @@ class _GetAll(object):
                         # Print the traceback of the caught exception
                         exception(tb=True)
                         debug(u'got network error in _GetAll.run. ' \
-                               'Sleeping for %d seconds...' % self.sleeptime)
+                               'Sleeping for %d seconds...',
+                              args=(self.sleeptime,))
                         self.sleep()
                     else:
                         if 'error' in data:
@@ -5089,6 +5156,7 @@ class _GetAll(object):
                 self.headerDoneApi(data['query'])
                 if 'normalized' in data['query']:
                     self._norm = dict([(x['from'],x['to']) for x in data['query']['normalized']])
+                self.buildIndex()
                 for vals in data['query']['pages'].values():
                     self.oneDoneApi(vals)
             else:  # read pages via Special:Export
@@ -5099,7 +5167,8 @@ class _GetAll(object):
                         # Print the traceback of the caught exception
                         exception(tb=True)
                         debug(u'got network error in _GetAll.run. ' \
-                               'Sleeping for %d seconds...' % self.sleeptime)
+                               'Sleeping for %d seconds...',
+                              args=(self.sleeptime,))
                         self.sleep()
                     else:
                         if "<title>Wiki does not exist</title>" in data:
@@ -5108,11 +5177,13 @@ class _GetAll(object):
                             # HTML error Page got thrown because of an internal
                             # error when fetching a revision.
                             output(u'Received incomplete XML data. ' \
-                                'Sleeping for %d seconds...' % self.sleeptime)
+                                'Sleeping for %d seconds...',
+                                   args=(self.sleeptime,))
                             self.sleep()
                         elif "<siteinfo>" not in data: # This probably means we got a 'temporary unaivalable'
                             output(u'Got incorrect export page. ' \
-                                'Sleeping for %d seconds...' % self.sleeptime)
+                                'Sleeping for %d seconds...',
+                                   args=(self.sleeptime,))
                             self.sleep()
                         else:
                             break
@@ -5120,6 +5191,7 @@ class _GetAll(object):
                 m = R.match(data)
                 if m:
                     data = m.group(2)
+                self.buildIndex()
                 handler = xmlreader.MediaWikiXmlHandler()
                 handler.setCallback(self.oneDone)
                 handler.setHeaderCallback(self.headerDone)
@@ -5136,9 +5208,29 @@ class _GetAll(object):
                 # All of the ones that have not been found apparently do not exist
 
             for pl in self.pages:
-                if not hasattr(pl,'_contents') and not hasattr(pl,'_getexception'):
+                if not pl._hasContents() and not hasattr(pl,'_getexception'):
                     pl._getexception = NoPage
 
+    def buildIndex(self):
+        """Map section free titles to the requested pages.
+
+        Applies the title normalization reported by the API first. Every
+        title is mapped to a list of pages because there might be duplicates
+        in the pages list, e.g. links to different sections of one page.
+
+        """
+        self._index = {}
+        for page in self.pages:
+            title = page.sectionFreeTitle()
+            if hasattr(self, '_norm') and title in self._norm:
+                title = self._norm[title]
+                # keep the section, the API normalizes titles without it
+                if page.section():
+                    page._title = u'%s#%s' % (title, page.section())
+                else:
+                    page._title = title
+            self._index.setdefault(title, []).append(page)
+
     def oneDone(self, entry):
         title = entry.title
         username = entry.username
@@ -5151,55 +5243,55 @@ class _GetAll(object):
 
         page = Page(self.site, title)
         successful = False
-        for page2 in self.pages:
-            if page2.sectionFreeTitle() == page.sectionFreeTitle():
-                if not (hasattr(page2,'_contents') or \
-                        hasattr(page2, '_getexception')) or self.force:
-                    page2.editRestriction = entry.editRestriction
-                    page2.moveRestriction = entry.moveRestriction
-                    if editRestriction == 'autoconfirmed':
-                        page2._editrestriction = True
-                    page2._permalink = entry.revisionid
-                    page2._userName = username
-                    page2._ipedit = ipedit
-                    page2._revisionId = revisionId
-                    page2._editTime = timestamp
-                    page2._versionhistory = [
-                        (revisionId,
-                         time.strftime("%Y-%m-%dT%H:%M:%SZ",
-                                       time.strptime(str(timestamp),
-                                                     "%Y%m%d%H%M%S")),
-                         username, entry.comment)]
-                    section = page2.section()
-                    # Store the content
-                    page2._contents = text
-                    m = self.site.redirectRegex().match(text)
-                    if m:
-                        ## output(u"%s is a redirect" % page2.title(asLink=True))
-                        redirectto = m.group(1)
-                        if section and not "#" in redirectto:
-                            redirectto += "#" + section
-                        page2._getexception = IsRedirectPage
-                        page2._redirarg = redirectto
-
-                    # This is used for checking deletion conflict.
-                    # Use the data loading time.
-                    page2._startTime = time.strftime('%Y%m%d%H%M%S',
-                                                     time.gmtime())
-                    if section:
-                        m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section), text)
-                        if not m:
-                            try:
-                                page2._getexception
-                                warning(u"Section not found: %s" % page2)
-                            except AttributeError:
-                                # There is no exception yet
-                                page2._getexception = SectionError
-                successful = True
-                # Note that there is no break here. The reason is that there
-                # might be duplicates in the pages list.
+        for page2 in self._index.get(page.sectionFreeTitle(), []):
+            if not (page2._hasContents() or \
+                    hasattr(page2, '_getexception')) or self.force:
+                page2.editRestriction = entry.editRestriction
+                page2.moveRestriction = entry.moveRestriction
+                if editRestriction == 'autoconfirmed':
+                    page2._editrestriction = True
+                page2._permalink = entry.revisionid
+                page2._userName = username
+                page2._ipedit = ipedit
+                page2._revisionId = revisionId
+                page2._editTime = timestamp
+                page2._versionhistory = [
+                    (revisionId,
+                     time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                   time.strptime(str(timestamp),
+                                                 "%Y%m%d%H%M%S")),
+                     username, entry.comment)]
+                section = page2.section()
+                # Store the content
+                page2._contents = text
+                m = self.site.redirectRegex().match(text)
+                if m:
+                    ## output(u"%s is a redirect" % page2.title(asLink=True))
+                    redirectto = m.group(1)
+                    if section and not "#" in redirectto:
+                        redirectto += "#" + section
+                    page2._getexception = IsRedirectPage
+                    page2._redirarg = redirectto
+
+                # This is used for checking deletion conflict.
+                # Use the data loading time.
+                page2._startTime = time.strftime('%Y%m%d%H%M%S',
+                                                 time.gmtime())
+                if section:
+                    m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section), text)
+                    if not m:
+                        try:
+                            page2._getexception
+                            warning(u"Section not found: %s", args=(page2,))
+                        except AttributeError:
+                            # There is no exception yet
+                            page2._getexception = SectionError
+            successful = True
+            # Note that there is no break here. The reason is that there
+            # might be duplicates in the pages list.
         if not successful:
-            output(u"BUG>> title %s (%s) not found in list" % (title, page))
+            output(u"BUG>> title %s (%s) not found in list",
+                   args=(title, page))
             output(u'Expected one of: %s'
                    % u', '.join([unicode(page2) for page2 in self.pages]))
             raise PageNotFound
@@ -5275,7 +5367,7 @@ class _GetAll(object):
         if curonly:
             predata['curonly'] = 'True'
         # Slow ourselves down
-        get_throttle(requestsize = len(self.pages))
+        get_throttle(requestsize = len(self.pages), site=self.site)
         # Now make the actual request to the server
         now = time.time()
         response, data = self.site.postForm(address, predata)
@@ -5310,65 +5402,62 @@ class _GetAll(object):
 
         page = Page(self.site, title)
         successful = False
-        for page2 in self.pages:
-            if hasattr(self, '_norm') and page2.sectionFreeTitle() in self._norm:
-                page2._title = self._norm[page2.sectionFreeTitle()]
-
-            if page2.sectionFreeTitle() == page.sectionFreeTitle():
-                if 'missing' in data:
-                    page2._getexception = NoPage
-                    successful = True
-                    break
-
-                if 'invalid' in data:
-                    page2._getexception = BadTitle
-                    successful = True
-                    break
+        for page2 in self._index.get(page.sectionFreeTitle(), []):
+            if 'missing' in data:
+                page2._getexception = NoPage
+                successful = True
+                break
 
-                if not (hasattr(page2,'_contents') or hasattr(page2,'_getexception')) or self.force:
-                    page2.editRestriction = editRestriction
-                    page2.moveRestriction = moveRestriction
-                    if editRestriction == 'autoconfirmed':
-                        page2._editrestriction = True
-                    page2._permalink = revisionId
-                    if rev:
-                        page2._userName = username
-                        page2._ipedit = ipedit
-                        page2._editTime = timestamp
-                        page2._contents = text
-                    else:
-                        raise KeyError(
-                            u'BUG?>>: Last revision of [[%s]] not found'
-                            % title)
-                    page2._revisionId = revisionId
-                    section = page2.section()
-                    if 'redirect' in data:
-                        ## output(u"%s is a redirect" % page2.title(asLink=True))
-                        m = self.site.redirectRegex().match(text)
-                        redirectto = m.group(1)
-                        if section and not "#" in redirectto:
-                            redirectto += "#" + section
-                        page2._getexception = IsRedirectPage
-                        page2._redirarg = redirectto
-
-                    # This is used for checking deletion conflict.
-                    # Use the data loading time.
-                    page2._startTime = time.strftime('%Y%m%d%H%M%S', time.gmtime())
-                    if section:
-                        m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section), text)
-                        if not m:
-                            try:
-                                page2._getexception
-                                warning(u"Section not found: %s"
-                                        % page2)
-                            except AttributeError:
-                                # There is no exception yet
-                                page2._getexception = SectionError
+            if 'invalid' in data:
+                page2._getexception = BadTitle
                 successful = True
-                # Note that there is no break here. The reason is that there
-                # might be duplicates in the pages list.
+                break
+
+            if not (page2._hasContents() or hasattr(page2,'_getexception')) or self.force:
+                page2.editRestriction = editRestriction
+                page2.moveRestriction = moveRestriction
+                if editRestriction == 'autoconfirmed':
+                    page2._editrestriction = True
+                page2._permalink = revisionId
+                if rev:
+                    page2._userName = username
+                    page2._ipedit = ipedit
+                    page2._editTime = timestamp
+                    page2._contents = text
+                else:
+                    raise KeyError(
+                        u'BUG?>>: Last revision of [[%s]] not found'
+                        % title)
+                page2._revisionId = revisionId
+                section = page2.section()
+                if 'redirect' in data:
+                    ## output(u"%s is a redirect" % page2.title(asLink=True))
+                    m = self.site.redirectRegex().match(text)
+                    redirectto = m.group(1)
+                    if section and not "#" in redirectto:
+                        redirectto += "#" + section
+                    page2._getexception = IsRedirectPage
+                    page2._redirarg = redirectto
+
+                # This is used for checking deletion conflict.
+                # Use the data loading time.
+                page2._startTime = time.strftime('%Y%m%d%H%M%S', time.gmtime())
+                if section:
+                    m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section), text)
+                    if not m:
+                        try:
+                            page2._getexception
+                            warning(u"Section not found: %s",
+                                    args=(page2,))
+                        except AttributeError:
+                            # There is no exception yet
+                            page2._getexception = SectionError
+            successful = True
+            # Note that there is no break here. The reason is that there
+            # might be duplicates in the pages list.
         if not successful:
-            output(u"BUG>> title %s (%s) not found in list" % (title, page))
+            output(u"BUG>> title %s (%s) not found in list",
+                   args=(title, page))
             output(u'Expected one of: %s'
                    % u', '.join([unicode(page2) for page2 in self.pages]))
             raise PageNotFound
@@ -5437,7 +5526,7 @@ class _GetAll(object):
         }
 
         # Slow ourselves down
-        get_throttle(requestsize = len(self.pages))
+        get_throttle(requestsize = len(self.pages), site=self.site)
         # Now make the actual request to the server
         now = time.time()
 
@@ -5467,15 +5556,17 @@ def getall(site, pages, throttle=True, force=False):
         for pagg in range(0, len(pages), limit):
             if pagg == range(0, len(pages), limit)[-1]: #latest retrieve
                 k = pages[pagg:]
-                output(u'Getting pages %d - %d of %d...' % (pagg + 1, len(pages), len(pages)))
+                output(u'Getting pages %d - %d of %d...',
+                       args=(pagg + 1, len(pages), len(pages)))
                 _GetAll(site, k, throttle, force).run()
                 pages[pagg:] = k
             else:
                 k = pages[pagg:pagg + limit]
-                output(u'Getting pages %d - %d of %d...' % (pagg + 1, pagg + limit, len(pages)))
+                output(u'Getting pages %d - %d of %d...',
+                       args=(pagg + 1, pagg + limit, len(pages)))
                 _GetAll(site, k, throttle, force).run()
                 pages[pagg:pagg + limit] = k
-            get_throttle(requestsize = len(pages) / 10) # one time to retrieve is 7.7 sec.
+            get_throttle(requestsize = len(pages) / 10, site=site) # one time to retrieve is 7.7 sec.
     else:
         _GetAll(site, pages, throttle, force).run()
 
@@ -5983,6 +6074,9 @@ class Site(object):
                                  % (self.__code, self.__family.name))
 
         self.nocapitalize = self.code in self.family.nocapitalize
+        # raw title -> site, namespace, title, section and the default
+        # namespace it depends on (or None) of a Page
+        self._parsedTitles = {}
         self._mediawiki_messages = {}
         self._info = {}
         self._userName = [None, None]
@@ -6470,7 +6564,9 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         """Post encoded data to the given http address at this site.
 
         address is the absolute path without hostname.
-        data is an ASCII string that has been URL-encoded.
+        data is an ASCII string that has been URL-encoded, or a file-like
+        object with a length, like upload.MultipartBody, which is sent as
+        it is read.
 
         Returns a (response, data) tuple where response is the HTTP
         response object and data is a Unicode string containing the
@@ -6492,6 +6588,8 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             headers['Accept-encoding'] = 'gzip'
         #print '%s' % headers
 
+        from pywikibot.comms import http
+
         url = '%s://%s%s' % (self.protocol(), self.hostname(), address)
         # Try to retrieve the page until it was successfully loaded (just in
         # case the server is down or overloaded).
@@ -6499,9 +6597,12 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         retry_idle_time = 1
         retry_attempt = 0
         while True:
+            if hasattr(data, 'seek'):
+                # send the body from its start again
+                data.seek(0)
             try:
                 request = urllib2.Request(url, data, headers)
-                f = MyURLopener.open(request)
+                f = http.opener.open(request)
 
                 # read & info can raise socket.error
                 text = f.read()
@@ -6939,8 +7040,21 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             return self._info.get(key)
 
     def mediawiki_message(self, key, forceReload = False):
-        """Return the MediaWiki message text for key "key" """
+        """Return the MediaWiki message text for key "key"
+
+        With config.use_diskcache, the messages of wikis without the API are
+        kept on disk and retrieved again only after a MediaWiki upgrade. Wikis
+        with the API are asked for each message separately, which is cached
+        in memory for the Site object only.
+
+        """
         # Allmessages is retrieved once for all per created Site object
+        # and, with the disk cache, once per MediaWiki version
+        if not self._mediawiki_messages and not forceReload and \
+           config.use_diskcache and not self.has_api():
+            import diskcache
+            self._mediawiki_messages = diskcache.CachedReadOnlyDictI.load(
+                self._mediawiki_messages_cachename()) or {}
         if (not self._mediawiki_messages) or forceReload:
             api = self.has_api()
             if verbose:
@@ -6966,7 +7080,10 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
 
             if config.use_diskcache and not api:
                 import diskcache
-                _dict = lambda x : diskcache.CachedReadOnlyDictI(x, prefix = "msg-%s-%s-" % (self.family.name, self.lang))
+                if self._mediawiki_messages:
+                    self._mediawiki_messages.delete()
+                _dict = lambda x : diskcache.CachedReadOnlyDictI(x,
+                    name = self._mediawiki_messages_cachename())
             else:
                 _dict = dict
 
@@ -7046,6 +7163,11 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             else:
                 raise KeyError("MediaWiki key '%s' does not exist on %s" % (key, self))
 
+    def _mediawiki_messages_cachename(self):
+        """Return the name of the disk cache file of the MediaWiki messages"""
+        return 'msg-%s-%s-%s' % (self.family.name, self.lang,
+                                 re.sub('[^\w.-]', '_', self.version()))
+
     def has_mediawiki_message(self, key):
         """Return True if this site defines a MediaWiki message for 'key'."""
         #return key in self._mediawiki_messages
@@ -7157,7 +7279,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             throttle = True
             path = self.search_address(urllib.quote_plus(key.encode('utf-8')),
                                        n=number, ns=namespaces)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(ur'<li><a href=".+?" title="(?P<title>.+?)">.+?</a>',
                                 re.DOTALL)
@@ -7233,7 +7355,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                         if c['ns'] == 6:
                             p_ret = ImagePage(self, c['title'])
                         else:
-                            p_ret = Page(self, c['title'], defaultNamespace=c['ns'])
+                            p_ret = Page.fromNormalizedTitle(self, c['title'], c['ns'])
 
                         yield (p_ret, c['user'],
                           parsetime2stamp(c['timestamp']),
@@ -7297,7 +7419,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             while True:
                 path = self.newpages_address(n=number, namespace=namespace)
                 # The throttling is important here, so always enabled.
-                get_throttle()
+                get_throttle(site=self)
                 html = self.getUrl(path)
 
                 entryR = re.compile('<li[^>]*>(?P<date>.+?) \S*?<a href=".+?"'
@@ -7333,7 +7455,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         entryR = re.compile(ur'<li>\(<a href=".+?" title=".+?">.+?</a>\) .<a href=".+?" title="(?P<title>.+?)">.+?</a> .\[(?P<length>[\d.,]+).*?\]</li>', re.UNICODE)
 
         while True:
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             for m in entryR.finditer(html):
                 title = m.group('title')
@@ -7353,7 +7475,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         entryR = re.compile(ur'<li>\(<a href=".+?" title=".+?">.+?</a>\) .<a href=".+?" title="(?P<title>.+?)">.+?</a> .\[(?P<length>[\d.,]+).*?\]</li>', re.UNICODE)
 
         while True:
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
 
             for m in entryR.finditer(html):
@@ -7373,7 +7495,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.categories_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(
                 '<li><a href=".+?" title="(?P<title>.+?)">.+?</a>.*?</li>')
@@ -7391,7 +7513,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.deadendpages_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(
                 '<li><a href=".+?" title="(?P<title>.+?)">.+?</a></li>')
@@ -7410,7 +7532,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.ancientpages_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile('<li><a href=".+?" title="(?P<title>.+?)">.+?</a> (?P<date>.+?)</li>')
             for m in entryR.finditer(html):
@@ -7429,7 +7551,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.lonelypages_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(
                 '<li><a href=".+?" title="(?P<title>.+?)">.+?</a></li>')
@@ -7448,7 +7570,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.unwatchedpages_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path, sysop = True)
             entryR = re.compile(
                 '<li><a href=".+?" title="(?P<title>.+?)">.+?</a>.+?</li>')
@@ -7467,7 +7589,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.uncategorizedcategories_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(
                 '<li><a href=".+?" title="(?P<title>.+?)">.+?</a></li>')
@@ -7584,7 +7706,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             for i in rcData:
                 if i['pageid'] not in seen:
                     seen.add(i['pageid'])
-                    page = Page(self, i['title'], defaultNamespace=i['ns'])
+                    page = Page.fromNormalizedTitle(self, i['title'], i['ns'])
                     if 'comment' in i:
                         page._comment = i['comment']
                     if returndict:
@@ -7624,7 +7746,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             '<a href=".+?" title="(?P<title>%s:.+?)">.+?</a>' % ns)
         while True:
             path = self.uncategorizedimages_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             for m in entryR.finditer(html):
                 title = m.group('title')
@@ -7640,7 +7762,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.uncategorizedpages_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(
                 '<li><a href=".+?" title="(?P<title>.+?)">.+?</a></li>')
@@ -7659,7 +7781,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.uncategorizedtemplates_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(
                 '<li><a href=".+?" title="(?P<title>.+?)">.+?</a></li>')
@@ -7679,7 +7801,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.unusedcategories_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile('<li><a href=".+?" title="(?P<title>.+?)">.+?</a></li>')
             for m in entryR.finditer(html):
@@ -7698,7 +7820,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.wantedcategories_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile(
                 '<li><a href=".+?" class="new" title="(?P<title>.+?) \(page does not exist\)">.+?</a> .+?\)</li>')
@@ -7720,7 +7842,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             '<a href=".+?" title="(?P<title>%s:.+?)">.+?</a>' % ns)
         while True:
             path = self.unusedfiles_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             for m in entryR.finditer(html):
                 fileext = None
@@ -7746,7 +7868,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         seen = set()
         while True:
             path = self.withoutinterwiki_address(n=number)
-            get_throttle()
+            get_throttle(site=self)
             html = self.getUrl(path)
             entryR = re.compile('<li><a href=".+?" title="(?P<title>.+?)">.+?</a></li>')
             for m in entryR.finditer(html):
@@ -7827,29 +7949,8 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         elif includeredirects == 'only':
             params['apfilterredir'] = 'redirects'
 
-        while True:
-            if throttle:
-                get_throttle()
-            data = query.GetData(params, self)
-            if verbose:
-                debug(u'allpages>>> data.keys() %s' % data.keys())
-            if 'warnings' in data:
-                warning = data['warnings']['allpages']['*']
-                raise RuntimeError("API query warning: %s" % warning)
-            if 'error' in data:
-                raise RuntimeError("API query error: %s" % data)
-            if not 'allpages' in data['query']:
-                raise RuntimeError("API query error, no pages found: %s" % data)
-            count = 0
-            for p in data['query']['allpages']:
-                count += 1
-                yield Page(self, p['title'])
-                if count >= config.special_page_limit:
-                    break
-            if 'query-continue' in data and count < params['aplimit']:
-                params.update(data['query-continue']['allpages'])
-            else:
-                break
+        for p in query.iterate(params, self, throttle=throttle):
+            yield Page.fromNormalizedTitle(self, p['title'], p['ns'])
 
     def _allpagesOld(self, start='!', namespace=0, includeredirects=True,
                  throttle=True):
@@ -8038,7 +8139,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                             # the links themselves have similar form
                             if pages['pageid'] not in cache:
                                 cache.append(pages['pageid'])
-                                yield Page(self, pages['title'], defaultNamespace=pages['ns'])
+                                yield Page.fromNormalizedTitle(self, pages['title'], pages['ns'])
                         if count >= limit:
                             break
 
@@ -8052,7 +8153,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                 offset = 0
                 while True:
                     path = self.linksearch_address(url, limit=limit, offset=offset)
-                    get_throttle()
+                    get_throttle(site=self)
                     html = self.getUrl(path)
                     #restricting the HTML source :
                     #when in the source, this div marks the beginning of the input
@@ -8636,6 +8737,14 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         """Given a namespace name, return its int index, or None if invalid."""
         return self.family.getNamespaceIndex(self.lang, namespace)
 
+    def _cacheTitle(self, title, parsed):
+        """Remember how the Page title was parsed, see Page.__init__()."""
+        if len(self._parsedTitles) >= config.page_title_cache_size:
+            # forgetting all titles at once is cheaper than keeping
+            # track of the least recently used ones
+            self._parsedTitles.clear()
+        self._parsedTitles[title] = parsed
+
     def language(self):
         """Return Site's language code."""
         return self.lang
@@ -8740,7 +8849,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             u'text'   : string,
         }
 
-        pywikibot.get_throttle()
+        pywikibot.get_throttle(site=self)
         pywikibot.output(u"Parsing string through the wiki parser via API.")
 
         result = query.GetData(params, self)
@@ -8773,7 +8882,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             u'text'   : string,
         }
 
-        pywikibot.get_throttle()
+        pywikibot.get_throttle(site=self)
         pywikibot.output(u"Expanding string through the wiki parser via API.")
 
         result = query.GetData(params, self)
@@ -8810,6 +8919,29 @@ def setSite(site):
     default_code = site.language()
     default_family = site.family
 
+_pageContentStore = None
+_pageContentStoreLock = threading.Lock()
+
+
+def pageContentStore():
+    """Return the store for the text of all pages, or None if it is disabled.
+
+    The store is used if config.page_contents_memory is set; it keeps as
+    many characters in memory and spills the remaining texts to disk.
+
+    """
+    global _pageContentStore
+    if _pageContentStore is None and config.page_contents_memory is not None:
+        _pageContentStoreLock.acquire()
+        try:
+            if _pageContentStore is None:
+                import pagestore
+                _pageContentStore = pagestore.PageContentStore(
+                    config.page_contents_memory)
+        finally:
+            _pageContentStoreLock.release()
+    return _pageContentStore
+
 # Command line parsing and help
 
 def calledModuleName():
@@ -9138,6 +9270,9 @@ def setLogfileStatus(enabled, logname=None, header=False):
                     )
         fh.setFormatter(formatter)
         #ch.setFormatter(formatter)
+        if config.logasync:
+            # write the logfile in a background thread
+            fh = AsyncLogHandler(fh)
         # add the handlers to logger
         logger.addHandler(fh)           # output to logfile
         #logger.addHandler(ch)           # output to terminal/shell console
@@ -9149,6 +9284,100 @@ def setLogfileStatus(enabled, logname=None, header=False):
 
     logger.propagate = enabled
 
+class AsyncLogHandler(logging.Handler):
+    """
+    Log handler which passes the records on to another handler in a
+    background thread, so that the bot does not wait for the logfile to be
+    written. The records are buffered and written in batches, at least
+    every interval seconds. If maxsize records are buffered, logging waits
+    until the background thread has written them.
+
+    """
+    def __init__(self, target, interval=1, maxsize=10000):
+        logging.Handler.__init__(self, target.level)
+        self.target = target
+        self.interval = interval
+        self.maxsize = maxsize
+        self.buffer = deque()
+        self.wakeup = threading.Event()
+        # notified when the buffer has been written
+        self.written = threading.Condition()
+        self.closing = False
+        self.thread = threading.Thread(target=self._write)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def handle(self, record):
+        # appending to the buffer is thread-safe, no lock needed
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        try:
+            # format the message now, its arguments may change meanwhile
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                # this also keeps the traceback as record.exc_text
+                self.target.format(record)
+                record.exc_info = None
+            if len(self.buffer) >= self.maxsize:
+                # the logfile is written slower than the bot logs
+                self.wakeup.set()
+                self.written.acquire()
+                try:
+                    while len(self.buffer) >= self.maxsize \
+                          and self.thread.isAlive():
+                        self.written.wait(1)
+                finally:
+                    self.written.release()
+            self.buffer.append(record)
+        except Exception:
+            self.handleError(record)
+
+    def _write(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            closing = self.closing
+            while self.buffer:
+                record = self.buffer.popleft()
+                if isinstance(record, logging.LogRecord):
+                    self.target.handle(record)
+                else:
+                    # the Event of a flush() waiting for the records before
+                    self.target.flush()
+                    record.set()
+            self.target.flush()
+            self.written.acquire()
+            try:
+                self.written.notifyAll()
+            finally:
+                self.written.release()
+            if closing:
+                return
+
+    def flush(self):
+        """Wait until the buffered records have been written."""
+        done = threading.Event()
+        self.buffer.append(done)
+        self.wakeup.set()
+        # the thread only ends when the handler is closed
+        while not done.isSet() and self.thread.isAlive():
+            done.wait(1)
+        if not done.isSet():
+            self.target.flush()
+
+    def close(self):
+        if self.thread.isAlive():
+            self.closing = True
+            self.wakeup.set()
+            self.thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+
 def init_handlers(strm=None):#, logname=None, header=False):
     """Initialize logging system for terminal-based bots.
 
@@ -9286,22 +9515,37 @@ if hasattr(sys, '_getframe'):
 
 # done filching
 
+# the loggers used by logoutput(), by layer
+_loggers = {}
+
 def logoutput(text, decoder=None, newline=True, _level=INFO, _logger="",
-              **kwargs):
+              args=None, **kwargs):
     """Format output and send to the logging module.
 
     Backend function used by all the user-output convenience functions.
 
+    If args is given, text is a format string which is only formatted with
+    args (text % args) when the message is output, so that messages of a
+    disabled level cost hardly anything.
+
     """
-    if _logger:
-        log = logging.getLogger("pywiki." + _logger)
-    else:
-        log = logging.getLogger("pywiki")
+    try:
+        log = _loggers[_logger]
+    except KeyError:
+        if _logger:
+            log = logging.getLogger("pywiki." + _logger)
+        else:
+            log = logging.getLogger("pywiki")
+        _loggers[_logger] = log
 
     # make sure logging system has been initialized
     if not logger:
         init_handlers()
 
+    # neither logged nor displayed
+    if not log.isEnabledFor(_level):
+        return
+
     frame = currentframe()
     module = os.path.basename(frame.f_code.co_filename)
     context = {'caller_name': frame.f_code.co_name,
@@ -9322,14 +9566,15 @@ def logoutput(text, decoder=None, newline=True, _level=INFO, _logger="",
                 text = unicode(text, 'utf-8')
             except UnicodeDecodeError:
                 text = unicode(text, 'iso8859-1')
+    if args is not None:
+        text = text % args
 
     log.log(_level, text, extra=context, **kwargs)
 
     # instead of logging handler for output to console (StreamHandler)
     if _level <> INFO:
         text = u'%s: %s' % (logging.getLevelName(_level), text)
-    if log.isEnabledFor(_level):
-        _outputOld(text, decoder, newline, (_level == STDOUT), **kwargs)
+    _outputOld(text, decoder, newline, (_level == STDOUT), **kwargs)
 
 def _outputOld(text, decoder=None, newline=True, toStdout=False, **kwargs):
     """Output a message to the user via the userinterface.
@@ -9399,6 +9644,10 @@ def output(text, decoder=None, newline=True, toStdout=False, **kwargs):
     consist of the escape character \03 and the color name in curly braces,
     e. g. \03{lightpurple}. \03{default} resets the color.
 
+    If the keyword argument args is given, text is formatted with it
+    (text % args) only when the message is really output, e.g.
+    debug(u'%d pages loaded', 'query', args=(len(pages),)).
+
     Other keyword arguments are passed unchanged to the logger; so far, the
     only argument that is useful is "exc_info=True", which causes the
     log message to include an exception traceback.
@@ -9537,45 +9786,117 @@ def inputChoice(question, answers, hotkeys, default = None):
     return data
 
 
-page_put_queue = Queue.Queue(config.max_queue_size)
-def async_put():
-    """Daemon; take pages from the queue and try to save them on the wiki."""
+_put_queues = {}    # one queue of pages to save per site
+_put_lock = threading.Lock()
+_put_slots = threading.BoundedSemaphore(max(1, config.put_threads))
+
+def _put_queue(site):
+    """Return the put queue of site, starting its thread if needed."""
+    _put_lock.acquire()
+    try:
+        if site in _put_queues:
+            queue, thread = _put_queues[site]
+            if thread.isAlive():
+                return queue
+        else:
+            queue = Queue.Queue(config.max_queue_size)
+        thread = threading.Thread(target=async_put, args=(queue,))
+        # identification for debugging purposes
+        thread.setName('Put-Thread-%s' % site)
+        thread.setDaemon(True)
+        thread.start()
+        _put_queues[site] = (queue, thread)
+        return queue
+    finally:
+        _put_lock.release()
+
+def async_put(queue):
+    """Daemon; take pages from the queue and try to save them on the wiki.
+
+    Every site has its own queue and thread, so saves to different wikis
+    do not wait for each other; at most config.put_threads pages are saved
+    at the same time.
+
+    """
     while True:
         (page, newtext, comment, watchArticle,
-                 minorEdit, force, callback) = page_put_queue.get()
-        if page is None:
-            # an explicit end-of-Queue marker is needed for compatibility
-            # with Python 2.4; in 2.5, we could use the Queue's task_done()
-            # and join() methods
-            return
+                 minorEdit, force, callback) = queue.get()
+        _put_slots.acquire()
         try:
-            page.put(newtext, comment, watchArticle, minorEdit, force)
-            error = None
-        except Exception, error:
-            pass
-        if callback is not None:
-            callback(page, error)
-            # if callback is provided, it is responsible for exception handling
-            continue
-        if isinstance(error, SpamfilterError):
-            output(u"Saving page %s prevented by spam filter: %s"
-                   % (page, error.url))
-        elif isinstance(error, PageNotSaved):
-            output(u"Saving page %s failed: %s" % (page, error))
-        elif isinstance(error, LockedPage):
-            output(u"Page %s is locked; not saved." % page)
-        elif isinstance(error, NoUsername):
-            output(u"Page %s not saved; sysop privileges required." % page)
-        elif error is not None:
-            exception(error, tb=True)
-            output(u"Saving page %s failed!" % page)
-
-_putthread = threading.Thread(target=async_put)
-# identification for debugging purposes
-_putthread.setName('Put-Thread')
-_putthread.setDaemon(True)
-## Don't start the queue if it is not necessary.
-#_putthread.start()
+            try:
+                page.put(newtext, comment, watchArticle, minorEdit, force)
+                error = None
+            except Exception, error:
+                pass
+        finally:
+            _put_slots.release()
+        try:
+            if callback is not None:
+                callback(page, error)
+                # if callback is provided, it is responsible for exception
+                # handling
+                continue
+            if isinstance(error, SpamfilterError):
+                output(u"Saving page %s prevented by spam filter: %s"
+                       % (page, error.url))
+            elif isinstance(error, PageNotSaved):
+                output(u"Saving page %s failed: %s" % (page, error))
+            elif isinstance(error, LockedPage):
+                output(u"Page %s is locked; not saved." % page)
+            elif isinstance(error, NoUsername):
+                output(u"Page %s not saved; sysop privileges required."
+                       % page)
+            elif error is not None:
+                exception(error, tb=True)
+                output(u"Saving page %s failed!" % page)
+        finally:
+            queue.task_done()
+
+class _PagePutQueue(object):
+    """Stand-in for the former single queue of put_async().
+
+    The pages are queued per site now, and the former thread working off
+    the queue (_putthread) is gone. Pages put here go to the queue of their
+    site; qsize() is the number of pages waiting on all sites.
+
+    """
+    def put(self, item, block=True, timeout=None):
+        if item[0] is None:
+            # the former end-of-queue marker, _flush() waits by itself
+            return
+        _put_queue(item[0].site()).put(item, block, timeout)
+
+    def qsize(self):
+        return sum([pending for site, pending, seconds
+                    in put_queue_status()])
+
+    def empty(self):
+        return not self.qsize()
+
+page_put_queue = _PagePutQueue()
+
+def put_queue_status():
+    """Return the pages waiting to be saved by put_async().
+
+    The result is a list of (site, number of pages, seconds) tuples, where
+    seconds is the estimated time until the queue of site is done. As the
+    sites are saved to in parallel, the longest of these times is the time
+    remaining for all.
+
+    """
+    _put_lock.acquire()
+    try:
+        queues = [(site, queue) for site, (queue, thread)
+                  in _put_queues.iteritems() if thread.isAlive()]
+    finally:
+        _put_lock.release()
+    status = []
+    for site, queue in queues:
+        pending = queue.unfinished_tasks
+        if pending:
+            status.append((site, pending,
+                           pending * put_throttle.getDelay(True, site=site)))
+    return status
 
 def stopme():
     """This should be run when a bot does not interact with the Wiki, or
@@ -9593,21 +9914,20 @@ def _flush():
     """
     def remaining():
         import datetime
-        remainingPages = page_put_queue.qsize() - 1
-            # -1 because we added a None element to stop the queue
+        status = put_queue_status()
+        remainingPages = sum([pending for site, pending, seconds in status])
         remainingSeconds = datetime.timedelta(
-            seconds=(remainingPages * put_throttle.getDelay(True)))
+            seconds=int(max([0] + [seconds for site, pending, seconds
+                                   in status])))
         return (remainingPages, remainingSeconds)
 
-    page_put_queue.put((None, None, None, None, None, None, None))
-
-    if page_put_queue.qsize() > 1:
+    if remaining()[0]:
         output(u'Waiting for %i pages to be put. Estimated time remaining: %s'
                % remaining())
 
-    while(_putthread.isAlive()):
+    while remaining()[0]:
         try:
-            _putthread.join(1)
+            time.sleep(1)
         except KeyboardInterrupt:
             answer = inputChoice(u"""\
 There are %i pages remaining in the queue. Estimated time remaining: %s
@@ -9627,6 +9947,8 @@ Really exit?"""
                     site._mediawiki_messages.delete()
                 except OSError:
                     pass
+    if _pageContentStore is not None:
+        _pageContentStore.close()
 
 import atexit
 atexit.register(_flush)
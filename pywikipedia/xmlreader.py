@@ -14,6 +14,10 @@ For fastest processing, XmlDump uses the cElementTree library if available
 (this comes included with Python 2.5, and can be downloaded from
 http://www.effbot.org/ for earlier versions). If not found, it falls back
 to the older method using regular expressions.
+
+XmlDump.parallel_parse() spreads the parsing of large dumps over several
+processes. After XmlDump.build_index(), single pages can be read with
+XmlDump.get() and reading can start at any page with XmlDump.seek().
 """
 #
 # (C) Pywikipedia bot team, 2005-2012
@@ -264,6 +268,176 @@ class XmlParserThread(threading.Thread):
         xml.sax.parse(self.filename, self.handler)
 
 
+class XmlDumpIndex(object):
+    """
+    On-disk index of the pages of an XML dump.
+
+    For every page it stores the title, the page id and the offset where
+    reading has to start to find the page: for an uncompressed dump the
+    offset of its <page> tag, for a bz2 dump the offset of the bz2 stream
+    containing it. Dumps offered as 'multistream' hold 100 pages per
+    stream, so a page can be reached without decompressing the dump up to
+    it. An ordinary bz2 dump is a single stream: every offset is 0 then, and
+    a page is only found by decompressing the dump from its start.
+
+    The index is an sqlite database, so lookups by title or page id take
+    logarithmic time and no memory for the index itself.
+    """
+
+    Rpage = re.compile('<page>\s*<title>([^<]*)</title>\s*'
+                       '(?:<ns>[^<]*</ns>\s*)?<id>(\d+)</id>')
+
+    def __init__(self, filename):
+        import sqlite3
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = unicode
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                        'title TEXT PRIMARY KEY, id INTEGER, offset INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS pages_id ON pages (id)')
+        # holds the row ('complete', '1') once the index has been built
+        self.db.execute('CREATE TABLE IF NOT EXISTS info ('
+                        'name TEXT PRIMARY KEY, value TEXT)')
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def add(self, entries):
+        """Store an iterable of (offset, pageid, title) tuples."""
+        self.db.executemany('INSERT OR REPLACE INTO pages (offset, id, title) '
+                            'VALUES (?, ?, ?)', entries)
+        self.db.commit()
+
+    def is_complete(self):
+        """Return True if building or loading the index has finished."""
+        return self.db.execute('SELECT value FROM info '
+                               'WHERE name = ?', ('complete',)).fetchone() \
+               is not None
+
+    def _set_complete(self, complete):
+        if complete:
+            self.db.execute('INSERT OR REPLACE INTO info (name, value) '
+                            'VALUES (?, ?)', ('complete', '1'))
+        else:
+            self.db.execute('DELETE FROM info WHERE name = ?', ('complete',))
+        self.db.commit()
+
+    def build(self, dumpfilename):
+        """Index the pages of an uncompressed or bz2 compressed dump."""
+        if dumpfilename.endswith('.gz') or dumpfilename.endswith('.7z'):
+            raise pywikibot.Error(u'%s cannot be read from the middle, use '
+                                  u'an uncompressed or bz2 dump.'
+                                  % dumpfilename)
+        self._set_complete(False)
+        if dumpfilename.endswith('.bz2'):
+            self.add(self._scan_bz2(dumpfilename))
+            if self.db.execute('SELECT COUNT(DISTINCT offset) '
+                               'FROM pages').fetchone()[0] == 1:
+                pywikibot.warning(u'%s is a single bz2 stream, every page '
+                                  u'is read from the start of the dump.'
+                                  % dumpfilename)
+        else:
+            self.add(self._scan_xml(dumpfilename))
+        self._set_complete(True)
+
+    def load(self, indexfilename):
+        """
+        Import the index offered together with multistream dumps, whose
+        lines are 'offset:pageid:title'.
+        """
+        if indexfilename.endswith('.bz2'):
+            import bz2
+            source = bz2.BZ2File(indexfilename)
+        else:
+            source = open(indexfilename)
+
+        def entries():
+            for line in source:
+                offset, pageid, title = line.rstrip('\n').split(':', 2)
+                yield int(offset), int(pageid), title.decode('utf-8')
+        self._set_complete(False)
+        try:
+            self.add(entries())
+        finally:
+            source.close()
+        self._set_complete(True)
+
+    def find(self, title=None, pageid=None):
+        """Return (offset, pageid, title) of the page or None if unknown."""
+        if title is not None:
+            return self.db.execute('SELECT offset, id, title FROM pages '
+                                   'WHERE title = ?',
+                                   (title.replace(u'_', u' '),)).fetchone()
+        return self.db.execute('SELECT offset, id, title FROM pages '
+                               'WHERE id = ?', (int(pageid),)).fetchone()
+
+    def _pages(self, data):
+        """
+        Return the (position, pageid, title) of the pages whose header is
+        in data and the part of data which has to be kept for the next
+        call.
+        """
+        from xml.sax.saxutils import unescape
+        pages = []
+        end = 0
+        for m in self.Rpage.finditer(data):
+            title = unescape(m.group(1), {'&quot;': '"'}).decode('utf-8')
+            pages.append((m.start(), int(m.group(2)), title))
+            end = m.end()
+        start = data.rfind('<page>', end)
+        if start < 0 or len(data) - start > 1024 * 1024:
+            start = max(end, len(data) - len('<page>'))
+        return pages, start
+
+    def _scan_xml(self, dumpfilename):
+        source = open(dumpfilename, 'rb')
+        data = ''
+        base = 0    # offset of data in the file
+        while True:
+            block = source.read(1024 * 1024)
+            if not block:
+                break
+            data += block
+            pages, keep = self._pages(data)
+            for position, pageid, title in pages:
+                yield base + position, pageid, title
+            base += keep
+            data = data[keep:]
+
+    def _scan_bz2(self, dumpfilename):
+        import bz2
+        source = open(dumpfilename, 'rb')
+        decompressor = bz2.BZ2Decompressor()
+        data = ''
+        stream = 0      # offset of the current stream
+        position = 0    # offset of block
+        block = ''
+        while True:
+            if not block:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+            try:
+                data += decompressor.decompress(block)
+            except EOFError:
+                # the stream ended exactly at the end of the previous block
+                decompressor = bz2.BZ2Decompressor()
+                stream = position
+                data = ''
+                continue
+            pages, keep = self._pages(data)
+            for x, pageid, title in pages:
+                yield stream, pageid, title
+            data = data[keep:]
+            unused = decompressor.unused_data
+            position += len(block) - len(unused)
+            block = unused
+            if unused:
+                decompressor = bz2.BZ2Decompressor()
+                stream = position
+                data = ''
+
+
 class XmlDump(object):
     """
     Represents an XML dump file. Reads the local file at initialization,
@@ -280,6 +454,8 @@ class XmlDump(object):
     """
     def __init__(self, filename, allrevisions=False):
         self.filename = filename
+        self.allrevisions = allrevisions
+        self._index = None
         if allrevisions:
             self._parse = self._parse_all
         else:
@@ -298,6 +474,90 @@ Consider installing the python-celementtree package.''')
 
     def new_parse(self):
         """Generator using cElementTree iterparse function"""
+        return self._parse_source(self._open())
+
+    def parallel_parse(self, processes=None, filter=None, ordered=True,
+                       chunksize=4 * 1024 * 1024):
+        """
+        Generator using several processes to parse the dump.
+
+        One process decompresses the dump and splits it into chunks of
+        whole pages, the worker processes parse these chunks with
+        cElementTree and send the XmlEntry objects back.
+
+        @param processes: number of worker processes; defaults to the
+            number of CPUs.
+        @param filter: function which is called with every XmlEntry in the
+            worker processes; only entries for which it returns True are
+            yielded. It has to be defined at module level so that it can
+            be sent to the workers.
+        @param ordered: if True, entries are yielded in the order of the
+            dump, otherwise in the order the chunks are done.
+        @param chunksize: approximate size of a chunk in bytes of XML.
+        """
+        import multiprocessing
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        tasks = multiprocessing.Queue(processes * 2)
+        results = multiprocessing.Queue(processes * 2)
+        # at most that many chunks are split off and not yielded yet, so
+        # the chunks done before the ones preceding them can't pile up
+        credits = multiprocessing.Semaphore(processes * 4)
+        splitter = multiprocessing.Process(
+            target=_split_dump,
+            args=(self.filename, tasks, results, processes, chunksize,
+                  credits))
+        workers = [multiprocessing.Process(target=_parse_chunks,
+                                           args=(self.allrevisions, filter,
+                                                 tasks, results))
+                   for i in range(processes)]
+        for process in [splitter] + workers:
+            process.daemon = True
+            process.start()
+
+        try:
+            running = processes
+            done = {}           # chunks done before the ones preceding them
+            wanted = 0
+            while running:
+                number, entries = results.get()
+                if number is None:
+                    if entries is not None:
+                        raise RuntimeError(u'Error parsing %s:\n%s'
+                                           % (self.filename, entries))
+                    running -= 1
+                    continue
+                if not ordered:
+                    credits.release()
+                    for entry in entries:
+                        yield entry
+                    continue
+                done[number] = entries
+                while wanted in done:
+                    credits.release()
+                    for entry in done.pop(wanted):
+                        yield entry
+                    wanted += 1
+        finally:
+            for process in [splitter] + workers:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    def _open(self, offset=0):
+        """
+        Return the dump as file object, decompressing it if needed.
+
+        If offset is given, reading starts there, after the root element
+        of the dump. For bz2 dumps, offset must be the start of a stream.
+        """
+        if offset:
+            if self.filename.endswith('.bz2'):
+                source = _MultiStreamBZ2File(self.filename, offset)
+            else:
+                source = open(self.filename)
+                source.seek(offset)
+            return _PrefixedFile(self._root(), source)
         if self.filename.endswith('.bz2'):
             import bz2
             source = bz2.BZ2File(self.filename)
@@ -314,6 +574,89 @@ Consider installing the python-celementtree package.''')
         else:
             # assume it's an uncompressed XML file
             source = open(self.filename)
+        return source
+
+    def _root(self):
+        """Return the start tag of the root element of the dump"""
+        source = self._open()
+        try:
+            return _read_header(source)[0]
+        finally:
+            source.close()
+
+    def build_index(self, multistreamindex=None):
+        """
+        Build the index used by seek() and get().
+
+        Only uncompressed and multistream bz2 dumps can be read from the
+        middle. An ordinary bz2 dump is indexed, too, but seek() and get()
+        decompress it from the start.
+
+        @param multistreamindex: the index file offered together with a
+            multistream dump; if given, it is imported instead of reading
+            the dump.
+        """
+        if multistreamindex:
+            self.index.load(multistreamindex)
+        else:
+            self.index.build(self.filename)
+
+    @property
+    def index(self):
+        """The XmlDumpIndex of this dump, stored in <filename>.idx"""
+        if self._index is None:
+            self._index = XmlDumpIndex(self.filename + '.idx')
+        return self._index
+
+    def has_index(self):
+        """Return True if the index of this dump has been built completely."""
+        import os
+        if self._index is None and not os.path.exists(self.filename + '.idx'):
+            return False
+        return self.index.is_complete()
+
+    def seek(self, title=None, pageid=None):
+        """
+        Return a generator of the XmlEntry objects starting with the given
+        page, which is looked up in the index.
+
+        Raises KeyError if the page is not in the index.
+        """
+        found = self.index.find(title, pageid)
+        if found is None:
+            raise KeyError(title or pageid)
+        return self._seek(*found)
+
+    def _seek(self, offset, pageid, title):
+        entries = self._parse_source(self._open(offset))
+        for entry in entries:
+            # a bz2 stream may start with other pages
+            if entry.title == title:
+                yield entry
+                break
+        for entry in entries:
+            yield entry
+
+    def get(self, title=None, pageid=None):
+        """
+        Return the XmlEntry of a page, or None if it is not in the index.
+
+        With allrevisions, the entry of the last revision in the dump is
+        returned.
+        """
+        result = None
+        try:
+            for entry in self.seek(title, pageid):
+                if not self.allrevisions:
+                    return entry
+                if result is not None and entry.title != result.title:
+                    break
+                result = entry
+        except KeyError:
+            pass
+        return result
+
+    def _parse_source(self, source):
         context = iterparse(source, events=("start", "end", "start-ns"))
         self.root = None
 
@@ -449,3 +792,134 @@ Consider installing the python-celementtree package.''')
                                    moveRestriction=moveRestriction,
                                    revisionid=m.group('revisionid')
                                   )
+
+
+def _split_dump(filename, tasks, results, processes, chunksize, credits):
+    """
+    Read the dump and put chunks of whole pages into the tasks queue.
+
+    Every chunk is a tuple of its number and a complete XML document made
+    of the root element of the dump and the pages. A chunk is only put
+    after acquiring the credits semaphore, which is released when the
+    entries of a chunk are yielded. At the end, a None is put for every
+    worker process. An exception is reported in the results queue as
+    (None, traceback).
+    """
+    import traceback
+    try:
+        source = XmlDump(filename)._open()
+        root, data = _read_header(source)
+        if root:
+            number = 0
+            while True:
+                block = source.read(chunksize)
+                data += block
+                end = data.rfind('</page>')
+                if end >= 0 and (len(data) >= chunksize or not block):
+                    end += len('</page>')
+                    credits.acquire()
+                    tasks.put((number,
+                               '%s%s</mediawiki>' % (root, data[:end])))
+                    number += 1
+                    data = data[end:]
+                if not block:
+                    break
+    except Exception:
+        results.put((None, traceback.format_exc()))
+        return
+    for i in range(processes):
+        tasks.put(None)
+
+
+def _parse_chunks(allrevisions, filter, tasks, results):
+    """
+    Parse the chunks from the tasks queue and put the lists of XmlEntry
+    objects into the results queue, together with the number of the chunk.
+
+    When all chunks are done, (None, None) is put; an exception is reported
+    as (None, traceback).
+    """
+    from cStringIO import StringIO
+    import traceback
+    dump = XmlDump(None, allrevisions)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            number, chunk = task
+            entries = [entry for entry in dump._parse_source(StringIO(chunk))
+                       if filter is None or filter(entry)]
+            results.put((number, entries))
+    except Exception:
+        results.put((None, traceback.format_exc()))
+    else:
+        results.put((None, None))
+
+
+def _read_header(source):
+    """
+    Read the dump up to the first page.
+
+    Return the start tag of the root element (None if there is none) and
+    the data read from the first <page> tag on.
+    """
+    data = ''
+    while '<page>' not in data:
+        block = source.read(1024 * 1024)
+        if not block:
+            break
+        data += block
+    root = re.search('<mediawiki[^>]*>', data)
+    if root:
+        root = root.group()
+    start = data.find('<page>')
+    if start < 0:
+        return root, ''
+    return root, data[start:]
+
+
+class _PrefixedFile(object):
+    """File object which reads prefix first, then source."""
+
+    def __init__(self, prefix, source):
+        self.prefix = prefix
+        self.source = source
+
+    def read(self, size=-1):
+        if self.prefix:
+            data, self.prefix = self.prefix, ''
+            return data
+        return self.source.read(size)
+
+
+class _MultiStreamBZ2File(object):
+    """
+    File object decompressing a file of several bz2 streams, starting
+    with the stream at offset.
+    """
+
+    def __init__(self, filename, offset=0):
+        import bz2
+        self.source = open(filename, 'rb')
+        self.source.seek(offset)
+        self.decompressor = bz2.BZ2Decompressor()
+        self.block = ''
+
+    def read(self, size=-1):
+        import bz2
+        while True:
+            if not self.block:
+                self.block = self.source.read(1024 * 1024)
+                if not self.block:
+                    return ''
+            try:
+                data = self.decompressor.decompress(self.block)
+            except EOFError:
+                self.decompressor = bz2.BZ2Decompressor()
+                continue
+            self.block = self.decompressor.unused_data
+            if self.block:
+                self.decompressor = bz2.BZ2Decompressor()
+            if data:
+                return data